@@ -1,219 +1,551 @@
 # mas.py
-import openai
-from config import OPENAI_API_KEY, OPENAI_BASE_URL, MODEL_NAME
-from utils import run_graphrag_query, generate_question_and_answer_with_agent, append_to_files
-from swarm import Swarm, Agent
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import (MODEL_NAME, MAX_CONCURRENT_SAMPLES, ORDERED_OUTPUT, REORDER_BUFFER_SIZE, RECORDS_OUTPUT,
+                    CHECKPOINT_PATH, TRACE_PATH, MAX_VERIFIER_ROUNDS, MAX_LOCAL_REPAIRS, VERIFIER_TOKEN_BUDGET, KEEP_UNVERIFIED_TRIPLES, STRUCTURED_OUTPUT,
+                    REUSE_DUPLICATE_QA, CHUNK_CONCURRENCY, PIPELINE_MODE, PIPELINE_STAGES, STAGE_WORKERS,
+                    STAGE_QUEUE_SIZE, DEDUP_SCOPE)
+from utils import translate_query, search_graphrag, generate_questions_and_answers, count_rows, iter_contexts
+from writers import clear_records, create_writer, finalize_outputs
+from cache import get_response_cache
+from checkpoint import CheckpointJournal
+from validation import validate_triples
+from triples import Triple, parse_triples, triples_from_json
+from llm import create_backend, run_agent
+from structured_output import run_structured_agent, TRIPLES_SCHEMA, ENTITIES_SCHEMA, EXTRACTION_SCHEMA
+from scheduler import bounded_map, estimate_tokens
+from tracing import span, current_span, begin_span, end_span, use_span, start_trace, stop_trace, print_report
+from stages import Stage, StagedExecutor, print_metrics
+from shards import Shard, in_shard
+from graph_store import get_graph_store
+from dedup import collapse_triples
+from chunking import chunk_text, merge_triples, build_index, supporting_context
 import random
 
-# Initialize OpenAI client
-openai.api_key = OPENAI_API_KEY
-openai.base_url = OPENAI_BASE_URL
-
-# Initialize Swarm client
-client = Swarm(openai)
+PIPELINE_MODES = ("legacy", "feed", "fused")
+FUSED_PROMPT = (
+    "First extract all important entities related to industry, production, and management from the text above "
+    "and list them under 'Entities:', one per line. "
+    "Then generate the knowledge graph triples between these entities under 'Triples:', "
+    "one per line in the format (Entity1, Relation, Entity2)."
+)
+FUSED_STRUCTURED_PROMPT = (
+    "First extract all important entities related to industry, production, and management from the text above, "
+    "then generate the knowledge graph triples between these entities."
+)
 
 # Define agents for different tasks
 class Agents:
-    entity_extractor = Agent(
-        name="Entity Extractor",
-        model=MODEL_NAME,
-        instructions=(
-            "You are an industrial information extraction expert. "
-            "Your task is to extract all important entities related to industry, production, and management from the given text. "
-            "Please return these entities as a list, each on a new line. "
-            #"Please answer in English. "
-            "Let's think step by step."
-        ),
-    )
-
-    relation_extractor = Agent(
-        name="Relation Extractor",
-        model=MODEL_NAME,
-        instructions=(
-            "You are an industrial relationship analysis expert. "
-            "Your task is to extract relationships between entities related to industry, production, and management based on the provided entity list and original text. "
-            "Please return these relationships in the format: Entity1 Relation Entity2. "
-            "For example: 'CompanyA manufactures ProductB'. "
-            #"Please answer in English. "
-            "Let's think step by step."
-        ),
-    )
-
-    knowledge_graph_master = Agent(
-        name="Knowledge Graph Master",
-        model=MODEL_NAME,
-        instructions=(
-            "You are a knowledge graph construction expert. "
-            "Your task is to generate triples for the knowledge graph based on the provided entity list and relationship list. "
-            "Please return these triples in the format: (Entity1, Relation, Entity2). "
-            "For example: '(Partial oxidation, facilitates, Oxygen)'. "
-            "Each triple should be on a new line. "
-            "Ensure that there are no extra spaces or characters around the commas and parentheses. "
-            "Let's think step by step."
-        ),
-    )
-
-    knowledge_graph_verifier = Agent(
-        name="Knowledge Graph Verifier",
-        model=MODEL_NAME,
-        instructions=(
-            "You are a knowledge graph validation expert. "
-            "Your task is to validate the generated knowledge graph triples to ensure they are consistent with the user's original input and logically correct. "
-            "If the validation passes, please return 'This is a loyal fact.' "
-            "If the validation fails, please specify the specific issues and request the Knowledge Relation Distiller to regenerate them accordingly. "
-            #"Please answer in English. "
-            "Let's think step by step."
-        ),
-    )
-
-    knowledge_relation_distiller = Agent(
-        name="Knowledge Relation Distiller",
-        model=MODEL_NAME,
-        instructions=(
-            "You are a question-answer generation expert. "
-            "Your task is to generate a question and an answer based on the provided knowledge graph triple and context. "
-            "The question should be in the form: 'According to the context, what is the relationship between Entity1 and Entity2?' "
-            "The answer should include the relationship between Entity1 and Entity2 and reference the context. "
-            #"Please answer in English. "
-            "Let's think step by step."
-        ),
-    )
-
-
-def process_message(message: str) -> Tuple[List[str], Optional[str], Optional[str]]:
-    """Process the user input message and generate knowledge graph triples."""
-    print(f"User Input: {message}\n")
-
-    output, translated_query = run_graphrag_query(message, openai)
-    if output is None or translated_query is None:
-        print("Skipping this sample due to error in run_graphrag_query.")
-        return None, None, None
-
-    print(f"Data Read: {output}\n")
+    """The agents of the pipeline, built by the PipelineContext on first use."""
 
-    # Randomly choose between Entity Extractor and Relation Extractor
-    chosen_agent = random.choice([Agents.entity_extractor, Agents.relation_extractor])
-    print(f"Randomly chosen agent: {chosen_agent.name}")
+    def __init__(self, Agent):
+        self.entity_extractor = Agent(
+            name="Entity Extractor",
+            model=MODEL_NAME,
+            instructions=(
+                "You are an industrial information extraction expert. "
+                "Your task is to extract all important entities related to industry, production, and management from the given text. "
+                "Please return these entities as a list, each on a new line. "
+                #"Please answer in English. "
+                "Let's think step by step."
+            ),
+        )
 
-    # Extract entities or relations based on the chosen agent
-    if chosen_agent == Agents.entity_extractor:
-        response = client.run(
-            agent=chosen_agent,
-            messages=[{"role": "user", "content": output}],
+        self.relation_extractor = Agent(
+            name="Relation Extractor",
+            model=MODEL_NAME,
+            instructions=(
+                "You are an industrial relationship analysis expert. "
+                "Your task is to extract relationships between entities related to industry, production, and management based on the provided entity list and original text. "
+                "Please return these relationships in the format: Entity1 Relation Entity2. "
+                "For example: 'CompanyA manufactures ProductB'. "
+                #"Please answer in English. "
+                "Let's think step by step."
+            ),
         )
-        entities = response.messages[-1]["content"].splitlines()
-        print(f"Entity Extractor: \n{'\n'.join(entities)}\n")
-    else:
-        response = client.run(
-            agent=chosen_agent,
-            messages=[{"role": "user", "content": output}],
+
+        self.knowledge_graph_master = Agent(
+            name="Knowledge Graph Master",
+            model=MODEL_NAME,
+            instructions=(
+                "You are a knowledge graph construction expert. "
+                "Your task is to generate triples for the knowledge graph based on the provided entity list and relationship list. "
+                "Please return these triples in the format: (Entity1, Relation, Entity2). "
+                "For example: '(Partial oxidation, facilitates, Oxygen)'. "
+                "Each triple should be on a new line. "
+                "Ensure that there are no extra spaces or characters around the commas and parentheses. "
+                "Let's think step by step."
+            ),
         )
-        relations = response.messages[-1]["content"].splitlines()
-        print(f"Relation Extractor: \n{'\n'.join(relations)}\n")
-
-    # Generate knowledge graph triples
-    kg_master_response = client.run(
-        agent=Agents.knowledge_graph_master,
-        messages=[{"role": "user", "content": output}],
-    )
-    kg_triples_raw = kg_master_response.messages[-1]["content"].splitlines()
-    valid_triples = []
-
-    for triple in kg_triples_raw:
-        try:
-            triple = triple.strip()
-            if triple.endswith(')'):
-                triple = triple[:-1].strip()
-            entity1, relation, entity2 = triple.strip('()').split(', ')
-            valid_triples.append((entity1, relation, entity2))
-        except ValueError:
-            print(f"Invalid triple detected: {triple}. Requesting regeneration.")
-
-    kg_triples = [f"({entity1}, {relation}, {entity2})" for entity1, relation, entity2 in valid_triples]
-    print(f"Knowledge Graph Master: \n{'\n'.join(kg_triples)}\n")
-
-    # Validate knowledge graph triples
-    validation_response = client.run(
-        agent=Agents.knowledge_graph_verifier,
-        messages=[
-            {"role": "user", "content": f"User Original Input:\n{output}"},
-            {"role": "user", "content": f"Generated Knowledge Graph Triples:\n{'\n'.join(kg_triples)}"}
-        ],
-    )
-    validation_result = validation_response.messages[-1]["content"]
-    print(f"Knowledge Graph Verifier: {validation_result}\n")
-
-    # Regenerate triples if validation fails
-    while "This is a loyal fact." not in validation_result:
-        kg_triples = []
-        kg_master_response = client.run(
-            agent=Agents.knowledge_graph_master,
-            messages=[
-                {"role": "user", "content": f"User Original Input:\n{output}"},
-                {"role": "user", "content": f"Validation Result:\n{validation_result}"},
-                {"role": "user", "content": f"Previous Generated Knowledge Graph Triples:\n{'\n'.join(kg_triples)}"}
-            ],
+
+        self.knowledge_graph_verifier = Agent(
+            name="Knowledge Graph Verifier",
+            model=MODEL_NAME,
+            instructions=(
+                "You are a knowledge graph validation expert. "
+                "Your task is to validate the generated knowledge graph triples to ensure they are consistent with the user's original input and logically correct. "
+                "If the validation passes, please return 'This is a loyal fact.' "
+                "If the validation fails, please specify the specific issues and request the Knowledge Relation Distiller to regenerate them accordingly. "
+                #"Please answer in English. "
+                "Let's think step by step."
+            ),
         )
-        kg_triples_raw = kg_master_response.messages[-1]["content"].splitlines()
-        valid_triples = []
-
-        for triple in kg_triples_raw:
-            try:
-                triple = triple.strip()
-                if triple.endswith(')'):
-                    triple = triple[:-1].strip()
-                entity1, relation, entity2 = triple.strip('()').split(', ')
-                valid_triples.append((entity1, relation, entity2))
-            except ValueError:
-                print(f"Invalid triple detected: {triple}. Requesting regeneration.")
-
-        kg_triples = [f"({entity1}, {relation}, {entity2})" for entity1, relation, entity2 in valid_triples]
-        print(f"Knowledge Graph Master: \n{'\n'.join(kg_triples)}\n")
-
-        validation_response = client.run(
-            agent=Agents.knowledge_graph_verifier,
-            messages=[
-                {"role": "user", "content": f"User Original Input:\n{output}"},
-                {"role": "user", "content": f"Generated Knowledge Graph Triples:\n{'\n'.join(kg_triples)}"}
-            ],
+
+        self.knowledge_relation_distiller = Agent(
+            name="Knowledge Relation Distiller",
+            model=MODEL_NAME,
+            instructions=(
+                "You are a question-answer generation expert. "
+                "Your task is to generate a question and an answer based on the provided knowledge graph triple and context. "
+                "The question should be in the form: 'According to the context, what is the relationship between Entity1 and Entity2?' "
+                "The answer should include the relationship between Entity1 and Entity2 and reference the context. "
+                #"Please answer in English. "
+                "Let's think step by step."
+            ),
         )
-        validation_result = validation_response.messages[-1]["content"]
+
+
+class PipelineContext:
+    """The chat backend (LLM_BACKEND) and the agents shared by all samples.
+
+    Building it imports and configures the clients, so it is created on first
+    use by get_pipeline() rather than when this module is imported.
+    """
+
+    def __init__(self):
+        self.backend = create_backend()
+        self.agents = Agents(self.backend.agent_class)
+        self.pid = os.getpid()
+
+
+_pipeline: Optional[PipelineContext] = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline() -> PipelineContext:
+    """Return the pipeline context of this process, creating it on first use.
+
+    All threads of a process share one context; a forked worker process builds
+    its own instead of reusing the parent's client connections.
+    """
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None or _pipeline.pid != os.getpid():
+            _pipeline = PipelineContext()
+        return _pipeline
+
+
+class SampleJob:
+    """One sample passing through the pipeline stages, with the stage results recorded so far.
+
+    `state` holds stage results recorded by an earlier, interrupted run
+    ("translation", "graphrag", "triples", "verdict"); those stages are not run
+    again. `on_stage` is called with the name and result of each newly completed stage.
+    """
+
+    def __init__(self, index: Optional[int], context: str, state: Optional[Dict[str, Any]] = None,
+                 on_stage: Optional[Callable[[str, Any], None]] = None):
+        self.index = index
+        self.context = context
+        self.state = dict(state or {})
+        self.on_stage = on_stage
+        self.rows: Optional[List[Tuple[str, Triple, str, str, Dict, Dict]]] = None
+        self.span = None
+        self.start_time = time.time()
+
+    def complete(self, stage: str, value: Any):
+        self.state[stage] = value
+        if self.on_stage is not None:
+            self.on_stage(stage, value)
+
+
+def translate_stage(job: SampleJob) -> Optional[SampleJob]:
+    """Translate the sample's context to English."""
+    print(f"User Input: {job.context}\n")
+    if "translation" in job.state or "verdict" in job.state:
+        return job
+    with use_span(job.span), span("translate"):
+        translated_query = translate_query(job.context, get_pipeline().backend)
+    if translated_query is None:
+        print("Skipping this sample due to error in the translate stage.")
+        return None
+    job.complete("translation", translated_query)
+    return job
+
+
+def graphrag_stage(job: SampleJob) -> Optional[SampleJob]:
+    """Query GraphRAG with the translated context."""
+    if "graphrag" in job.state or "verdict" in job.state:
+        return job
+    with use_span(job.span), span("graphrag"):
+        output = search_graphrag(job.state["translation"])
+    if output is None:
+        print("Skipping this sample due to error in the graphrag stage.")
+        return None
+    job.complete("graphrag", output)
+    return job
+
+
+def extract_stage(job: SampleJob) -> Optional[SampleJob]:
+    """Generate the knowledge graph triples of the GraphRAG output."""
+    if "triples" in job.state or "verdict" in job.state:
+        return job
+    print(f"Data Read: {job.state['graphrag']}\n")
+    with use_span(job.span):
+        job.complete("triples", [triple.to_list() for triple in generate_triples(job.state["graphrag"])])
+    return job
+
+
+def verify_stage(job: SampleJob) -> Optional[SampleJob]:
+    """Validate the triples locally and with the Knowledge Graph Verifier."""
+    if "verdict" in job.state:
+        return job
+    with use_span(job.span):
+        kg_triples, validation_result = verify_triples(job.state["graphrag"],
+                                                       [Triple(*triple) for triple in job.state["triples"]])
+    job.complete("verdict", [[triple.to_list() for triple in kg_triples], validation_result])
+    return job
+
+
+def qa_stage(job: SampleJob) -> Optional[SampleJob]:
+    """Generate the question/answer records of the sample's triples, one per cluster of near-duplicates."""
+    kg_triples = collapse_triples([Triple(*triple) for triple in job.state["verdict"][0]], DEDUP_SCOPE)
+    translated_context = job.state["translation"]
+    store = get_graph_store()
+    if store is not None:
+        store.add_triples(kg_triples, job.index + 1)
+    with use_span(job.span):
+        qa_results = generate_questions_and_answers(kg_triples, translated_context, get_pipeline().backend,
+                                                    store=store if REUSE_DUPLICATE_QA else None)
+    job.rows = []
+    for triple, question, answer, rte_data, kgc_data in qa_results:
+        if question is None or answer is None or rte_data is None or kgc_data is None:
+            print(f"Skipping triple {triple} of sample {job.index + 1} due to error in generate_question_and_answer_with_agent.")
+            continue
+        job.rows.append((translated_context, triple, question, answer, rte_data, kgc_data))
+    return job
+
+
+SAMPLE_STAGES = [("translate", translate_stage), ("graphrag", graphrag_stage), ("extract", extract_stage),
+                 ("verify", verify_stage), ("qa", qa_stage)]
+
+
+def process_message(message: str, state: Optional[Dict[str, Any]] = None,
+                    on_stage: Optional[Callable[[str, Any], None]] = None) -> Tuple[List[Triple], Optional[str], Optional[str]]:
+    """Process the user input message and generate knowledge graph triples.
+
+    Runs the stages up to the verifier in the calling thread; `state` and
+    `on_stage` are as for SampleJob.
+    """
+    job = SampleJob(None, message, state, on_stage)
+    for _, stage in SAMPLE_STAGES[:-1]:
+        if stage(job) is None:
+            return None, None, None
+    kg_triples, validation_result = job.state["verdict"]
+    return [Triple(*triple) for triple in kg_triples], job.state["translation"], validation_result
+
+
+def generate_triples(output: str) -> List[Triple]:
+    """Run the extractor and the Knowledge Graph Master on the GraphRAG output.
+
+    Outputs longer than CHUNK_MAX_TOKENS are split into overlapping windows that
+    are processed in parallel; their triples are merged without duplicates.
+    """
+    if PIPELINE_MODE not in PIPELINE_MODES:
+        raise ValueError(f"Unsupported pipeline mode: {PIPELINE_MODE}")
+    chunks = chunk_text(output)
+    if len(chunks) == 1:
+        return generate_chunk_triples(output)
+    print(f"Splitting the GraphRAG output into {len(chunks)} windows.")
+    parent = current_span()
+    results = bounded_map(lambda item: generate_chunk_triples(item[1], item[0], parent), enumerate(chunks),
+                          CHUNK_CONCURRENCY)
+    return merge_triples(triples for _, triples in results)
+
+
+def generate_chunk_triples(output: str, chunk: Optional[int] = None, parent=None) -> List[Triple]:
+    """Generate the triples of one window of the GraphRAG output according to PIPELINE_MODE.
+
+    "legacy" runs the extractor and the Knowledge Graph Master on the output,
+    "feed" also gives the extractor's result to the Knowledge Graph Master, and
+    "fused" has the Knowledge Graph Master extract the entities and generate the
+    triples in a single call.
+    """
+    agents = get_pipeline().agents
+    chunk_attributes = {"chunk": chunk} if chunk is not None else {}
+    messages = [{"role": "user", "content": output}]
+    if PIPELINE_MODE == "fused":
+        with span("kg_master", parent=parent, round=0, mode="fused", **chunk_attributes):
+            kg_triples = request_fused_triples(messages)
+    else:
+        if PIPELINE_STAGES.get("extractor", True):
+            extracted = run_extractor(output, parent, chunk_attributes)
+            if PIPELINE_MODE == "feed" and extracted:
+                messages.append({"role": "user", "content": extracted})
+        with span("kg_master", parent=parent, round=0, **chunk_attributes):
+            kg_triples = request_triples(agents.knowledge_graph_master, messages)
+    print("Knowledge Graph Master: \n" + "\n".join(map(str, kg_triples)) + "\n")
+    return kg_triples
+
+
+def run_extractor(output: str, parent=None, chunk_attributes: Optional[Dict] = None) -> str:
+    """Run the Entity or the Relation Extractor on the output and return its result as a prompt section."""
+    # Randomly choose between Entity Extractor and Relation Extractor
+    # Seeded by the output so that reruns make the same choice and can be served from the response cache
+    pipeline = get_pipeline()
+    agents = pipeline.agents
+    chosen_agent = random.Random(output).choice([agents.entity_extractor, agents.relation_extractor])
+    print(f"Randomly chosen agent: {chosen_agent.name}")
+
+    # Extract entities or relations based on the chosen agent
+    with span("extractor", parent=parent, agent=chosen_agent.name, **(chunk_attributes or {})):
+        if chosen_agent == agents.entity_extractor:
+            if STRUCTURED_OUTPUT:
+                value = run_structured_agent(pipeline.backend, chosen_agent, [{"role": "user", "content": output}],
+                                             "entities", ENTITIES_SCHEMA)
+                entities = value["entities"] if value is not None else []
+            else:
+                entities = run_agent(
+                    pipeline.backend,
+                    chosen_agent,
+                    messages=[{"role": "user", "content": output}],
+                ).splitlines()
+            print("Entity Extractor: \n" + "\n".join(entities) + "\n")
+            return "Extracted Entities:\n" + "\n".join(entities) if entities else ""
+        else:
+            if STRUCTURED_OUTPUT:
+                relations = request_triples(chosen_agent, [{"role": "user", "content": output}])
+            else:
+                relations = run_agent(
+                    pipeline.backend,
+                    chosen_agent,
+                    messages=[{"role": "user", "content": output}],
+                ).splitlines()
+            print("Relation Extractor: \n" + "\n".join(map(str, relations)) + "\n")
+            return "Extracted Relations:\n" + "\n".join(map(str, relations)) if relations else ""
+
+
+def request_triples(agent, messages: List[Dict], attempt: int = 0) -> List[Triple]:
+    """Ask an agent for triples, as free text or as schema-validated JSON when STRUCTURED_OUTPUT is set."""
+    pipeline = get_pipeline()
+    if STRUCTURED_OUTPUT:
+        value = run_structured_agent(pipeline.backend, agent, messages, "knowledge_graph_triples", TRIPLES_SCHEMA, attempt)
+        return triples_from_json(value) if value is not None else []
+    return parse_triples(run_agent(pipeline.backend, agent, messages=messages, attempt=attempt))
+
+
+def request_fused_triples(messages: List[Dict]) -> List[Triple]:
+    """Ask the Knowledge Graph Master to extract the entities and generate the triples in one call."""
+    pipeline = get_pipeline()
+    agent = pipeline.agents.knowledge_graph_master
+    if STRUCTURED_OUTPUT:
+        value = run_structured_agent(pipeline.backend, agent,
+                                     messages + [{"role": "user", "content": FUSED_STRUCTURED_PROMPT}],
+                                     "knowledge_graph_extraction", EXTRACTION_SCHEMA)
+        if value is None:
+            return []
+        print("Extracted Entities: \n" + "\n".join(value["entities"]) + "\n")
+        return triples_from_json(value)
+    response = run_agent(pipeline.backend, agent, messages=messages + [{"role": "user", "content": FUSED_PROMPT}])
+    entities, marker, triples = response.partition("Triples:")
+    if marker:
+        print(entities.strip() + "\n")
+    return parse_triples(triples if marker else response)
+
+
+def verify_triples(output: str, triples: List[Triple]) -> Tuple[List[Triple], str]:
+    """Validate triples locally and with the Knowledge Graph Verifier, regenerating within a budget.
+
+    Triples failing the local checks (grounding in `output`, relation format,
+    duplicates) are sent back to the Knowledge Graph Master on their own, up to
+    MAX_LOCAL_REPAIRS times, without a verifier call. Only locally valid triples
+    reach the verifier, whose rejections are regenerated up to MAX_VERIFIER_ROUNDS
+    times. Triples the verifier rejected are dropped; if VERIFIER_TOKEN_BUDGET
+    prompt tokens are spent before any verdict, they are kept or dropped
+    according to KEEP_UNVERIFIED_TRIPLES. The verifier and the regeneration from
+    its feedback see the whole `output`, so they can judge what the triples miss;
+    for long outputs the local repair prompt carries only the sentences supporting
+    the failed triples (see chunking.build_index).
+    """
+    pipeline = get_pipeline()
+    index = build_index(output)
+    validation_result = ""
+    tokens_spent = 0
+    repairs = 0  # local repairs
+    rounds = 0  # regenerations from verifier feedback
+
+    def spend(messages: List[Dict]) -> List[Dict]:
+        nonlocal tokens_spent
+        tokens_spent += sum(estimate_tokens(m["content"]) for m in messages)
+        return messages
+
+    while True:
+        triples, failed = validate_triples(triples, output)
+        if failed and repairs < MAX_LOCAL_REPAIRS and tokens_spent < VERIFIER_TOKEN_BUDGET:
+            # Repair only the triples that failed the local checks
+            repairs += 1
+            feedback = "\n".join(f"{triple}: {reason}" for triple, reason in failed)
+            print(f"Local validation failed for {len(failed)} triples:\n{feedback}\n")
+            with span("kg_master", round=rounds, repair="local"):
+                repaired = request_triples(pipeline.agents.knowledge_graph_master, spend([
+                    {"role": "user", "content": "User Original Input:\n"
+                                                + supporting_context(index, output, [triple for triple, _ in failed])},
+                    {"role": "user", "content": f"Validation Result:\n{feedback}"},
+                    {"role": "user", "content": "Regenerate only these Knowledge Graph Triples:\n" + "\n".join(
+                        str(triple) for triple, _ in failed)}
+                ]), repairs + rounds)
+            triples = triples + repaired
+            continue
+
+        if failed:
+            print(f"Dropping {len(failed)} triples that failed local validation.")
+        kg_triples = "\n".join(map(str, triples))
+        print(f"Knowledge Graph Master: \n{kg_triples}\n")
+        if not triples:
+            break
+        if not PIPELINE_STAGES.get("verifier", True):
+            return triples, "Not verified."
+        if tokens_spent >= VERIFIER_TOKEN_BUDGET:
+            break
+
+        with span("verifier", round=rounds):
+            validation_result = run_agent(pipeline.backend, pipeline.agents.knowledge_graph_verifier, messages=spend([
+                {"role": "user", "content": f"User Original Input:\n{output}"},
+                {"role": "user", "content": f"Generated Knowledge Graph Triples:\n{kg_triples}"}
+            ]), attempt=repairs + rounds)
         print(f"Knowledge Graph Verifier: {validation_result}\n")
+        if "This is a loyal fact." in validation_result:
+            return triples, validation_result
+
+        if rounds >= MAX_VERIFIER_ROUNDS or tokens_spent >= VERIFIER_TOKEN_BUDGET:
+            break
+
+        # Regenerate triples from the verifier's feedback on the previous triples
+        rounds += 1
+        with span("kg_master", round=rounds, repair="verifier"):
+            triples = request_triples(pipeline.agents.knowledge_graph_master, spend([
+                {"role": "user", "content": f"User Original Input:\n{output}"},
+                {"role": "user", "content": f"Validation Result:\n{validation_result}"},
+                {"role": "user", "content": f"Previous Generated Knowledge Graph Triples:\n{kg_triples}"}
+            ]), repairs + rounds)
+
+    print(f"Verification stopped after {rounds} verifier rounds, {repairs} local repairs "
+          f"and about {tokens_spent} prompt tokens.")
+    if not validation_result and KEEP_UNVERIFIED_TRIPLES:
+        return triples, "Not verified."
+    return [], validation_result or "Not verified."
+
+
+def start_job(index: int, context: str, journal: Optional[CheckpointJournal] = None) -> SampleJob:
+    """Create the job of a sample, reusing the stages recorded for it in the checkpoint `journal`."""
+    print(f"Processing sample {index + 1}")
+    job = SampleJob(index, context)
+    if journal is not None:
+        job.state = journal.state(index)
+        job.on_stage = lambda stage, value: journal.record(index, stage, value)
+    job.span = begin_span("sample", sample=index + 1)
+    return job
+
+
+def finish_job(job: SampleJob) -> Optional[List[Tuple[str, Triple, str, str, Dict, Dict]]]:
+    """End the job of a sample and return its output rows, or None if a stage failed."""
+    end_span(job.span)
+    if job.rows is None:
+        print(f"Skipping sample {job.index + 1} due to an error in one of its stages.")
+        return None
+    print(f"Sample {job.index + 1} processed in {time.time() - job.start_time:.2f} seconds")
+    return job.rows
+
+
+def process_xlsx(input_file: str, output_xlsx: str, rte_output_json: str, kgc_output_json: str,
+                 records_output: str = RECORDS_OUTPUT, concurrency: int = MAX_CONCURRENT_SAMPLES,
+                 ordered: bool = ORDERED_OUTPUT, resume: bool = False, checkpoint_path: str = CHECKPOINT_PATH,
+                 shard: Optional[Shard] = None, shard_by: str = "range", finalize: bool = True,
+                 trace_path: str = TRACE_PATH) -> bool:
+    """Process the input Excel file and generate output files.
 
-    return kg_triples, translated_query, validation_result
+    Returns True if every sample was processed, False if samples were skipped
+    after errors or the run failed; rerunning with `resume=True` retries them.
 
+    Samples pass through the stages of SAMPLE_STAGES, each with its own
+    STAGE_WORKERS threads and a bounded input queue, so the stages of different
+    samples overlap; up to `concurrency` samples are in the pipeline at a time.
+    Output records are appended to the `records_output` log from the calling
+    thread only, in input order when `ordered` is True, and the XLSX/JSON outputs
+    are built from the log at the end. The stage and queue metrics are printed at the end.
 
-def process_xlsx(input_file: str, output_xlsx: str, rte_output_json: str, kgc_output_json: str):
-    """Process the input Excel file and generate output files."""
-    from utils import initialize_output_files
-    initialize_output_files(output_xlsx, rte_output_json, kgc_output_json)
+    Progress is journaled to `checkpoint_path`. With `resume=True` finished samples
+    are skipped and partially processed samples continue from their last completed
+    stage; otherwise the journal and the record log are started afresh.
 
+    With a `shard` (index, count) only the samples of that shard are processed
+    (see shards.in_shard), and with `finalize=False` only the record log is
+    written, for shards.merge_shards to combine.
+    """
+    if not resume:
+        clear_records(records_output)
+    writer = create_writer(records_output)
+    journal = CheckpointJournal(checkpoint_path, resume)
+    tracer = start_trace(trace_path, resume=resume)
+    executor = None
+    succeeded = False
     try:
-        df = pd.read_excel(input_file, usecols=['context'])
-
-        if 'context' not in df.columns:
-            raise ValueError("Input file must contain a 'context' column.")
-
-        total_samples = len(df)
-        for index, row in df.iterrows():
-            start_time = time.time()
-            print(f"Processing sample {index + 1}/{total_samples}")
-            context = row['context']
-            result = process_message(context)
-            if result is None:
-                print(f"Skipping sample {index + 1}/{total_samples} due to error in process_message.")
-                continue
-            kg_triples, translated_context, validation_result = result
-
-            for triple in kg_triples:
-                question, answer, rte_data, kgc_data = generate_question_and_answer_with_agent(triple, translated_context, openai)
-                if question is None or answer is None or rte_data is None or kgc_data is None:
-                    print(f"Skipping sample {index + 1}/{total_samples} due to error in generate_question_and_answer_with_agent.")
-                    continue
-                append_to_files(index + 1, translated_context, triple, question, answer, rte_data, kgc_data, output_xlsx, rte_output_json, kgc_output_json)
-
-            end_time = time.time()
-            print(f"Sample {index + 1}/{total_samples} processed in {end_time - start_time:.2f} seconds")
+        # Rows are streamed from the workbook instead of being loaded at once
+        total_rows = count_rows(input_file)
+        total_samples = total_rows
+        contexts = iter_contexts(input_file)
+        if shard is not None:
+            print(f"Processing shard {shard[0]}/{shard[1]} ({shard_by}) of {total_rows} samples")
+            contexts = ((index, context) for index, context in contexts
+                        if in_shard(index, context, shard, total_rows, shard_by))
+            # The size of a hash shard is only known once the input has been read
+            total_samples = ((shard[0] + 1) * total_rows // shard[1] - shard[0] * total_rows // shard[1]
+                             if shard_by == "range" else "?")
+        completed = len(journal.done)
+        jobs = (start_job(index, context, journal) for index, context in contexts
+                if context is not None and not journal.is_done(index))
+        executor = StagedExecutor([Stage(name, stage, STAGE_WORKERS.get(name, concurrency)) for name, stage in SAMPLE_STAGES],
+                                  STAGE_QUEUE_SIZE, max_in_flight=concurrency, max_buffered=REORDER_BUFFER_SIZE)
+        for job, _ in executor.run(jobs, ordered):
+            index = job.index
+            rows = finish_job(job)
+            completed += 1
+            if rows is not None:
+                with span("write", sample=index + 1, records=len(rows)):
+                    for translated_context, triple, question, answer, rte_data, kgc_data in rows:
+                        writer.append({
+                            "sample_index": index + 1,
+                            "context": translated_context,
+                            "triple": str(triple),
+                            "question": question,
+                            "answer": answer,
+                            "rte": rte_data,
+                            "kgc": kgc_data
+                        })
+                    # The sample only counts as done once its records are on disk
+                    writer.flush()
+                    journal.mark_done(index)
+            print(f"Completed {completed}/{total_samples} samples")
+        skipped = completed - len(journal.done)
+        if skipped:
+            print(f"{skipped} samples were skipped after errors.")
+        succeeded = not skipped
 
     except Exception as e:
         print(f"An error occurred in process_xlsx: {e}")
+    finally:
+        if executor is not None:
+            print_metrics(executor.metrics())
+        writer.close()
+        journal.close()
+        if finalize:
+            finalize_outputs(records_output, output_xlsx, rte_output_json, kgc_output_json)
+        cache = get_response_cache()
+        if cache is not None:
+            print(f"LLM response cache: {cache.stats()}")
+        if tracer is not None:
+            stop_trace()
+            print_report(tracer.path)
+    return succeeded
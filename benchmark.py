@@ -0,0 +1,453 @@
+# benchmark.py
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+def _legacy_parse(lines: List[str]) -> List[tuple]:
+    """The split(', ') parser previously used in MAS and utils, for comparison."""
+    triples = []
+    for triple in lines:
+        try:
+            triple = triple.strip()
+            if triple.endswith(')'):
+                triple = triple[:-1].strip()
+            entity1, relation, entity2 = triple.strip('()').split(', ')
+            triples.append((entity1, relation, entity2))
+        except ValueError:
+            pass
+    return triples
+
+
+def synthetic_kg_output(num_lines: int, seed: int = 0) -> str:
+    """Build a Knowledge Graph Master style output mixing the triple formats models produce."""
+    rng = random.Random(seed)
+    entities = ["Steel plant", "Blast furnace", "Iron ore", "Coke", "Oxygen", "Tianjin, China",
+                "Company A, Inc.", "Rolling mill", "Slag", "Production line"]
+    relations = ["produces", "consumes", "is located in", "supplies", "part of", "emits"]
+    formats = [
+        lambda h, r, t: f"({h}, {r}, {t})",
+        lambda h, r, t: f"{rng.randint(1, 99)}. ({h},{r},{t})",
+        lambda h, r, t: f"- ({h} , {r} , {t})",
+        lambda h, r, t: f'("{h}", "{r}", "{t}")',
+        lambda h, r, t: f"{h} -> {r} -> {t}",
+        lambda h, r, t: f'{{"head": "{h}", "relation": "{r}", "tail": "{t}"}}',
+        lambda h, r, t: "Let's think step by step.",
+    ]
+    lines = []
+    for _ in range(num_lines):
+        head, tail = rng.sample(entities, 2)
+        lines.append(rng.choice(formats)(head, rng.choice(relations), tail))
+    return "\n".join(lines)
+
+
+def _time(func: Callable[[], list], repeat: int) -> tuple:
+    best = float("inf")
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, len(result)
+
+
+def bench_triples(args):
+    """Micro-benchmark the triple parser against the legacy split parser."""
+    import contextlib
+    import io
+    from triples import parse_triples
+
+    output = synthetic_kg_output(args.lines)
+    lines = output.splitlines()
+    for name, func in (("legacy split", lambda: _legacy_parse(lines)), ("triples.parse_triples", lambda: parse_triples(output))):
+        # Silence the per-line "Invalid triple detected" messages
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, parsed = _time(func, args.repeat)
+        print(f"{name:>22}: {parsed}/{len(lines)} lines parsed, {len(lines) / elapsed:,.0f} lines/s")
+
+
+# Client libraries that must only be imported when the pipeline is first used
+LAZY_MODULES = ("openai", "swarm", "pandas", "graphrag")
+
+
+def _import_profile(module: str) -> Dict[str, int]:
+    """Import a module in a fresh interpreter and return the cumulative import time (us) of every module."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        profile[name] = int(cumulative)
+    return profile
+
+
+def bench_import(args):
+    """Measure the import time of the pipeline modules and fail if it exceeds the threshold."""
+    failed = False
+    for module in args.modules:
+        profiles = [_import_profile(module) for _ in range(args.repeat)]
+        best = min(profiles, key=lambda profile: profile[module])
+        elapsed_ms = best[module] / 1000
+        eager = [name for name in LAZY_MODULES if name in best]
+        slowest = sorted(((us, name) for name, us in best.items() if "." not in name and name != module), reverse=True)[:3]
+        print(f"{module:>8}: {elapsed_ms:.1f} ms (slowest: "
+              + ", ".join(f"{name} {us / 1000:.1f} ms" for us, name in slowest) + ")")
+        if elapsed_ms > args.max_ms:
+            print(f"{module:>8}: import takes longer than {args.max_ms} ms")
+            failed = True
+        if eager:
+            print(f"{module:>8}: imports {', '.join(eager)} at import time")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+def synthetic_contexts(rows: int, seed: int = 0) -> List[str]:
+    """Build input contexts in the style of the test data (short Chinese industry sentences)."""
+    rng = random.Random(seed)
+    subjects = ["钢铁厂", "高炉", "轧钢厂", "发电站", "烧结厂"]
+    topics = ["生产流程", "能源消耗", "原料供应", "排放控制", "设备维护"]
+    return [f"{rng.choice(subjects)}的{rng.choice(topics)} {index}" for index in range(rows)]
+
+
+def synthetic_triple_variants(count: int, seed: int = 0) -> Iterator[Tuple[int, tuple]]:
+    """Yield (base triple id, triple) pairs where each base triple recurs with trivial variations.
+
+    Variants change the casing, add an article, pluralize the entities or use a
+    relation synonym, as Knowledge Graph Master outputs do across samples. Base
+    triples come in pairs with the same entities and opposite relations (e.g.
+    "increases"/"decreases"), which must not be merged.
+    """
+    rng = random.Random(seed)
+    syllables = ["ka", "to", "ri", "men", "sul", "vo", "den", "pra", "lin", "gor", "te", "nas"]
+    # Pairs of opposite relations, each with its synonyms
+    relations = [(("produces", "manufactures"), ("consumes", "uses")), (("supplies", "provides"), ("emits", "releases")),
+                 (("contains", "includes"), ("is part of", "belongs to")), (("increases",), ("decreases",)),
+                 (("activates",), ("deactivates",)), (("is upstream of",), ("is downstream of",)),
+                 (("is used in",), ("is not used in",))]
+    bases = max(1, count // 5)
+    names = ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) + " " + rng.choice(["plant", "unit", "line", "furnace", "mill"])
+             for _ in range(max(2, bases // 4))]
+    for _ in range(count):
+        base = rng.randrange(bases)
+        base_rng = random.Random(base // 2)
+        head, tail = base_rng.sample(names, 2)
+        relation = base_rng.choice(relations)[base % 2]
+        variant = rng.randrange(5)
+        if variant == 1:
+            head, tail = head.title(), tail.upper()
+        elif variant == 2:
+            head = "The " + head
+        elif variant == 3:
+            head, tail = head + "s", tail + "s"
+        yield base, (head, relation[-1] if variant == 4 else relation[0], tail)
+
+
+def bench_dedup(args):
+    """Cluster synthetic near-duplicate triples and report throughput, cluster quality and memory."""
+    from dedup import TripleDeduplicator
+    from triples import Triple
+
+    # Triples that differ in one word name different things and must stay apart
+    distinct = [("Pump station A", "supplies", "Cooling water"), ("Pump station B", "supplies", "Cooling water"),
+                ("Hot rolling mill", "produces", "steel coils"), ("Cold rolling mill", "produces", "steel coils"),
+                ("Unit 1", "increases", "pressure"), ("Unit 2", "increases", "pressure"),
+                ("Unit 1", "decreases", "pressure")]
+    clusters = TripleDeduplicator().assign([Triple(*triple) for triple in distinct])
+    if len(set(clusters)) != len(distinct):
+        raise AssertionError(f"distinct triples were merged: {list(zip(distinct, clusters))}")
+    merged = TripleDeduplicator().assign([Triple("The pump station A", "provides", "cooling waters"),
+                                          Triple("pump station a", "supplies", "Cooling water")])
+    if merged[0] != merged[1]:
+        raise AssertionError("trivial variants were not merged")
+
+    deduplicator = TripleDeduplicator()
+    members: Dict[int, Dict[int, int]] = {}  # cluster -> base -> count
+    bases = set()
+
+    def assign(batch: List[Tuple[int, tuple]]):
+        for (base, _), cluster in zip(batch, deduplicator.assign([Triple(*triple) for _, triple in batch])):
+            counts = members.setdefault(cluster, {})
+            counts[base] = counts.get(base, 0) + 1
+            bases.add(base)
+
+    start = time.perf_counter()
+    batch: List[Tuple[int, tuple]] = []
+    for entry in synthetic_triple_variants(args.triples):
+        batch.append(entry)
+        if len(batch) == args.batch_size:
+            assign(batch)
+            batch = []
+    assign(batch)
+    elapsed = time.perf_counter() - start
+    # Purity: triples whose cluster is dominated by their own base triple
+    purity = sum(max(counts.values()) for counts in members.values()) / args.triples
+    print(f"{'triples':>10}{'seconds':>9}{'triples/s':>11}{'clusters':>10}{'base triples':>14}{'purity':>8}{'peak RSS MB':>13}")
+    print(f"{args.triples:>10}{elapsed:>9.1f}{args.triples / elapsed:>11.0f}{len(members):>10}{len(bases):>14}"
+          f"{purity:>8.1%}{_peak_rss_mb():>13.0f}")
+
+
+def bench_columnar(args):
+    """Compare the size and load time of the RTE/KGC JSON files with the same records in a columnar dataset."""
+    import contextlib
+    import eval
+    from columnar import ColumnarDataset, write_columnar
+    from writers import iter_json_records
+
+    print(f"{'rows':>8}{'JSON MB':>9}{'columnar MB':>13}{'ratio':>7}{'JSON load s':>13}{'columnar load s':>17}"
+          f"{'open ms':>9}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            _write_eval_corpus(rows, directory)
+            files = {data_type: os.path.join(directory, f"{data_type}_output.json") for data_type in ("kgc", "rte")}
+            dataset = os.path.join(directory, "dataset")
+            write_columnar(iter_json_records(files["kgc"]), dataset)
+            json_bytes = sum(os.path.getsize(path) for path in files.values())
+            columnar_bytes = sum(os.path.getsize(os.path.join(dataset, name)) for name in os.listdir(dataset))
+
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                json_records = {data_type: eval.load_dataset(path) for data_type, path in files.items()}
+                json_load = time.perf_counter() - start
+                start = time.perf_counter()
+                ColumnarDataset(dataset)
+                open_ms = (time.perf_counter() - start) * 1000
+                start = time.perf_counter()
+                columnar_records = {data_type: eval.load_dataset(dataset, data_type) for data_type in files}
+                columnar_load = time.perf_counter() - start
+            if columnar_records != json_records:
+                raise AssertionError("The columnar dataset does not reproduce the JSON records.")
+            print(f"{rows:>8}{json_bytes / 2 ** 20:>9.1f}{columnar_bytes / 2 ** 20:>13.1f}"
+                  f"{json_bytes / columnar_bytes:>7.1f}{json_load:>13.2f}{columnar_load:>17.2f}{open_ms:>9.1f}")
+
+
+def bench_resume(args):
+    """Simulate a crash in the middle of a record and a journal write and check that resuming loses nothing."""
+    from checkpoint import CheckpointJournal
+    from writers import JsonlRecordWriter, read_records
+
+    with tempfile.TemporaryDirectory() as directory:
+        records_path = os.path.join(directory, "records.jsonl")
+        with JsonlRecordWriter(records_path) as writer:
+            for index in range(args.records):
+                writer.append({"sample_index": index})
+        with open(records_path, "a", encoding="utf-8") as f:
+            f.write('{"sample_index": ')  # crash before the line is complete
+        start = time.perf_counter()
+        with JsonlRecordWriter(records_path) as writer:
+            reopen_ms = (time.perf_counter() - start) * 1000
+            writer.append({"sample_index": args.records})
+        indices = [record["sample_index"] for record in read_records(records_path)]
+        if indices != list(range(args.records + 1)):
+            raise AssertionError(f"Resumed record log lost records: {len(indices)} of {args.records + 1} read back.")
+
+        checkpoint_path = os.path.join(directory, "checkpoint.jsonl")
+        journal = CheckpointJournal(checkpoint_path)
+        journal.mark_done(0)
+        journal.close()
+        with open(checkpoint_path, "a", encoding="utf-8") as f:
+            f.write('{"index": 1, "stage": ')
+        journal = CheckpointJournal(checkpoint_path, resume=True)
+        journal.mark_done(1)
+        journal.close()
+        journal = CheckpointJournal(checkpoint_path, resume=True)
+        journal.close()
+        if journal.done != {0, 1}:
+            raise AssertionError("Resumed checkpoint journal lost a completed sample.")
+    print(f"{'records':>10}{'reopen ms':>11}")
+    print(f"{args.records:>10}{reopen_ms:>11.1f}")
+
+
+def _write_pipeline_corpus(rows: int, directory: str):
+    import pandas as pd
+    pd.DataFrame({"context": synthetic_contexts(rows)}).to_excel(os.path.join(directory, "input.xlsx"), index=False)
+
+
+def _write_eval_corpus(rows: int, directory: str):
+    """Write kgc_output.json and rte_output.json with `rows` records each, five records per context."""
+    from mock_backends import FakeGraphRAGEngine, _facts
+    from writers import write_json_array
+
+    def records(kind: str):
+        engine = FakeGraphRAGEngine()
+        for index in range(rows):
+            context = engine.query(str(index // 5))
+            fact = _facts(context)[index % 5]
+            if kind == "kgc":
+                yield {"head entity name": fact["head"], "head entity type": "industry", "tail entity name": fact["tail"],
+                       "tail entity type": "industry", "relation": fact["relation"], "context": context}
+            else:
+                yield {"entity name": fact["head"], "entity type": "industry", "text description": context,
+                       "triplet": [{"subject": fact["head"], "predicate": fact["relation"], "object": fact["tail"]}]}
+
+    write_json_array(records("kgc"), os.path.join(directory, "kgc_output.json"))
+    write_json_array(records("rte"), os.path.join(directory, "rte_output.json"))
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_worker(args):
+    """Run the pipeline or the evaluation in this process with config overrides and write its measurements."""
+    import config
+    for key, value in json.loads(args.overrides).items():
+        setattr(config, key, value)
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            if args.workload == "pipeline":
+                from MAS import process_xlsx
+                process_xlsx("input.xlsx", "output/output.xlsx", "output/rte.json", "output/kgc.json",
+                             "output/records.jsonl", checkpoint_path="output/checkpoint.jsonl")
+            else:
+                import eval
+                eval.main()
+        finally:
+            sys.stdout = stdout
+    result = {"elapsed": time.perf_counter() - start, "peak_rss_mb": _peak_rss_mb()}
+    if args.workload == "pipeline":
+        result.update(_pipeline_quality("output/records.jsonl", "output/checkpoint.jsonl", config.TRACE_PATH))
+    with open("result.json", "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def _pipeline_quality(records_path: str, checkpoint_path: str, trace_path: str) -> Dict[str, float]:
+    """Count the output records and accepted verdicts of a pipeline run and its median sample latency."""
+    from tracing import summarize
+    with open(records_path, encoding="utf-8") as f:
+        records = sum(1 for line in f if line.strip())
+    verdicts = []
+    with open(checkpoint_path, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["stage"] == "verdict":
+                verdicts.append("This is a loyal fact." in entry["value"][1])
+    sample = summarize(trace_path).get("sample", {}) if os.path.exists(trace_path) else {}
+    return {"records": records, "verified": sum(verdicts) / len(verdicts) if verdicts else 0.0,
+            "sample_p50_ms": sample.get("p50_ms", 0.0)}
+
+
+def _measure(workload: str, rows: int, args, overrides: Dict = None):
+    """Run one worker against a fresh mock chat server; returns (result, samples, server)."""
+    from mock_backends import MockChatServer
+
+    server = MockChatServer(latency=args.latency, error_rate=args.error_rate).start()
+    overrides = dict({
+        "LLM_BACKEND": "http", "OPENAI_BASE_URL": server.url, "EVAL_API_BASE": server.url,
+        "GRAPHRAG_BACKEND": "mock", "LLM_CACHE_ENABLED": False, "RATE_LIMITS": {},
+        "MAX_CONCURRENT_SAMPLES": args.concurrency, "EVAL_CONCURRENCY": args.concurrency,
+    }, **(overrides or {}))
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            if workload == "pipeline":
+                _write_pipeline_corpus(rows, directory)
+                samples = rows
+            else:
+                _write_eval_corpus(rows, directory)
+                samples = 2 * rows  # KGC and RTE records
+            command = [sys.executable, os.path.abspath(__file__), "worker", workload, json.dumps(overrides)]
+            subprocess.run(command, cwd=directory, check=True)
+            with open(os.path.join(directory, "result.json"), encoding="utf-8") as f:
+                result = json.load(f)
+    finally:
+        server.stop()
+    return result, samples, server
+
+
+def bench_throughput(args):
+    """Run process_xlsx or eval.main end to end against the mock chat server and the fake GraphRAG engine."""
+    print(f"{'rows':>8}{'seconds':>10}{'samples/s':>12}{'calls/sample':>14}{'errors':>8}{'peak RSS MB':>13}")
+    for rows in args.rows:
+        result, samples, server = _measure(args.workload, rows, args)
+        print(f"{rows:>8}{result['elapsed']:>10.1f}{samples / result['elapsed']:>12.1f}"
+              f"{server.requests / samples:>14.2f}{server.errors:>8}{result['peak_rss_mb']:>13.0f}")
+
+
+def bench_modes(args):
+    """A/B report of the pipeline modes and stage toggles: latency and call volume against output quality."""
+    print(f"{'variant':<30}{'seconds':>9}{'sample p50 ms':>15}{'calls/sample':>14}{'records/sample':>16}{'verified':>10}")
+    for mode in args.modes:
+        for stages in args.stages:
+            toggles = {"extractor": "extractor" in stages, "verifier": "verifier" in stages}
+            result, samples, server = _measure("pipeline", args.rows, args,
+                                               {"PIPELINE_MODE": mode, "PIPELINE_STAGES": toggles})
+            variant = f"{mode} [{stages or 'no stages'}]"
+            print(f"{variant:<30}{result['elapsed']:>9.1f}{result['sample_p50_ms']:>15.0f}"
+                  f"{server.requests / samples:>14.2f}{result['records'] / samples:>16.2f}{result['verified']:>10.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the KG-MAD pipeline.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    triples_parser = subparsers.add_parser("triples", help="Parse a large synthetic Knowledge Graph Master output.")
+    triples_parser.add_argument("--lines", type=int, default=100000)
+    triples_parser.add_argument("--repeat", type=int, default=3)
+    triples_parser.set_defaults(func=bench_triples)
+
+    import_parser = subparsers.add_parser("import", help="Guard the import time of the pipeline modules.")
+    import_parser.add_argument("--modules", nargs="+", default=["MAS", "eval", "utils", "main"])
+    import_parser.add_argument("--max-ms", type=float, default=300.0)
+    import_parser.add_argument("--repeat", type=int, default=3)
+    import_parser.set_defaults(func=bench_import)
+
+    for workload, help_text in (("pipeline", "End-to-end process_xlsx throughput against the mock backends."),
+                                ("eval", "End-to-end eval.main throughput against the mock chat server.")):
+        throughput_parser = subparsers.add_parser(workload, help=help_text)
+        throughput_parser.add_argument("--rows", type=int, nargs="+", default=[100],
+                                       help="Synthetic corpus sizes, e.g. --rows 100 1000 10000 100000.")
+        throughput_parser.add_argument("--latency", type=float, default=0.0, help="Mean mock response time in seconds.")
+        throughput_parser.add_argument("--error-rate", type=float, default=0.0)
+        throughput_parser.add_argument("--concurrency", type=int, default=16)
+        throughput_parser.set_defaults(func=bench_throughput, workload=workload)
+
+    modes_parser = subparsers.add_parser("modes", help="Compare the pipeline modes (A/B) on the mock backends.")
+    modes_parser.add_argument("--modes", nargs="+", default=["legacy", "feed", "fused"],
+                              choices=["legacy", "feed", "fused"])
+    modes_parser.add_argument("--stages", nargs="+", default=["extractor,verifier"],
+                              help="Enabled stage sets to compare, e.g. extractor,verifier verifier ''.")
+    modes_parser.add_argument("--rows", type=int, default=100)
+    modes_parser.add_argument("--latency", type=float, default=0.05, help="Mean mock response time in seconds.")
+    modes_parser.add_argument("--error-rate", type=float, default=0.0)
+    modes_parser.add_argument("--concurrency", type=int, default=16)
+    modes_parser.set_defaults(func=bench_modes)
+
+    dedup_parser = subparsers.add_parser("dedup", help="Cluster synthetic near-duplicate triples.")
+    dedup_parser.add_argument("--triples", type=int, default=1000000)
+    dedup_parser.add_argument("--batch-size", type=int, default=10000)
+    dedup_parser.set_defaults(func=bench_dedup)
+
+    columnar_parser = subparsers.add_parser("columnar", help="Compare the JSON outputs with the columnar dataset.")
+    columnar_parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    columnar_parser.set_defaults(func=bench_columnar)
+
+    resume_parser = subparsers.add_parser("resume", help="Check that resuming after a torn write loses no record.")
+    resume_parser.add_argument("--records", type=int, default=100000)
+    resume_parser.set_defaults(func=bench_resume)
+
+    worker_parser = subparsers.add_parser("worker", help="Internal: run one throughput measurement.")
+    worker_parser.add_argument("workload", choices=["pipeline", "eval"])
+    worker_parser.add_argument("overrides")
+    worker_parser.set_defaults(func=run_worker)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
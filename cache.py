@@ -0,0 +1,145 @@
+# cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+from config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES, LLM_CACHE_REPLAY_ONLY
+from scheduler import estimate_tokens, token_usage
+from tracing import record_llm_call
+
+
+class CacheMiss(Exception):
+    """Raised in replay-only mode when a response is not in the cache."""
+
+
+class ResponseCache:
+    """Disk-backed, content-addressed cache of LLM responses stored in SQLite.
+
+    Entries are keyed on a hash of everything that determines a response (model,
+    instructions, messages, parameters). When the stored responses exceed
+    `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES,
+                 replay_only: bool = LLM_CACHE_REPLAY_ONLY):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        """Hash the request parts into a cache key."""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for a key, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """Store a response, evicting least recently used entries if the cache is full."""
+        size = len(value.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                              (key, value, size, time.time()))
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Delete the least recently used entries until the cache is below 90% of its size limit."""
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def cached(self, compute: Callable[[], Optional[str]], **key_parts) -> Optional[str]:
+        """Return the cached response for the request, computing and storing it on a miss.
+
+        In replay-only mode a miss raises CacheMiss instead of calling `compute`.
+        Responses that are None are not cached.
+        """
+        key = self.make_key(**key_parts)
+        value = self.get(key)
+        if value is not None:
+            return value
+        if self.replay_only:
+            raise CacheMiss(f"No cached response for request {key[:12]} (replay-only mode)")
+        value = compute()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and the current cache size."""
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self.total_bytes}
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the shared response cache, or None if caching is disabled."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def cached_call(compute: Callable[[], Optional[str]], **key_parts) -> Optional[str]:
+    """Run `compute` through the shared response cache when caching is enabled.
+
+    The call is recorded on the active trace span, as a cache hit if `compute` did not run,
+    with the token usage reported by the API or, for cache hits, estimated.
+    """
+    computed = False
+
+    def run() -> Optional[str]:
+        nonlocal computed
+        computed = True
+        return compute()
+
+    cache = get_response_cache()
+    value = run() if cache is None else cache.cached(run, **key_parts)
+    prompt_tokens = estimate_tokens(key_parts.get("instructions") or "") + sum(
+        estimate_tokens(m.get("content") or "") for m in key_parts.get("messages", []))
+    record_llm_call(key_parts.get("model"), *token_usage(value, prompt_tokens), cache_hit=not computed)
+    return value
@@ -0,0 +1,74 @@
+# checkpoint.py
+import json
+import os
+import threading
+from typing import Any, Dict, Set
+from utils import ensure_directory_exists, truncate_torn_line
+
+
+class CheckpointJournal:
+    """Append-only JSONL journal of per-sample stage results and completed samples.
+
+    Each line records one finished stage of one sample, e.g.
+    {"index": 3, "stage": "translation", "value": "..."}. A sample whose
+    "done" stage is recorded has all of its output records on disk.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        ensure_directory_exists(path)
+        self.path = path
+        self.states: Dict[int, Dict[str, Any]] = {}
+        self.done: Set[int] = set()
+        self.lock = threading.Lock()
+
+        if resume:
+            # Otherwise the first entry appended after a crash would be glued onto the torn line
+            truncate_torn_line(path)
+            self._load()
+        elif os.path.exists(path):
+            os.remove(path)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["stage"] == "done":
+                    self.done.add(entry["index"])
+                else:
+                    self.states.setdefault(entry["index"], {})[entry["stage"]] = entry["value"]
+        print(f"Resuming from {self.path}: {len(self.done)} samples done, "
+              f"{len(set(self.states) - self.done)} partially processed")
+
+    def state(self, index: int) -> Dict[str, Any]:
+        """Return the stage results already recorded for a sample."""
+        with self.lock:
+            return dict(self.states.get(index, {}))
+
+    def record(self, index: int, stage: str, value: Any):
+        """Durably record the result of one stage of a sample."""
+        line = json.dumps({"index": index, "stage": stage, "value": value}, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if stage == "done":
+                self.done.add(index)
+                self.states.pop(index, None)
+            else:
+                self.states.setdefault(index, {})[stage] = value
+
+    def mark_done(self, index: int):
+        """Record that all output records of a sample have been written."""
+        self.record(index, "done", True)
+
+    def is_done(self, index: int) -> bool:
+        return index in self.done
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,117 @@
+# chunking.py
+import math
+import re
+from collections import Counter
+from typing import Iterable, List, Optional
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, SUPPORT_SENTENCES, SUPPORT_MIN_TOKENS
+from scheduler import estimate_tokens
+from triples import Triple
+from validation import normalize
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+|(?<=[。！？；])|\n+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a text into sentences at sentence-ending punctuation and line breaks."""
+    return [sentence.strip() for sentence in _SENTENCE_END_RE.split(text) if sentence and sentence.strip()]
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """Split a long text into windows of whole sentences of about `max_tokens` tokens.
+
+    Consecutive windows share their last/first sentences (up to `overlap_tokens`
+    tokens), so facts spanning a window boundary appear whole in one of them.
+    Texts within `max_tokens` (or any text if `max_tokens` is 0) are returned as one window.
+    """
+    if max_tokens <= 0 or estimate_tokens(text) <= max_tokens:
+        return [text]
+    chunks, window, size = [], [], 0
+    for sentence in split_sentences(text):
+        tokens = estimate_tokens(sentence)
+        if window and size + tokens > max_tokens:
+            chunks.append(" ".join(window))
+            overlap, overlap_size = [], 0
+            for previous in reversed(window):
+                if overlap_size + estimate_tokens(previous) > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += estimate_tokens(previous)
+            window, size = overlap, overlap_size
+        window.append(sentence)
+        size += tokens
+    if window:
+        chunks.append(" ".join(window))
+    return chunks
+
+
+def merge_triples(chunk_triples: Iterable[List[Triple]]) -> List[Triple]:
+    """Merge the triples of several windows in order, dropping triples already seen (after normalization)."""
+    seen = set()
+    merged = []
+    for triples in chunk_triples:
+        for triple in triples:
+            key = tuple(normalize(part) for part in triple)
+            if key not in seen:
+                seen.add(key)
+                merged.append(triple)
+    return merged
+
+
+class SentenceIndex:
+    """BM25 index over the sentences of a context, used to find the sentences supporting a triple."""
+
+    def __init__(self, text: str, k1: float = 1.5, b: float = 0.75):
+        self.sentences = split_sentences(text)
+        self.terms = [Counter(normalize(sentence).split()) for sentence in self.sentences]
+        self.lengths = [sum(terms.values()) for terms in self.terms]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = Counter(term for terms in self.terms for term in terms)
+        count = len(self.sentences)
+        self.idf = {term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                    for term, frequency in document_frequency.items()}
+        self.k1 = k1
+        self.b = b
+
+    def scores(self, query: str) -> List[float]:
+        query_terms = [term for term in normalize(query).split() if term in self.idf]
+        scores = []
+        for terms, length in zip(self.terms, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self.average_length) if self.average_length else self.k1
+            for term in query_terms:
+                frequency = terms.get(term, 0)
+                if frequency:
+                    score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            scores.append(score)
+        return scores
+
+    def top(self, query: str, k: int) -> List[int]:
+        """Return the indexes of the `k` best matching sentences (with a positive score)."""
+        scores = self.scores(query)
+        ranked = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+        return [i for i in ranked[:k] if scores[i] > 0]
+
+    def support(self, triples: Iterable[Triple], k: int = SUPPORT_SENTENCES) -> str:
+        """Return the sentences supporting any of the triples, in their original order."""
+        selected = set()
+        for triple in triples:
+            selected.update(self.top(" ".join(triple), k))
+        return " ".join(self.sentences[i] for i in sorted(selected))
+
+
+def build_index(context: str) -> Optional[SentenceIndex]:
+    """Return a sentence index for compacting prompts about a context, or None to send it in full.
+
+    Short contexts (under SUPPORT_MIN_TOKENS tokens) are sent in full, as is
+    every context when SUPPORT_SENTENCES is 0.
+    """
+    if SUPPORT_SENTENCES <= 0 or estimate_tokens(context) < SUPPORT_MIN_TOKENS:
+        return None
+    return SentenceIndex(context)
+
+
+def supporting_context(index: Optional[SentenceIndex], context: str, triples: Iterable[Triple]) -> str:
+    """Return the part of `context` supporting the triples, or the whole context without an index or matches."""
+    if index is None:
+        return context
+    return index.support(triples) or context
@@ -0,0 +1,201 @@
+# columnar.py
+import hashlib
+import os
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional
+from config import COLUMNAR_BATCH_SIZE
+from writers import RecordWriter, iter_json_records, write_json_array
+
+CONTEXTS_FILE = "contexts.arrow"
+TRIPLES_FILE = "triples.arrow"
+# Low-cardinality columns stored as Arrow dictionaries
+_DICTIONARY_COLUMNS = ("head_type", "relation", "tail_type")
+
+
+def _schemas():
+    import pyarrow as pa
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    contexts = pa.schema([("text", pa.large_string())])
+    triples = pa.schema([("sample_index", pa.int32()), ("context_id", pa.int32()), ("head", pa.string()),
+                         ("head_type", dictionary), ("relation", dictionary), ("tail", pa.string()),
+                         ("tail_type", dictionary), ("question", pa.string()), ("answer", pa.string())])
+    return contexts, triples
+
+
+def record_rows(record: Dict, sample_index: Optional[int] = None) -> List[Dict]:
+    """Return the rows of a record log entry, a KGC record or an RTE record (one row per triple)."""
+    if "kgc" in record:
+        rows = record_rows(record["kgc"], record.get("sample_index"))
+        for row in rows:
+            row["question"], row["answer"] = record.get("question"), record.get("answer")
+        return rows
+    if "triplet" in record:
+        return [{"sample_index": sample_index, "context": record.get("text description", ""),
+                 "head": item.get("subject"), "head_type": record.get("entity type"), "relation": item.get("predicate"),
+                 "tail": item.get("object"), "tail_type": None} for item in record["triplet"]]
+    return [{"sample_index": sample_index, "context": record.get("context", ""),
+             "head": record.get("head entity name"), "head_type": record.get("head entity type"),
+             "relation": record.get("relation"), "tail": record.get("tail entity name"),
+             "tail_type": record.get("tail entity type")}]
+
+
+class ColumnarWriter(RecordWriter):
+    """Writes triple rows (see record_rows) to a columnar dataset directory (requires pyarrow).
+
+    The dataset is two Arrow IPC files: contexts.arrow holds every distinct
+    context once, and triples.arrow one row per triple referencing its context
+    by row number, with entity types and relations dictionary-encoded. The
+    files are uncompressed so readers can memory-map them without copying, and
+    are moved into place when the writer is closed.
+    """
+
+    def __init__(self, path: str, batch_size: int = COLUMNAR_BATCH_SIZE):
+        super().__init__(path, batch_size)
+        import pyarrow as pa
+        os.makedirs(path, exist_ok=True)
+        self.schemas = _schemas()
+        # Only the new values of a dictionary are written with each batch
+        options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        self.sinks = [pa.OSFile(os.path.join(path, name + ".tmp"), "wb") for name in (CONTEXTS_FILE, TRIPLES_FILE)]
+        self.writers = [pa.ipc.new_file(sink, schema, options=options) for sink, schema in zip(self.sinks, self.schemas)]
+        self.context_ids: Dict[bytes, int] = {}  # context digest -> row number in contexts.arrow
+        self.dictionaries: Dict[str, Dict[str, int]] = {column: {} for column in _DICTIONARY_COLUMNS}
+        self.rows = 0
+
+    def append_record(self, record: Dict):
+        """Append the rows of a record log entry, KGC record or RTE record."""
+        for row in record_rows(record):
+            self.append(row)
+
+    def _encode(self, column: str, values: List[Optional[str]]):
+        import pyarrow as pa
+        ids = self.dictionaries[column]
+        indices = [None if value is None else ids.setdefault(value, len(ids)) for value in values]
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(list(ids), pa.string()))
+
+    def _write_batch(self, rows: List[Dict]):
+        import pyarrow as pa
+        contexts, context_ids = [], []
+        for row in rows:
+            digest = hashlib.sha1(row["context"].encode("utf-8")).digest()
+            if digest not in self.context_ids:
+                self.context_ids[digest] = len(self.context_ids)
+                contexts.append(row["context"])
+            context_ids.append(self.context_ids[digest])
+        if contexts:
+            self.writers[0].write_batch(pa.record_batch([pa.array(contexts, pa.large_string())], schema=self.schemas[0]))
+        columns = {
+            "sample_index": pa.array([row.get("sample_index") for row in rows], pa.int32()),
+            "context_id": pa.array(context_ids, pa.int32()),
+        }
+        for column in ("head", "tail", "question", "answer"):
+            columns[column] = pa.array([row.get(column) for row in rows], pa.string())
+        for column in _DICTIONARY_COLUMNS:
+            columns[column] = self._encode(column, [row.get(column) for row in rows])
+        self.writers[1].write_batch(pa.record_batch([columns[field.name] for field in self.schemas[1]],
+                                                    schema=self.schemas[1]))
+        self.rows += len(rows)
+
+    def close(self):
+        self.flush()
+        for writer, sink in zip(self.writers, self.sinks):
+            writer.close()
+            sink.close()
+        for name in (CONTEXTS_FILE, TRIPLES_FILE):
+            os.replace(os.path.join(self.path, name + ".tmp"), os.path.join(self.path, name))
+
+
+class ColumnarDataset:
+    """Read access to a columnar dataset; both files are memory-mapped, so opening it reads no row data."""
+
+    def __init__(self, path: str):
+        import pyarrow as pa
+        self.path = path
+        self.contexts = pa.ipc.open_file(pa.memory_map(os.path.join(path, CONTEXTS_FILE))).read_all()
+        self.triples = pa.ipc.open_file(pa.memory_map(os.path.join(path, TRIPLES_FILE))).read_all()
+
+    def __len__(self) -> int:
+        return self.triples.num_rows
+
+    def context(self, context_id: int) -> str:
+        return self.contexts.column("text")[context_id].as_py()
+
+    def columns(self, names: List[str]) -> Iterator[tuple]:
+        """Iterate over the rows as tuples of the context and the named columns.
+
+        Columns are decoded a record batch at a time; dictionary values are
+        decoded once per batch and rows of the same context share one string.
+        """
+        import pyarrow as pa
+        context_id, context = None, None
+        for batch in self.triples.to_batches():
+            columns = []
+            for name in names:
+                column = batch.column(name)
+                if pa.types.is_dictionary(column.type):
+                    values = column.dictionary.to_pylist()
+                    columns.append([None if index is None else values[index] for index in column.indices.to_pylist()])
+                else:
+                    columns.append(column.to_pylist())
+            contexts = []
+            for row_context_id in batch.column("context_id").to_pylist():
+                if row_context_id != context_id:
+                    context_id, context = row_context_id, self.context(row_context_id)
+                contexts.append(context)
+            yield from zip(contexts, *columns)
+
+    def rows(self) -> Iterator[Dict]:
+        """Iterate over the rows as dicts with the keys of record_rows."""
+        names = [name for name in self.triples.column_names if name != "context_id"]
+        for values in self.columns(names):
+            yield dict(zip(["context"] + names, values))
+
+    def iter_records(self, data_type: str) -> Iterator[Dict]:
+        """Iterate over the rows as KGC or RTE records, in the schema of kgc_output.json and rte_output.json."""
+        if data_type == "kgc":
+            for context, head, head_type, tail, tail_type, relation in self.columns(
+                    ["head", "head_type", "tail", "tail_type", "relation"]):
+                yield {"head entity name": head, "head entity type": head_type, "tail entity name": tail,
+                       "tail entity type": tail_type, "relation": relation, "context": context}
+        elif data_type == "rte":
+            for context, head, head_type, relation, tail in self.columns(["head", "head_type", "relation", "tail"]):
+                yield {"entity name": head, "entity type": head_type, "text description": context,
+                       "triplet": [{"subject": head, "predicate": relation, "object": tail}]}
+        else:
+            raise ValueError("Invalid data type. Only 'kgc' and 'rte' are supported.")
+
+    def stats(self) -> Dict:
+        files = {name: os.path.getsize(os.path.join(self.path, name)) for name in (CONTEXTS_FILE, TRIPLES_FILE)}
+        return {"triples": len(self), "contexts": self.contexts.num_rows,
+                "relations": len(set(self.triples.column("relation").to_pylist())), "bytes": files}
+
+
+def is_columnar(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, TRIPLES_FILE))
+
+
+def write_columnar(records: Iterable[Dict], path: str) -> int:
+    """Write record log entries, KGC records or RTE records to a columnar dataset; returns the number of rows."""
+    with ColumnarWriter(path) as writer:
+        for record in records:
+            writer.append_record(record)
+    return writer.rows
+
+
+def export_json(path: str, data_type: str, output_json: str):
+    """Write the KGC or RTE records of a columnar dataset as a JSON array file."""
+    write_json_array(ColumnarDataset(path).iter_records(data_type), output_json)
+
+
+if __name__ == "__main__":
+    # python columnar.py convert <records.jsonl|kgc_output.json|rte_output.json> <dataset>
+    # python columnar.py export <dataset> kgc|rte <output.json>
+    # python columnar.py stats <dataset>
+    if sys.argv[1] == "convert":
+        from writers import read_unique_records
+        source = read_unique_records(sys.argv[2]) if sys.argv[2].endswith(".jsonl") else iter_json_records(sys.argv[2])
+        print(f"Wrote {write_columnar(source, sys.argv[3])} rows to {sys.argv[3]}")
+    elif sys.argv[1] == "export":
+        export_json(sys.argv[2], sys.argv[3], sys.argv[4])
+    else:
+        print(ColumnarDataset(sys.argv[2]).stats())
@@ -8,8 +8,140 @@ OPENAI_BASE_URL = "BASE_URL"
 # Model configuration
 MODEL_NAME = "Model_Name"
 
+# Chat backend: "openai" uses the openai and Swarm clients; "http" sends requests over
+# pooled keep-alive connections to the OpenAI-compatible endpoint at OPENAI_BASE_URL
+# (e.g. the mock server of mock_backends.py)
+LLM_BACKEND = "openai"
+LLM_POOL_SIZE = 32  # Keep-alive connections of the "http" backend
+LLM_MAX_RETRIES = 5  # Retries for rate limit (429), server (5xx) and connection errors
+LLM_TIMEOUT = 60  # Seconds
+
 # File paths
 INPUT_XLSX = "test_data.xlsx"
 OUTPUT_XLSX = "output/output_t.xlsx"
 RTE_OUTPUT_JSON = "output/rte_output_t.json"
-KGC_OUTPUT_JSON = "output/kgc_output_t.json"
\ No newline at end of file
+KGC_OUTPUT_JSON = "output/kgc_output_t.json"
+RECORDS_OUTPUT = "output/records_t.jsonl"  # Append-only record log the files above are built from
+CHECKPOINT_PATH = "output/checkpoint_t.jsonl"  # Journal of completed samples and stages used by --resume
+
+# Output writer configuration
+OUTPUT_BACKEND = "jsonl"  # "jsonl" or "parquet" (requires pyarrow; RECORDS_OUTPUT is then a directory)
+WRITE_BATCH_SIZE = 50  # Number of records buffered before each fsync'd write
+DATASET_FORMAT = "json"  # "json" writes RTE_OUTPUT_JSON and KGC_OUTPUT_JSON; "columnar" writes COLUMNAR_OUTPUT instead (requires pyarrow)
+COLUMNAR_OUTPUT = "output/dataset_t"  # Columnar dataset directory; python columnar.py export writes the JSON files from it
+COLUMNAR_BATCH_SIZE = 10000  # Rows per Arrow record batch
+
+# GraphRAG configuration
+GRAPHRAG_BACKEND = "inprocess"  # "inprocess" keeps the index loaded; "subprocess" runs the CLI per query; "mock" needs no index
+GRAPHRAG_ROOT = "./test"
+GRAPHRAG_DATA_DIR = "test/output/20250115-130155/artifacts"
+GRAPHRAG_METHOD = "Global"  # "Global" or "Local"
+GRAPHRAG_COMMUNITY_LEVEL = 2
+GRAPHRAG_RESPONSE_TYPE = "Multiple Paragraphs"
+
+# LLM response cache
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = "cache/llm_cache.sqlite"
+LLM_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # Least recently used responses are evicted above this size
+LLM_CACHE_REPLAY_ONLY = False  # Serve cached responses only; uncached requests fail instead of calling the API
+
+# Structured output: the extractors and the Knowledge Graph Master return JSON
+# validated against a schema (requires a model supporting response_format)
+STRUCTURED_OUTPUT = False
+
+# Pipeline mode: how the extractor and the Knowledge Graph Master work together
+#   "legacy": the extractor runs, but the Knowledge Graph Master only gets the GraphRAG output
+#   "feed":   the Knowledge Graph Master also gets the extracted entities or relations
+#   "fused":  one Knowledge Graph Master call extracts the entities and generates the triples
+PIPELINE_MODE = "legacy"
+# Per-stage toggles: without the extractor "legacy" and "feed" run the Knowledge Graph Master alone;
+# without the verifier the locally validated triples are kept unverified
+PIPELINE_STAGES = {"extractor": True, "verifier": True}
+
+# Triple verification configuration
+MAX_VERIFIER_ROUNDS = 3  # Maximum regenerations from verifier feedback per sample
+MAX_LOCAL_REPAIRS = 3  # Maximum regenerations of triples failing the local checks per sample
+VERIFIER_TOKEN_BUDGET = 30000  # Maximum estimated prompt tokens spent on verification per sample
+KEEP_UNVERIFIED_TRIPLES = False  # Keep locally valid triples when the budget runs out before any verifier verdict
+ENTITY_MATCH_THRESHOLD = 0.6  # Fraction of an entity's words that must (fuzzily) appear in the context
+MAX_RELATION_WORDS = 6
+
+# Long contexts: GraphRAG outputs above CHUNK_MAX_TOKENS estimated tokens are split into
+# overlapping windows processed in parallel (0 to disable), and the verifier and QA prompts
+# of contexts above SUPPORT_MIN_TOKENS quote only the BM25-ranked sentences supporting each triple
+CHUNK_MAX_TOKENS = 1500
+CHUNK_OVERLAP_TOKENS = 150
+CHUNK_CONCURRENCY = 4  # Windows of one sample processed at the same time
+SUPPORT_SENTENCES = 4  # Supporting sentences per triple (0 to always send the full context)
+SUPPORT_MIN_TOKENS = 300
+
+# Knowledge graph store: distinct triples with interned entities/relations, shared across samples and runs
+GRAPH_STORE_ENABLED = True
+GRAPH_STORE_PATH = "output/graph_t.sqlite"
+REUSE_DUPLICATE_QA = True  # Reuse the question/answer of an equivalent triple instead of generating it again
+
+# Translation of the contexts before the GraphRAG query
+TRANSLATION_SKIP_ENGLISH = True  # Use contexts detected as English as they are, without a translation request
+TRANSLATION_MEMORY_PATH = "cache/translation_memory.sqlite"  # Translations reused across samples and runs ("" to disable)
+# Estimated shingle similarity for reusing a near-duplicate's translation; None reuses exact repeats only. Near-duplicates
+# with different numbers are never reused, but a changed word (e.g. "reduce"/"increase") can be, so only enable this for
+# corpora whose repeated contexts differ in formatting alone
+TRANSLATION_NEAR_DUPLICATE_THRESHOLD = None
+TRANSLATION_BATCH_SIZE = 8  # Contexts translated per request (1 = one request per context)
+TRANSLATION_BATCH_WAIT = 0.05  # Seconds to wait for more contexts before sending a partial batch
+
+# Near-duplicate triples (dedup.py): triples equal after normalization (case, articles, plurals,
+# relation synonyms) or with hashed n-gram embeddings at least DEDUP_THRESHOLD similar form one cluster
+DEDUP_ENABLED = True
+DEDUP_SCOPE = "sample"  # "sample" drops near-duplicates within a sample, "global" also those of earlier samples
+DEDUP_THRESHOLD = 0.9  # Weighted cosine similarity of head (0.4), relation (0.2) and tail (0.4)
+DEDUP_DIM = 64  # Embedding dimensions per field
+DEDUP_LSH_BANDS = 20  # SimHash LSH index: bands of DEDUP_LSH_BITS random hyperplanes
+DEDUP_LSH_BITS = 16
+
+# Evaluation API configuration (eval.py)
+EVAL_API_KEY = "YOUR_API_KEY_HERE"
+EVAL_API_BASE = "https://api.openai.com"  # scheme://host[:port]; http:// works for a local test server
+EVAL_MODEL = "gpt-4"
+EVAL_CONCURRENCY = 16  # Maximum evaluation requests in flight (also the connection pool size)
+EVAL_MAX_RETRIES = 5  # Retries for 429/5xx responses and connection errors
+EVAL_TIMEOUT = 60  # Seconds
+EVAL_BATCH_SIZE = 1  # Records sharing a context scored per request (1 = one request per record)
+EVAL_REUSE_DUPLICATES = True  # Reuse the stored evaluation of an equivalent triple (requires GRAPH_STORE_ENABLED)
+
+# Tracing: per-stage spans (wall time, tokens, cache hits, retries) written as JSON lines
+TRACE_ENABLED = True
+TRACE_PATH = "output/trace_t.jsonl"
+EVAL_TRACE_PATH = "eval_trace.jsonl"
+# USD per 1K prompt/completion tokens, used for the cost column of the run report
+TOKEN_PRICES = {
+    "gpt-4": {"prompt": 0.03, "completion": 0.06},
+    MODEL_NAME: {"prompt": 0.0, "completion": 0.0},
+}
+
+# Concurrency configuration
+MAX_CONCURRENT_SAMPLES = 4  # Number of samples in the pipeline at the same time (1 = sequential)
+ORDERED_OUTPUT = True  # Write results in input order; False writes each sample as soon as it finishes
+REORDER_BUFFER_SIZE = 64  # Finished samples held back until the samples before them are written (ORDERED_OUTPUT)
+QA_CONCURRENCY = 8  # Number of question/answer requests sent at the same time for one sample's triples
+# Staged execution: every stage has its own worker threads and a bounded input queue, so one
+# sample's GraphRAG retrieval overlaps other samples' LLM calls (see the queue report at the end).
+# Worker threads per stage (translate, graphrag, extract, verify, qa); unlisted stages get MAX_CONCURRENT_SAMPLES
+STAGE_WORKERS = {"graphrag": 2}
+STAGE_QUEUE_SIZE = 4  # Samples waiting in front of each stage
+
+# Rate limits per API endpoint (omit a key for no limit); models listed under "models"
+# get their own limits, the other models of the endpoint share the endpoint's limits
+RATE_LIMITS = {
+    OPENAI_BASE_URL: {"requests_per_minute": 500, "tokens_per_minute": 150000},
+}
+# Fraction of RATE_LIMITS one process may use; main.py --workers COUNT gives each worker 1/COUNT
+RATE_LIMIT_SHARE = 1.0
+
+# Adaptive request scheduling per endpoint and model (all LLM and evaluation requests)
+SCHEDULER_INITIAL_CONCURRENCY = 16  # Requests in flight at the start; raised on success, halved on 429/503
+SCHEDULER_MAX_CONCURRENCY = 64
+SCHEDULER_LATENCY_TARGET = None  # Seconds; slower responses also halve the concurrency (None to ignore latency)
+SCHEDULER_DEADLINE = 600  # Seconds a request may spend waiting and retrying before it is given up
+CIRCUIT_BREAKER_FAILURES = 10  # Consecutive failed attempts that pause all requests to the endpoint
+CIRCUIT_BREAKER_RESET = 30  # Seconds before a probe request is sent to a paused endpoint
@@ -0,0 +1,255 @@
+# dedup.py
+import sys
+import threading
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import DEDUP_ENABLED, DEDUP_THRESHOLD, DEDUP_DIM, DEDUP_LSH_BANDS, DEDUP_LSH_BITS
+from triples import Triple
+from validation import normalize
+
+_ARTICLES = {"the", "a", "an"}
+# Words that may differ between near-duplicates; any other differing word keeps triples apart
+_STOPWORDS = _ARTICLES | {"of", "and", "in", "on", "at", "for", "to", "with", "by", "from"}
+# Relation verbs with the same meaning, by their stemmed form
+RELATION_SYNONYMS = {
+    "manufacture": "produce", "make": "produce", "generate": "produce", "create": "produce", "output": "produce",
+    "use": "consume", "utilize": "consume", "utilise": "consume",
+    "provide": "supply", "deliver": "supply", "feed": "supply",
+    "contain": "include", "comprise": "include", "has": "include", "have": "include",
+    "release": "emit", "discharge": "emit",
+    "located in": "is located in", "situated in": "is located in", "is situated in": "is located in",
+    "belong to": "is part of", "is component of": "is part of", "is component in": "is part of",
+}
+# Field weights of the triple similarity: head, relation, tail
+_WEIGHTS = (0.4, 0.2, 0.4)
+
+
+def _stem(word: str) -> str:
+    """Strip the plural or third person -s of a word."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("sses", "shes", "ches", "xes", "zes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=1 << 18)
+def canonical(text: str, relation: bool = False) -> str:
+    """Canonical form of an entity or relation: normalized, without a leading article, plurals stemmed, relation synonyms merged."""
+    words = normalize(text).split()
+    if len(words) > 1 and words[0] in _ARTICLES:
+        words = words[1:]
+    words = [_stem(word) for word in words]
+    key = " ".join(words)
+    if relation:
+        key = RELATION_SYNONYMS.get(key, key)
+        if words and key == " ".join(words):
+            key = " ".join([RELATION_SYNONYMS.get(words[0], words[0])] + words[1:])
+    return key
+
+
+def canonical_triple(triple: Triple) -> Tuple[str, str, str]:
+    head, relation, tail = triple
+    return canonical(head), canonical(relation, relation=True), canonical(tail)
+
+
+def _content_words(key: Tuple[str, str, str]) -> Tuple[frozenset, frozenset]:
+    """Return the words of the canonical head and tail that are not stopwords."""
+    return tuple(frozenset(word for word in field.split() if word not in _STOPWORDS) for field in (key[0], key[2]))
+
+
+class TripleDeduplicator:
+    """Clusters near-duplicate triples in a stream, keeping the first triple of each cluster as its representative.
+
+    Triples with the same canonical form (see canonical) are the same cluster.
+    Other triples are embedded as hashed character 3-gram vectors of their
+    head, relation and tail (cached per distinct string) and looked up in a
+    SimHash LSH index over the representatives: `bands` bands of `bits` random
+    hyperplanes each. A candidate joins the cluster if the weighted cosine
+    similarity of the fields reaches `threshold`, the canonical relations are
+    equal and the head and tail have the same words apart from stopwords. A
+    single differing word often names a different thing ("Pump station A"/"B",
+    "Hot"/"Cold rolling mill") and similar relations often mean the opposite
+    ("increases"/"decreases"), so only word order, spacing and punctuation
+    differ within a cluster beyond what canonical() merges. Memory grows with
+    the number of distinct strings and canonical triples seen (the field vector
+    and canonical key caches) plus one vector per cluster.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, dim: int = DEDUP_DIM, bands: int = DEDUP_LSH_BANDS,
+                 bits: int = DEDUP_LSH_BITS, seed: int = 0):
+        import numpy as np
+        self.np = np
+        self.threshold = threshold
+        self.dim = dim
+        self.bands = bands
+        self.bits = bits
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((3 * dim, bands * bits)).astype(np.float32)
+        self.powers = (1 << np.arange(bits, dtype=np.int64))
+        self.lock = threading.Lock()
+        self.keys: Dict[Tuple[str, str, str], int] = {}  # canonical triple -> cluster id
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+        self.vectors = np.zeros((1024, 3 * dim), dtype=np.float16)  # vectors of the representatives
+        self.relations: List[str] = []  # canonical relations of the representatives
+        self.words: List[Tuple[frozenset, frozenset]] = []  # content words of their heads and tails
+        self.representatives: List[Triple] = []
+        self.field_vectors: Dict[str, "np.ndarray"] = {}
+        self.seen = 0
+
+    def _field_vector(self, text: str) -> "np.ndarray":
+        vector = self.field_vectors.get(text)
+        if vector is None:
+            np = self.np
+            vector = np.zeros(self.dim, dtype=np.float32)
+            padded = f" {text} "
+            for i in range(max(len(padded) - 2, 1)):
+                h = zlib.crc32(padded[i:i + 3].encode("utf-8"))
+                vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+            self.field_vectors[text] = vector
+        return vector
+
+    def _embed(self, keys: List[Tuple[str, str, str]]) -> "np.ndarray":
+        np = self.np
+        weights = [w ** 0.5 for w in _WEIGHTS]
+        return np.stack([np.concatenate([self._field_vector(field) * weight for field, weight in zip(key, weights)])
+                         for key in keys])
+
+    def _band_keys(self, vectors: "np.ndarray") -> "np.ndarray":
+        signs = (vectors @ self.planes > 0).reshape(len(vectors), self.bands, self.bits)
+        return signs.astype(self.np.int64) @ self.powers
+
+    def _new_cluster(self, triple: Triple, key: Tuple[str, str, str], vector, band_keys) -> int:
+        cluster = len(self.representatives)
+        if cluster == len(self.vectors):
+            self.vectors = self.np.concatenate([self.vectors, self.np.zeros_like(self.vectors)])
+        self.vectors[cluster] = vector
+        self.relations.append(key[1])
+        self.words.append(_content_words(key))
+        self.representatives.append(triple)
+        for band, band_key in enumerate(band_keys):
+            self.buckets.setdefault((band, int(band_key)), []).append(cluster)
+        return cluster
+
+    def assign(self, triples: List[Triple]) -> List[int]:
+        """Return the cluster id of each triple, creating clusters for new triples."""
+        with self.lock:
+            self.seen += len(triples)
+            keys = [canonical_triple(triple) for triple in triples]
+            clusters: List[Optional[int]] = [self.keys.get(key) for key in keys]
+            pending = [i for i, cluster in enumerate(clusters) if cluster is None]
+            if not pending:
+                return clusters
+            vectors = self._embed([keys[i] for i in pending])
+            band_keys = self._band_keys(vectors)
+            for row, i in enumerate(pending):
+                key = keys[i]
+                if key in self.keys:  # An earlier triple of this batch
+                    clusters[i] = self.keys[key]
+                    continue
+                candidates = {cluster for band, band_key in enumerate(band_keys[row])
+                              for cluster in self.buckets.get((band, int(band_key)), ())}
+                words = _content_words(key)
+                candidates = [cluster for cluster in candidates
+                              if self.relations[cluster] == key[1] and self.words[cluster] == words]
+                cluster = None
+                if candidates:
+                    similarities = self.vectors[candidates].astype(self.np.float32) @ vectors[row]
+                    best = int(similarities.argmax())
+                    if similarities[best] >= self.threshold:
+                        cluster = candidates[best]
+                if cluster is None:
+                    cluster = self._new_cluster(triples[i], key, vectors[row], band_keys[row])
+                self.keys[key] = cluster
+                clusters[i] = cluster
+            return clusters
+
+    def representative(self, triple: Triple) -> Triple:
+        """Return the representative of the triple's cluster (the first equivalent triple seen)."""
+        return self.representatives[self.assign([triple])[0]]
+
+    def collapse(self, triples: List[Triple], seen_clusters: Optional[set] = None) -> List[Triple]:
+        """Keep the first triple of each cluster, in order.
+
+        Clusters in `seen_clusters` (e.g. those of earlier samples) are dropped
+        as well; the clusters kept are added to it.
+        """
+        seen_clusters = set() if seen_clusters is None else seen_clusters
+        kept = []
+        for triple, cluster in zip(triples, self.assign(triples)):
+            if cluster not in seen_clusters:
+                seen_clusters.add(cluster)
+                kept.append(triple)
+        return kept
+
+    def stats(self) -> Dict[str, int]:
+        return {"triples": self.seen, "clusters": len(self.representatives), "canonical_forms": len(self.keys)}
+
+
+_deduplicator: Optional[TripleDeduplicator] = None
+_global_clusters: set = set()
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator() -> Optional[TripleDeduplicator]:
+    """Return the deduplicator shared by this process, or None if deduplication is disabled."""
+    global _deduplicator
+    if not DEDUP_ENABLED:
+        return None
+    with _deduplicator_lock:
+        if _deduplicator is None:
+            _deduplicator = TripleDeduplicator()
+        return _deduplicator
+
+
+def collapse_triples(triples: List[Triple], scope: str = "sample") -> List[Triple]:
+    """Drop near-duplicate triples: within the list ("sample") or also of earlier lists in this process ("global")."""
+    deduplicator = get_deduplicator()
+    if deduplicator is None:
+        return triples
+    if scope == "global":
+        with _deduplicator_lock:
+            return deduplicator.collapse(triples, _global_clusters)
+    if scope != "sample":
+        raise ValueError(f"Unsupported deduplication scope: {scope}")
+    return deduplicator.collapse(triples)
+
+
+def dedup_key(triple: Triple) -> Triple:
+    """Return the triple under which results of the triple's cluster are stored (itself without deduplication)."""
+    deduplicator = get_deduplicator()
+    return deduplicator.representative(triple) if deduplicator is not None else triple
+
+
+def iter_record_triples(path: str) -> Iterable[Triple]:
+    from writers import iter_json_records
+    for record in iter_json_records(path):
+        if "triplet" in record:
+            for item in record["triplet"]:
+                yield Triple(item["subject"], item["predicate"], item["object"])
+        elif "relation" in record:
+            yield Triple(record["head entity name"], record["relation"], record["tail entity name"])
+
+
+if __name__ == "__main__":
+    # python dedup.py kgc_output.json: cluster the triples of an output file and print the largest clusters
+    deduplicator = TripleDeduplicator()
+    members: Dict[int, List[Triple]] = {}
+    batch: List[Triple] = []
+    for record_triple in iter_record_triples(sys.argv[1]):
+        batch.append(record_triple)
+        if len(batch) == 10000:
+            for member, cluster_id in zip(batch, deduplicator.assign(batch)):
+                members.setdefault(cluster_id, []).append(member)
+            batch = []
+    for member, cluster_id in zip(batch, deduplicator.assign(batch)):
+        members.setdefault(cluster_id, []).append(member)
+    print(deduplicator.stats())
+    for cluster_id, cluster in sorted(members.items(), key=lambda item: -len(item[1]))[:10]:
+        print(f"{len(cluster):>6}  {deduplicator.representatives[cluster_id]}  e.g. {cluster[-1]}")
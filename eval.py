@@ -1,72 +1,90 @@
 import os
 import json
-import http.client
-from tqdm import tqdm
-
-# Custom API key and URL
-openai.api_key = GPT4_OPENAI_API_KEY
-openai.base_url = GPT4_OPENAI_BASE_URL
-
-# Print current working directory
-print("Current working directory:", os.getcwd())
+import hashlib
+from functools import lru_cache
+import threading
+from config import (EVAL_API_BASE, EVAL_API_KEY, EVAL_MODEL, EVAL_CONCURRENCY, EVAL_MAX_RETRIES, EVAL_TIMEOUT,
+                    EVAL_BATCH_SIZE, EVAL_TRACE_PATH, EVAL_REUSE_DUPLICATES)
+from cache import cached_call, get_response_cache, CacheMiss
+from http_pool import ChatCompletionClient
+from scheduler import bounded_map, get_scheduler, estimate_tokens
+from structured_output import repair_json
+from writers import iter_json_records, write_json_array
+from columnar import ColumnarDataset, is_columnar
+from tracing import span, start_trace, stop_trace, print_report
+from graph_store import get_graph_store
+from triples import Triple
+from dedup import dedup_key
 
 # Dataset file paths
 kgc_file = "kgc_output.json"
 rte_file = "rte_output.json"
-
-# Check if files exist
-print(f"Checking if {kgc_file} exists:", os.path.exists(kgc_file))
-print(f"Checking if {rte_file} exists:", os.path.exists(rte_file))
+columnar_dir = "dataset"  # Columnar dataset used when the JSON files above are missing
 
 
-def load_dataset(file_path):
+def iter_dataset(file_path, data_type=None):
     """
-    Load dataset from a JSON file with array format.
+    Iterate over the records of a dataset file without loading it into memory.
+    Supports JSON array files, JSON lines (.jsonl) files and columnar dataset
+    directories, whose records are returned as `data_type` ("kgc" or "rte") records.
     """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File {file_path} not found.")
+    if is_columnar(file_path):
+        yield from ColumnarDataset(file_path).iter_records(data_type)
+        return
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)  # Load JSON array
-            if not isinstance(data, list):  # Ensure it's a list
-                raise ValueError("Dataset is not a JSON array.")
-            print(f"Loaded {len(data)} entries from {file_path}")
-            return data
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON file: {e}")
-            raise
+    try:
+        yield from iter_json_records(file_path)
+    except ValueError as e:
+        print(f"Error decoding JSON file: {e}")
+        raise
+
+
+def load_dataset(file_path, data_type=None):
+    """
+    Load a whole dataset into a list. Prefer iter_dataset for large files.
+    """
+    data = list(iter_dataset(file_path, data_type))
+    print(f"Loaded {len(data)} entries from {file_path}")
+    return data
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_eval_client():
+    """Return the shared evaluation API client with its keep-alive connection pool."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ChatCompletionClient(EVAL_API_BASE, EVAL_API_KEY, EVAL_MODEL, pool_size=EVAL_CONCURRENCY,
+                                           timeout=EVAL_TIMEOUT)
+        return _client
 
 
 # Call custom API
 def call_custom_api(prompt):
-    conn = http.client.HTTPSConnection(api_url)
-    payload = json.dumps({
-        "model": "gpt-4",
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
-        "stream": False
-    })
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json'
-    }
+    messages = [{"role": "user", "content": prompt}]
     try:
-        conn.request("POST", "/v1/chat/completions", payload, headers)
-        res = conn.getresponse()
-        data = res.read()
-        response = json.loads(data.decode("utf-8"))
-        print(f"API Response: {response}")  # Add log
-        if 'choices' in response:
-            generated_text = response['choices'][0]['message']['content']
-            return generated_text
-        else:
-            print(f"Unexpected response format: {response}")
-            return None
+        return cached_call(lambda: request_custom_api(prompt), model=EVAL_MODEL, instructions=None,
+                           messages=messages, params={})
+    except CacheMiss as e:
+        print(e)
+        return None
+
+
+def request_custom_api(prompt):
+    messages = [{"role": "user", "content": prompt}]
+    try:
+        response = get_scheduler(EVAL_API_BASE, EVAL_MODEL).call(lambda: get_eval_client().complete(messages),
+                                                                 estimate_tokens(prompt), max_retries=EVAL_MAX_RETRIES)
     except Exception as e:
         print(f"Error during API call: {e}")
         return None
+    print(f"API Response: {response}")  # Add log
+    return response
 
 
 def construct_prompt(data, data_type):
@@ -126,106 +144,357 @@ def construct_prompt(data, data_type):
         raise ValueError("Invalid data type. Only 'kgc' and 'rte' are supported.")
 
 
-# Create dataset
-try:
-    kgc_dataset = load_dataset(kgc_file)
-except FileNotFoundError:
-    print(f"KGC dataset file '{kgc_file}' not found.")
-    kgc_dataset = []
+def record_context(data, data_type):
+    """
+    Return the context text a record is evaluated against.
+    """
+    return data.get("context", "") if data_type == "kgc" else data.get("text description", "")
+
+
+def construct_batch_prompt(batch, data_type):
+    """
+    Construct one evaluation prompt for several (id, record) pairs sharing a context.
+    The shared context and the instructions are only included once.
+    """
+    context = record_context(batch[0][1], data_type)
+    if data_type == "kgc":
+        prompt = "Evaluate each of the following knowledge graph triplets"
+    elif data_type == "rte":
+        prompt = "Evaluate the reasoning triplets of each of the following records"
+    else:
+        raise ValueError("Invalid data type. Only 'kgc' and 'rte' are supported.")
+    prompt += f" against the shared context.\nContext: {context}\n" if context else ".\n"
+
+    for record_id, data in batch:
+        if data_type == "kgc":
+            prompt += (
+                f"\nRecord {record_id}:\n"
+                f"Head Entity: {data.get('head entity name', 'N/A')}\n"
+                f"Relation: {data.get('relation', 'N/A')}\n"
+                f"Tail Entity: {data.get('tail entity name', 'N/A')}\n"
+            )
+        else:
+            prompt += (
+                f"\nRecord {record_id}:\n"
+                f"Entity Name: {data.get('entity name', 'N/A')}\n"
+                f"Entity Type: {data.get('entity type', 'N/A')}\n"
+                f"Triplets: {json.dumps(data.get('triplet', []), ensure_ascii=False)}\n"
+            )
+
+    criteria = "accuracy and completeness" if data_type == "kgc" else "logical consistency and correctness"
+    prompt += (
+        f"\nPlease evaluate the {criteria} of every record. "
+        "Return a JSON array with one object per record in the following format:\n"
+        "[{\"id\": <record id>, \"Answer\": \"Yes/No\", \"Suggestions\": \"Details\", \"Confidence\": <score>}]. "
+        "Where <score> is a number between 0 and 5 representing your confidence level."
+    )
+    return prompt
+
+
+def parse_batch_response(response, record_ids):
+    """
+    Parse a batch evaluation response into {record id: result}.
+    Entries that are missing, malformed or for unknown ids are left out.
+    """
+    try:
+        entries = repair_json(response, {"type": "array"})
+    except ValueError as e:
+        print(f"Invalid batch response format: {e}")
+        return {}
+    if not isinstance(entries, list):
+        return {}
+    results = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            record_id = int(entry.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if record_id in record_ids and "Answer" in entry and "Suggestions" in entry and "Confidence" in entry:
+            results[record_id] = {key: entry[key] for key in ("Answer", "Suggestions", "Confidence")}
+    return results
 
-try:
-    rte_dataset = load_dataset(rte_file)
-except FileNotFoundError:
-    print(f"RTE dataset file '{rte_file}' not found.")
-    rte_dataset = []
 
+def iter_batches(dataset, data_type, batch_size):
+    """
+    Group consecutive (index, record) pairs that share a context into batches of up to `batch_size`.
+    Records of one sample are written consecutively, so this groups them without buffering the dataset.
+    """
+    batch = []
+    for index, item in enumerate(dataset):
+        if batch and (len(batch) >= batch_size or
+                      record_context(item, data_type) != record_context(batch[0][1], data_type)):
+            yield batch
+            batch = []
+        batch.append((index, item))
+    if batch:
+        yield batch
+
+
+# Evaluate a single record
+def evaluate_record(item, data_type):
+    prompt = construct_prompt(item, data_type)
+    print(f"Prompt: {prompt}")  # Add log
+    response = call_custom_api(prompt)
+    if response:
+        try:
+            result = json.loads(response)
+            # Verify result format
+            if "Answer" in result and "Suggestions" in result and "Confidence" in result:
+                return result
+            else:
+                print(f"Missing fields in response: {result}")
+                return {"Answer": "Invalid", "Suggestions": response}
+        except json.JSONDecodeError:
+            print(f"Invalid response format: {response}")
+            return {"Answer": "Invalid", "Suggestions": response}
+    else:
+        return {"Answer": "Error", "Suggestions": "API call failed."}
+
+
+def record_triple(data, data_type):
+    """
+    Return the triple a record evaluates, or None if it does not hold exactly one.
+    """
+    if data_type == "kgc":
+        parts = (data.get("head entity name"), data.get("relation"), data.get("tail entity name"))
+    else:
+        triplets = data.get("triplet", [])
+        if len(triplets) != 1 or not isinstance(triplets[0], dict):
+            return None
+        parts = (triplets[0].get("subject"), triplets[0].get("predicate"), triplets[0].get("object"))
+    return Triple(*parts) if all(isinstance(part, str) and part for part in parts) else None
+
+
+@lru_cache(maxsize=None)
+def evaluator_version(data_type):
+    """
+    Return a hash of the evaluator model and prompts: stored evaluations are only
+    reused while the model, the prompt templates and the batch mode are unchanged.
+    """
+    placeholder = {key: f"<{key}>" for key in ("head entity name", "tail entity name", "relation", "context",
+                                               "entity name", "entity type", "text description")}
+    prompts = [construct_prompt(placeholder, data_type)]
+    if EVAL_BATCH_SIZE > 1:
+        prompts.append(construct_batch_prompt([(0, placeholder)], data_type))
+    return hashlib.sha256(json.dumps([EVAL_MODEL, prompts]).encode("utf-8")).hexdigest()
+
+
+def evaluation_key(data, data_type):
+    """
+    Return (triple, evaluator) under which the evaluation of a record is stored, or None.
+    The triple is its cluster's representative; the evaluator combines the
+    evaluator version with the context the record is judged against.
+    """
+    triple = record_triple(data, data_type)
+    if triple is None:
+        return None
+    context = record_context(data, data_type)
+    evaluator = hashlib.sha256(f"{evaluator_version(data_type)}\n{context}".encode("utf-8")).hexdigest()
+    return dedup_key(triple), evaluator
+
+
+# Evaluate a batch of records sharing a context
+def evaluate_batch(batch, data_type):
+    """
+    Evaluate a batch of (index, record) pairs with one request and return (index, result) pairs.
+    Records the batch response does not cover are evaluated one by one.
+    With EVAL_REUSE_DUPLICATES, records whose triple (or a near-duplicate of it, see dedup.py)
+    was evaluated before against the same context by the same model and prompts reuse that result.
+    """
+    store = get_graph_store() if EVAL_REUSE_DUPLICATES else None
+    if store is None:
+        with span("eval", data_type=data_type, records=len(batch)):
+            return _evaluate_batch(batch, data_type)
+
+    results, pending = [], []
+    for index, item in batch:
+        key = evaluation_key(item, data_type)
+        stored = store.get_evaluation(key[0], data_type, key[1]) if key is not None else None
+        if stored is not None:
+            results.append((index, stored))
+        else:
+            pending.append((index, item))
+    if pending:
+        with span("eval", data_type=data_type, records=len(pending)):
+            evaluated = _evaluate_batch(pending, data_type)
+        items = dict(pending)
+        for index, result in evaluated:
+            key = evaluation_key(items[index], data_type)
+            if key is not None and str(result.get("Answer", "")).lower() in ("yes", "no"):
+                store.put_evaluation(key[0], data_type, key[1], result)
+        results.extend(evaluated)
+    return sorted(results, key=lambda entry: entry[0])
+
+
+def _evaluate_batch(batch, data_type):
+    if len(batch) == 1:
+        index, item = batch[0]
+        return [(index, evaluate_record(item, data_type))]
+
+    prompt = construct_batch_prompt(batch, data_type)
+    print(f"Prompt: {prompt}")  # Add log
+    response = call_custom_api(prompt)
+    covered = parse_batch_response(response, {index for index, _ in batch}) if response else {}
 
-# Evaluate dataset
-def evaluate_dataset(dataset, data_type):
     results = []
-    for item in tqdm(dataset, desc=f"Evaluating {data_type} dataset"):
-        prompt = construct_prompt(item, data_type)
-        print(f"Prompt: {prompt}")  # Add log
-        response = call_custom_api(prompt)
-        if response:
-            try:
-                result = json.loads(response)
-                # Verify result format
-                if "Answer" in result and "Suggestions" in result and "Confidence" in result:
-                    results.append(result)
-                else:
-                    print(f"Missing fields in response: {result}")
-                    results.append({"Answer": "Invalid", "Suggestions": response})
-            except json.JSONDecodeError:
-                print(f"Invalid response format: {response}")
-                results.append({"Answer": "Invalid", "Suggestions": response})
+    for index, item in batch:
+        if index in covered:
+            results.append((index, covered[index]))
         else:
-            results.append({"Answer": "Error", "Suggestions": "API call failed."})
+            print(f"Record {index} not covered by the batch response, evaluating it on its own.")
+            results.append((index, evaluate_record(item, data_type)))
     return results
 
 
-# Calculate accuracy and confidence
-def calculate_metrics(results):
-    correct_count = sum(1 for r in results if r.get("Answer", "").lower() == "yes")
-    incorrect_count = sum(1 for r in results if r.get("Answer", "").lower() == "no")
-    total = len(results)
-    accuracy = correct_count / total if total > 0 else 0
+# Evaluate dataset
+def evaluate_dataset(dataset, data_type, stream_path=None, concurrency=EVAL_CONCURRENCY, batch_size=EVAL_BATCH_SIZE,
+                     total=None):
+    """
+    Evaluate the records of an iterable dataset with up to `concurrency` requests in flight
+    and yield (index, result) pairs in dataset order.
+    With `batch_size` > 1, consecutive records sharing a context are scored
+    together in one request. Results are also appended to `stream_path` (JSON
+    lines with the record index). Only the requests in flight are held in memory.
+    """
+    from tqdm import tqdm
+    if total is None and hasattr(dataset, "__len__"):
+        total = len(dataset)
+    stream = open(stream_path, "w", encoding="utf-8") if stream_path else None
+    try:
+        completed = bounded_map(lambda batch: evaluate_batch(batch, data_type),
+                                iter_batches(dataset, data_type, batch_size), concurrency, ordered=True)
+        with tqdm(total=total, desc=f"Evaluating {data_type} dataset") as progress:
+            for _, batch_results in completed:
+                if stream:
+                    stream.write("".join(json.dumps({"index": index, "result": result}, ensure_ascii=False) + "\n"
+                                         for index, result in batch_results))
+                    stream.flush()
+                progress.update(len(batch_results))
+                yield from batch_results
+    finally:
+        if stream:
+            stream.close()
+
+
+class MetricsAggregator:
+    """
+    Online accuracy and confidence metrics, updated one result at a time in constant memory.
+    """
 
-    confidence_scores = []
-    for r in results:
-        suggestions = r.get("Suggestions", "")
-        confidence = r.get("Confidence", None)
+    def __init__(self):
+        self.total = 0
+        self.correct = 0
+        self.incorrect = 0
+        self.confidence_count = 0
+        self.confidence_sum = 0.0
+        self.confidence_histogram = [0] * 6  # Confidence scores 0-5, rounded down
+
+    def add(self, result):
+        self.total += 1
+        answer = str(result.get("Answer", "")).lower()
+        if answer == "yes":
+            self.correct += 1
+        elif answer == "no":
+            self.incorrect += 1
+
+        suggestions = result.get("Suggestions", "")
+        confidence = result.get("Confidence", None)
         print(f"Suggestions: {suggestions}")  # Add log
         print(f"Confidence: {confidence}")  # Add log
-        if confidence is not None:
-            try:
-                confidence_score = float(confidence)
-                if 0 <= confidence_score <= 5:
-                    confidence_scores.append(confidence_score)
-                else:
-                    print(f"Confidence score out of range: {confidence_score}")
-            except ValueError:
-                print(f"Failed to parse confidence score from: {confidence}")
-        else:
+        if confidence is None:
             print("Confidence score not found in response.")
-    average_confidence = sum(confidence_scores) / len(confidence_scores) if confidence_scores else 0
+            return
+        try:
+            confidence_score = float(confidence)
+        except (TypeError, ValueError):
+            print(f"Failed to parse confidence score from: {confidence}")
+            return
+        if 0 <= confidence_score <= 5:
+            self.confidence_count += 1
+            self.confidence_sum += confidence_score
+            self.confidence_histogram[int(confidence_score)] += 1
+        else:
+            print(f"Confidence score out of range: {confidence_score}")
 
-    # Add more logs
-    print(f"Total Entries: {total}")
-    print(f"Correct Answers: {correct_count}")
-    print(f"Incorrect Answers: {incorrect_count}")
+    @property
+    def accuracy(self):
+        return self.correct / self.total if self.total > 0 else 0
 
-    return accuracy, average_confidence
+    @property
+    def average_confidence(self):
+        return self.confidence_sum / self.confidence_count if self.confidence_count else 0
 
+    def report(self):
+        print(f"Total Entries: {self.total}")
+        print(f"Correct Answers: {self.correct}")
+        print(f"Incorrect Answers: {self.incorrect}")
+        print(f"Confidence Histogram (0-5): {self.confidence_histogram}")
 
-# Main function
-def main():
-    try:
-        kgc_dataset = load_dataset(kgc_file)
-        rte_dataset = load_dataset(rte_file)
-    except FileNotFoundError as e:
-        print(e)
-        return
 
-    print("Evaluating KGC dataset...")
-    kgc_results = evaluate_dataset(kgc_dataset, "kgc")
-    print("Evaluating RTE dataset...")
-    rte_results = evaluate_dataset(rte_dataset, "rte")
+# Calculate accuracy and confidence
+def calculate_metrics(results):
+    metrics = MetricsAggregator()
+    for r in results:
+        metrics.add(r)
+    metrics.report()
+    return metrics.accuracy, metrics.average_confidence
 
-    print("Calculating metrics for KGC dataset...")
-    kgc_accuracy, kgc_confidence = calculate_metrics(kgc_results)
-    print(f"KGC Dataset - Accuracy: {kgc_accuracy:.2f}, Average Confidence: {kgc_confidence:.2f}")
 
-    print("Calculating metrics for RTE dataset...")
-    rte_accuracy, rte_confidence = calculate_metrics(rte_results)
-    print(f"RTE Dataset - Accuracy: {rte_accuracy:.2f}, Average Confidence: {rte_confidence:.2f}")
+def evaluate_file(file_path, data_type, results_json, stream_path):
+    """
+    Evaluate a dataset file in a single streaming pass: results are written to
+    `results_json` and `stream_path` and aggregated into metrics as they arrive.
+    """
+    metrics = MetricsAggregator()
 
-    # Save results
-    with open("kgc_results.json", "w", encoding="utf-8") as f:
-        json.dump(kgc_results, f, ensure_ascii=False, indent=4)
-    with open("rte_results.json", "w", encoding="utf-8") as f:
-        json.dump(rte_results, f, ensure_ascii=False, indent=4)
+    def results():
+        for _, result in evaluate_dataset(iter_dataset(file_path, data_type), data_type, stream_path):
+            metrics.add(result)
+            yield result
 
+    write_json_array(results(), results_json)
+    return metrics
+
+
+# Main function
+def main():
+    # Print current working directory
+    print("Current working directory:", os.getcwd())
+
+    files = {}
+    for data_type, file_path in (("kgc", kgc_file), ("rte", rte_file)):
+        if not os.path.exists(file_path) and is_columnar(columnar_dir):
+            file_path = columnar_dir
+        if not os.path.exists(file_path):
+            print(f"File {file_path} not found.")
+            return
+        files[data_type] = file_path
+
+    # Results are saved and metrics aggregated while the datasets are evaluated
+    tracer = start_trace(EVAL_TRACE_PATH)
+    try:
+        print("Evaluating KGC dataset...")
+        kgc_metrics = evaluate_file(files["kgc"], "kgc", "kgc_results.json", "kgc_results.jsonl")
+        print("Evaluating RTE dataset...")
+        rte_metrics = evaluate_file(files["rte"], "rte", "rte_results.json", "rte_results.jsonl")
+    finally:
+        stop_trace()
+
+    print("Metrics for KGC dataset:")
+    kgc_metrics.report()
+    print(f"KGC Dataset - Accuracy: {kgc_metrics.accuracy:.2f}, Average Confidence: {kgc_metrics.average_confidence:.2f}")
+
+    print("Metrics for RTE dataset:")
+    rte_metrics.report()
+    print(f"RTE Dataset - Accuracy: {rte_metrics.accuracy:.2f}, Average Confidence: {rte_metrics.average_confidence:.2f}")
+
+    cache = get_response_cache()
+    if cache is not None:
+        print(f"LLM response cache: {cache.stats()}")
+    if tracer is not None:
+        print_report(tracer.path)
     print("Evaluation completed. Results saved.")
 
 
@@ -0,0 +1,200 @@
+# graph_store.py
+import json
+import os
+import sqlite3
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import GRAPH_STORE_ENABLED, GRAPH_STORE_PATH
+from triples import Triple
+from validation import normalize
+
+
+class GraphStore:
+    """Cross-sample knowledge graph of the generated triples, stored in SQLite.
+
+    Entities and relations are interned by their normalized form (the first
+    spelling seen is kept for display), and indexes on the head and tail ids
+    serve as adjacency lists. Each distinct triple counts the samples it occurs
+    in and keeps its generated questions/answers and evaluation results, so
+    duplicates can reuse them.
+    """
+
+    def __init__(self, path: str = GRAPH_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS entities (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, name TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS relations (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, name TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS triples ("
+            " id INTEGER PRIMARY KEY, head_id INTEGER NOT NULL, relation_id INTEGER NOT NULL, tail_id INTEGER NOT NULL,"
+            " occurrences INTEGER NOT NULL DEFAULT 0, first_sample INTEGER,"
+            " UNIQUE (head_id, relation_id, tail_id));"
+            "CREATE INDEX IF NOT EXISTS triples_tail ON triples (tail_id);"
+            "CREATE TABLE IF NOT EXISTS triple_samples ("
+            " triple_id INTEGER NOT NULL, sample INTEGER NOT NULL, PRIMARY KEY (triple_id, sample));"
+            "CREATE TABLE IF NOT EXISTS triple_qa ("
+            " triple_id INTEGER NOT NULL, generator TEXT NOT NULL, question TEXT NOT NULL, answer TEXT NOT NULL,"
+            " PRIMARY KEY (triple_id, generator));"
+            "CREATE TABLE IF NOT EXISTS triple_evaluations ("
+            " triple_id INTEGER NOT NULL, data_type TEXT NOT NULL, evaluator TEXT NOT NULL, result TEXT NOT NULL,"
+            " PRIMARY KEY (triple_id, data_type, evaluator));"
+        )
+        self.conn.commit()
+        # In-memory intern tables: normalized key -> id
+        self.entity_ids: Dict[str, int] = dict(self.conn.execute("SELECT key, id FROM entities"))
+        self.relation_ids: Dict[str, int] = dict(self.conn.execute("SELECT key, id FROM relations"))
+
+    def _intern(self, table: str, ids: Dict[str, int], name: str) -> int:
+        key = normalize(name)
+        if key not in ids:
+            self.conn.execute(f"INSERT OR IGNORE INTO {table} (key, name) VALUES (?, ?)", (key, name))
+            # Another process may have interned the key first
+            ids[key] = self.conn.execute(f"SELECT id FROM {table} WHERE key = ?", (key,)).fetchone()[0]
+        return ids[key]
+
+    def _ids(self, triple: Triple, create: bool) -> Optional[Tuple[int, int, int]]:
+        head, relation, tail = triple
+        if not create:
+            keys = (normalize(head), normalize(relation), normalize(tail))
+            if keys[0] not in self.entity_ids or keys[1] not in self.relation_ids or keys[2] not in self.entity_ids:
+                return None
+            return self.entity_ids[keys[0]], self.relation_ids[keys[1]], self.entity_ids[keys[2]]
+        return (self._intern("entities", self.entity_ids, head), self._intern("relations", self.relation_ids, relation),
+                self._intern("entities", self.entity_ids, tail))
+
+    def _triple_id(self, triple: Triple) -> Optional[int]:
+        ids = self._ids(triple, create=False)
+        if ids is None:
+            return None
+        row = self.conn.execute("SELECT id FROM triples WHERE head_id = ? AND relation_id = ? AND tail_id = ?",
+                                ids).fetchone()
+        return row[0] if row else None
+
+    def add_triples(self, triples: List[Triple], sample_index: Optional[int] = None):
+        """Add the triples of a sample to the graph, counting the samples each triple occurs in.
+
+        Adding the same triple for the same sample again, e.g. when a sample is
+        redone after a resume or in a later run, does not count it twice.
+        """
+        with self.lock:
+            for triple in triples:
+                ids = self._ids(triple, create=True)
+                self.conn.execute("INSERT OR IGNORE INTO triples (head_id, relation_id, tail_id, first_sample) "
+                                  "VALUES (?, ?, ?, ?)", ids + (sample_index,))
+                triple_id = self._triple_id(triple)
+                if sample_index is not None:
+                    new = self.conn.execute("INSERT OR IGNORE INTO triple_samples (triple_id, sample) VALUES (?, ?)",
+                                            (triple_id, sample_index)).rowcount
+                    if not new:
+                        continue
+                self.conn.execute("UPDATE triples SET occurrences = occurrences + 1 WHERE id = ?", (triple_id,))
+            self.conn.commit()
+
+    def get_qa(self, triple: Triple, generator: str) -> Optional[Tuple[str, str]]:
+        """Return the question and answer generated earlier for an equivalent triple.
+
+        `generator` identifies what the answer depends on besides the triple
+        (model, prompt and context, see utils.qa_generator); answers of other
+        generators are not returned.
+        """
+        with self.lock:
+            triple_id = self._triple_id(triple)
+            if triple_id is None:
+                return None
+            row = self.conn.execute("SELECT question, answer FROM triple_qa WHERE triple_id = ? AND generator = ?",
+                                    (triple_id, generator)).fetchone()
+            return tuple(row) if row else None
+
+    def put_qa(self, triple: Triple, generator: str, question: str, answer: str):
+        """Store the question and answer of a triple (the first one stored per generator is kept)."""
+        with self.lock:
+            ids = self._ids(triple, create=True)
+            self.conn.execute("INSERT OR IGNORE INTO triples (head_id, relation_id, tail_id) VALUES (?, ?, ?)", ids)
+            triple_id = self._triple_id(triple)
+            self.conn.execute("INSERT OR IGNORE INTO triple_qa (triple_id, generator, question, answer) "
+                              "VALUES (?, ?, ?, ?)", (triple_id, generator, question, answer))
+            self.conn.commit()
+
+    def get_evaluation(self, triple: Triple, data_type: str, evaluator: str) -> Optional[Dict]:
+        """Return the evaluation result of an equivalent triple for a dataset type ("kgc" or "rte").
+
+        `evaluator` identifies what the result depends on besides the triple
+        (model, prompts and context, see eval.evaluation_key); results of other
+        evaluators are not returned.
+        """
+        with self.lock:
+            triple_id = self._triple_id(triple)
+            if triple_id is None:
+                return None
+            row = self.conn.execute(
+                "SELECT result FROM triple_evaluations WHERE triple_id = ? AND data_type = ? AND evaluator = ?",
+                (triple_id, data_type, evaluator)).fetchone()
+            return json.loads(row[0]) if row else None
+
+    def put_evaluation(self, triple: Triple, data_type: str, evaluator: str, result: Dict):
+        with self.lock:
+            ids = self._ids(triple, create=True)
+            self.conn.execute("INSERT OR IGNORE INTO triples (head_id, relation_id, tail_id) VALUES (?, ?, ?)", ids)
+            triple_id = self._triple_id(triple)
+            self.conn.execute("INSERT OR IGNORE INTO triple_evaluations (triple_id, data_type, evaluator, result) "
+                              "VALUES (?, ?, ?, ?)", (triple_id, data_type, evaluator, json.dumps(result, ensure_ascii=False)))
+            self.conn.commit()
+
+    def neighbors(self, entity: str, direction: str = "both") -> List[Tuple[str, str, str]]:
+        """Return (direction, relation, entity) for the edges of an entity; direction is "out", "in" or "both"."""
+        with self.lock:
+            entity_id = self.entity_ids.get(normalize(entity))
+            if entity_id is None:
+                return []
+            edges = []
+            if direction in ("out", "both"):
+                edges += self.conn.execute(
+                    "SELECT 'out', r.name, e.name FROM triples t JOIN relations r ON r.id = t.relation_id "
+                    "JOIN entities e ON e.id = t.tail_id WHERE t.head_id = ? ORDER BY t.id", (entity_id,)).fetchall()
+            if direction in ("in", "both"):
+                edges += self.conn.execute(
+                    "SELECT 'in', r.name, e.name FROM triples t JOIN relations r ON r.id = t.relation_id "
+                    "JOIN entities e ON e.id = t.head_id WHERE t.tail_id = ? ORDER BY t.id", (entity_id,)).fetchall()
+            return edges
+
+    def stats(self) -> Dict:
+        """Return the number of entities, relations, distinct triples and triple occurrences."""
+        with self.lock:
+            triples, occurrences = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(occurrences), 0) FROM triples").fetchone()
+            return {"entities": len(self.entity_ids), "relations": len(self.relation_ids),
+                    "triples": triples, "occurrences": occurrences}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_store: Optional[GraphStore] = None
+_store_lock = threading.Lock()
+
+
+def get_graph_store() -> Optional[GraphStore]:
+    """Return the shared graph store, or None if it is disabled."""
+    global _store
+    if not GRAPH_STORE_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = GraphStore()
+        return _store
+
+
+if __name__ == "__main__":
+    # python graph_store.py stats | neighbors <entity> [out|in|both]
+    store = GraphStore()
+    if len(sys.argv) > 2 and sys.argv[1] == "neighbors":
+        for edge_direction, relation, other in store.neighbors(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "both"):
+            print(f"({sys.argv[2]}, {relation}, {other})" if edge_direction == "out" else f"({other}, {relation}, {sys.argv[2]})")
+    else:
+        print(store.stats())
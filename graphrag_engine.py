@@ -0,0 +1,165 @@
+# graphrag_engine.py
+import os
+import subprocess
+import sys
+import threading
+from typing import Optional
+from config import (GRAPHRAG_BACKEND, GRAPHRAG_ROOT, GRAPHRAG_DATA_DIR, GRAPHRAG_METHOD,
+                    GRAPHRAG_COMMUNITY_LEVEL, GRAPHRAG_RESPONSE_TYPE)
+
+
+class GraphRAGEngine:
+    """Long-lived GraphRAG query engine that keeps the index artifacts in memory.
+
+    The configuration and parquet artifacts are loaded once on the first query
+    (memory-mapped through pyarrow) and reused for every following query.
+    """
+
+    def __init__(self, root: str = GRAPHRAG_ROOT, data_dir: str = GRAPHRAG_DATA_DIR,
+                 method: str = GRAPHRAG_METHOD, community_level: int = GRAPHRAG_COMMUNITY_LEVEL,
+                 response_type: str = GRAPHRAG_RESPONSE_TYPE):
+        self.root = root
+        self.data_dir = data_dir
+        self.method = method.lower()
+        self.community_level = community_level
+        self.response_type = response_type
+        self.api = None
+        self.config = None
+        self.tables = None
+        self.lock = threading.Lock()
+
+    def _read_table(self, name: str):
+        import pandas as pd
+        path = os.path.join(self.data_dir, f"{name}.parquet")
+        if not os.path.exists(path):
+            return None
+        return pd.read_parquet(path, memory_map=True)
+
+    def _load_config(self):
+        try:
+            from graphrag.config import load_config
+            from pathlib import Path
+            return load_config(Path(self.root))
+        except ImportError:
+            from graphrag.query.cli import _configure_paths_and_settings
+            return _configure_paths_and_settings(self.data_dir, self.root, None)[2]
+
+    def load(self):
+        """Load the GraphRAG configuration and index artifacts if they are not loaded yet."""
+        with self.lock:
+            if self.tables is not None:
+                return
+            from graphrag.query import api
+            self.api = api
+            self.config = self._load_config()
+            names = ["create_final_nodes", "create_final_entities", "create_final_community_reports"]
+            if self.method == "local":
+                names += ["create_final_text_units", "create_final_relationships", "create_final_covariates"]
+            tables = {name: self._read_table(name) for name in names}
+            missing = [name for name, table in tables.items() if table is None and name != "create_final_covariates"]
+            if missing:
+                raise FileNotFoundError(f"Missing GraphRAG artifacts in {self.data_dir}: {', '.join(missing)}")
+            self.tables = tables
+            print(f"Loaded GraphRAG index from {self.data_dir}")
+
+    def query(self, query: str) -> str:
+        """Answer a query with the configured search method."""
+        self.load()
+        t = self.tables
+        if self.method == "local":
+            search = self.api.local_search(
+                config=self.config,
+                nodes=t["create_final_nodes"],
+                entities=t["create_final_entities"],
+                community_reports=t["create_final_community_reports"],
+                text_units=t["create_final_text_units"],
+                relationships=t["create_final_relationships"],
+                covariates=t["create_final_covariates"],
+                community_level=self.community_level,
+                response_type=self.response_type,
+                query=query,
+            )
+        else:
+            search = self.api.global_search(
+                config=self.config,
+                nodes=t["create_final_nodes"],
+                entities=t["create_final_entities"],
+                community_reports=t["create_final_community_reports"],
+                community_level=self.community_level,
+                response_type=self.response_type,
+                query=query,
+            )
+        import asyncio
+        response = asyncio.run(search)
+        # graphrag >= 0.3 returns (response, context_data); only the response text is the output
+        if isinstance(response, tuple):
+            response = response[0]
+        return response if isinstance(response, str) else str(response)
+
+
+_engine: Optional[GraphRAGEngine] = None
+_engine_failed = False
+_engine_lock = threading.Lock()
+
+
+def get_graphrag_engine() -> GraphRAGEngine:
+    """Return the process-wide GraphRAG engine, creating it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = GraphRAGEngine()
+        return _engine
+
+
+def run_graphrag_subprocess(query: str) -> Optional[str]:
+    """Run a query with the GraphRAG command line in a fresh subprocess."""
+    command = [
+        sys.executable, "-m", "graphrag.query",
+        "--root", GRAPHRAG_ROOT,
+        "--method", GRAPHRAG_METHOD,
+        query,
+        "--data", GRAPHRAG_DATA_DIR
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode == 0:
+        output = result.stdout.strip()
+        for marker in ("SUCCESS: Local Search Response:", "SUCCESS: Global Search Response:"):
+            if marker in output:
+                return output.split(marker, 1)[1].strip()
+        return output
+    else:
+        error_message = result.stderr.strip()
+        if "failed" in error_message or "parsing" in error_message:
+            print(f"Error: Failed to parse the URL. Please check the URL's validity and your network connection. Error details: {error_message}")
+            return None
+        else:
+            raise Exception(f"Command failed with error: {error_message}")
+
+
+def query_graphrag(query: str) -> Optional[str]:
+    """Query GraphRAG with the in-process engine, falling back to the subprocess CLI.
+
+    The fallback is used when GRAPHRAG_BACKEND is "subprocess" or when the
+    engine cannot be loaded or its query API does not match the installed
+    GraphRAG version (a TypeError or AttributeError from the search call); the
+    engine is then not tried again. GRAPHRAG_BACKEND "mock"
+    answers from a deterministic fake engine without an index.
+    """
+    global _engine_failed
+    if GRAPHRAG_BACKEND == "mock":
+        from mock_backends import FakeGraphRAGEngine
+        return FakeGraphRAGEngine().query(query)
+    if GRAPHRAG_BACKEND == "inprocess" and not _engine_failed:
+        engine = get_graphrag_engine()
+        try:
+            engine.load()
+        except Exception as e:
+            print(f"Failed to load the in-process GraphRAG engine, falling back to subprocess: {e}")
+            _engine_failed = True
+        else:
+            try:
+                return engine.query(query)
+            except (TypeError, AttributeError) as e:
+                print(f"The in-process GraphRAG query API is incompatible, falling back to subprocess: {e}")
+                _engine_failed = True
+    return run_graphrag_subprocess(query)
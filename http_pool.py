@@ -0,0 +1,101 @@
+# http_pool.py
+import http.client
+import json
+import queue
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from scheduler import RETRY_STATUSES, Completion, RetryableError
+
+
+class ConnectionPool:
+    """Pool of keep-alive HTTP(S) connections to one host, shared between threads."""
+
+    def __init__(self, base_url: str, size: int, timeout: float = 60.0):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def _get(self) -> http.client.HTTPConnection:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, timeout=self.timeout)
+
+    def _put(self, conn: http.client.HTTPConnection):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def post(self, path: str, body: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        """POST a request on a pooled connection and return (status, headers, body).
+
+        A connection the server has closed since its last use is replaced once.
+        """
+        for reused in (True, False):
+            conn = self._get() if reused else self.connection_class(self.host, timeout=self.timeout)
+            try:
+                conn.request("POST", self.prefix + path, body, headers)
+                res = conn.getresponse()
+                data = res.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if res.will_close:
+                conn.close()
+            else:
+                self._put(conn)
+            return res.status, dict(res.getheaders()), data
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ChatCompletionClient:
+    """Chat completions client over a keep-alive connection pool.
+
+    Each call sends one request; retries are left to the request scheduler.
+    """
+
+    def __init__(self, base_url: str, api_key: str, model: str, pool_size: int = 16,
+                 timeout: float = 60.0, path: str = "/v1/chat/completions"):
+        self.pool = ConnectionPool(base_url, pool_size, timeout)
+        self.path = path
+        self.api_key = api_key
+        self.model = model
+
+    def complete(self, messages: List[Dict], **params) -> Optional[str]:
+        """Return the reply text of a chat completion with its reported usage, or None if the response is not a completion.
+
+        Raises RetryableError for 429/5xx responses and OSError for connection errors.
+        """
+        payload = json.dumps(dict({"model": self.model, "messages": messages, "stream": False}, **params))
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        status, response_headers, data = self.pool.post(self.path, payload, headers)
+        if status in RETRY_STATUSES:
+            retry_after = response_headers.get("Retry-After")
+            raise RetryableError(status, float(retry_after) if retry_after and retry_after.isdigit() else None)
+        try:
+            response = json.loads(data.decode("utf-8"))
+        except json.JSONDecodeError as e:
+            print(f"Error decoding API response: {e}")
+            return None
+        if 'choices' in response:
+            return Completion(response['choices'][0]['message']['content'], response.get('usage'))
+        print(f"Unexpected response format: {response}")
+        return None
@@ -0,0 +1,131 @@
+# llm.py
+from dataclasses import dataclass
+from typing import Dict, List
+from config import MODEL_NAME, OPENAI_API_KEY, OPENAI_BASE_URL, LLM_BACKEND, LLM_POOL_SIZE, LLM_TIMEOUT
+from scheduler import Completion, get_scheduler, estimate_tokens
+from cache import cached_call
+
+
+@dataclass
+class AgentSpec:
+    """An agent without functions: a name, a model and its instructions."""
+    name: str
+    model: str
+    instructions: str
+
+
+class ChatBackend:
+    """Interface of the chat model used by the pipeline.
+
+    `chat` sends a plain chat completion request and `run` runs an agent
+    (its instructions as the system prompt) and both return the reply text,
+    as a Completion carrying the token usage where the API reports it.
+    Agents are created with `agent_class`.
+    """
+
+    agent_class = AgentSpec
+
+    def chat(self, messages: List[Dict], model: str, **params) -> str:
+        raise NotImplementedError
+
+    def run(self, agent, messages: List[Dict]) -> str:
+        raise NotImplementedError
+
+
+class OpenAIBackend(ChatBackend):
+    """The openai module for chat requests and a Swarm client for agents."""
+
+    def __init__(self, api_key: str = OPENAI_API_KEY, base_url: str = OPENAI_BASE_URL):
+        import openai
+        from swarm import Swarm
+
+        openai.api_key = api_key
+        openai.base_url = base_url
+        self.openai = openai
+        self.client = Swarm(openai)
+
+    @property
+    def agent_class(self):
+        from swarm import Agent
+        return Agent
+
+    def chat(self, messages: List[Dict], model: str, **params) -> str:
+        # The module-level client of openai>=1.0, configured by openai.api_key and openai.base_url
+        response = self.openai.chat.completions.create(model=model, messages=messages, **params)
+        usage = getattr(response, "usage", None)
+        if usage is not None and not isinstance(usage, dict):
+            usage = {"prompt_tokens": getattr(usage, "prompt_tokens", None),
+                     "completion_tokens": getattr(usage, "completion_tokens", None)}
+        return Completion(response.choices[0].message.content, usage)
+
+    def run(self, agent, messages: List[Dict]) -> str:
+        # Swarm does not return the usage of its requests, so it is estimated
+        response = self.client.run(agent=agent, messages=messages)
+        return response.messages[-1]["content"]
+
+
+class HttpBackend(ChatBackend):
+    """Chat completions over pooled keep-alive HTTP connections to an OpenAI-compatible endpoint.
+
+    Agents are sent as a system prompt plus the messages, which is what Swarm
+    sends for agents without functions.
+    """
+
+    def __init__(self, base_url: str = OPENAI_BASE_URL, api_key: str = OPENAI_API_KEY, model: str = MODEL_NAME,
+                 pool_size: int = LLM_POOL_SIZE, timeout: float = LLM_TIMEOUT):
+        from http_pool import ChatCompletionClient
+
+        # Accept base URLs with or without the /v1 API prefix
+        path = "/chat/completions" if base_url.rstrip("/").endswith("/v1") else "/v1/chat/completions"
+        self.http = ChatCompletionClient(base_url, api_key, model, pool_size=pool_size, timeout=timeout, path=path)
+
+    def chat(self, messages: List[Dict], model: str, **params) -> str:
+        content = self.http.complete(messages, model=model, **params)
+        if content is None:
+            raise RuntimeError("Chat completion request failed")
+        return content
+
+    def run(self, agent, messages: List[Dict]) -> str:
+        return self.chat([{"role": "system", "content": agent.instructions}] + messages, agent.model)
+
+
+def create_backend(name: str = LLM_BACKEND) -> ChatBackend:
+    """Create the chat backend configured by LLM_BACKEND ("openai" or "http")."""
+    if name == "openai":
+        return OpenAIBackend()
+    if name == "http":
+        return HttpBackend()
+    raise ValueError(f"Unsupported LLM backend: {name}")
+
+
+def _prompt_tokens(messages: List[Dict], instructions: str = "") -> int:
+    """Estimate the prompt size of a chat request."""
+    return estimate_tokens(instructions) + sum(estimate_tokens(m.get("content") or "") for m in messages)
+
+
+def chat_completion(backend: ChatBackend, messages: List[Dict], model: str = MODEL_NAME, attempt: int = 0,
+                    **params) -> str:
+    """Send a chat completion request through the response cache and the request scheduler.
+
+    `attempt` only affects the cache key, like in run_agent.
+    """
+    def compute() -> str:
+        return get_scheduler(OPENAI_BASE_URL, model).call(lambda: backend.chat(messages, model, **params),
+                                                          _prompt_tokens(messages))
+
+    key_params = dict(params, attempt=attempt) if attempt else params
+    return cached_call(compute, model=model, instructions=None, messages=messages, params=key_params)
+
+
+def run_agent(backend: ChatBackend, agent, messages: List[Dict], attempt: int = 0) -> str:
+    """Run an agent through the response cache and the request scheduler and return its last message.
+
+    `attempt` distinguishes repeated identical requests (e.g. regeneration rounds)
+    so that each round gets its own cache entry instead of replaying the first answer.
+    """
+    def compute() -> str:
+        return get_scheduler(OPENAI_BASE_URL, agent.model).call(lambda: backend.run(agent, messages),
+                                                                _prompt_tokens(messages, agent.instructions))
+
+    params = {"attempt": attempt} if attempt else {}
+    return cached_call(compute, model=agent.model, instructions=agent.instructions, messages=messages, params=params)
@@ -1,8 +1,52 @@
 # main.py
-from config import INPUT_XLSX, OUTPUT_XLSX, RTE_OUTPUT_JSON, KGC_OUTPUT_JSON
+import argparse
+import sys
+import config
+from config import INPUT_XLSX, OUTPUT_XLSX, RTE_OUTPUT_JSON, KGC_OUTPUT_JSON, RECORDS_OUTPUT, CHECKPOINT_PATH, TRACE_PATH
 from MAS import process_xlsx
+from shards import parse_shard, shard_path, merge_shards, run_local_shards
 
 if __name__ == "__main__":
-    print("Starting the knowledge graph processing pipeline...")
-    process_xlsx(INPUT_XLSX, OUTPUT_XLSX, RTE_OUTPUT_JSON, KGC_OUTPUT_JSON)
-    print("Processing completed.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the knowledge graph processing pipeline.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip samples finished by a previous run and continue partially processed ones.")
+    parser.add_argument("--shard", type=parse_shard, metavar="INDEX/COUNT",
+                        help="Process only one shard of the input (e.g. 0/4) and write its own output segment.")
+    parser.add_argument("--shard-by", choices=["range", "hash"], default="range",
+                        help="Split the input into contiguous row ranges or by a hash of the context.")
+    parser.add_argument("--workers", type=int, metavar="COUNT",
+                        help="Run COUNT shards as local worker processes and merge their segments.")
+    parser.add_argument("--merge", type=int, metavar="COUNT",
+                        help="Merge the segments of COUNT shards into the final output files.")
+    parser.add_argument("--rate-limit-share", type=float, metavar="FRACTION",
+                        help="Use only this fraction of RATE_LIMITS, e.g. when other processes share the endpoint "
+                             "(set by --workers).")
+    args = parser.parse_args()
+    if args.rate_limit_share is not None:
+        config.RATE_LIMIT_SHARE = args.rate_limit_share
+
+    if args.shard is not None:
+        print(f"Starting shard {args.shard[0]}/{args.shard[1]} of the knowledge graph processing pipeline...")
+        succeeded = process_xlsx(INPUT_XLSX, OUTPUT_XLSX, RTE_OUTPUT_JSON, KGC_OUTPUT_JSON,
+                                 shard_path(RECORDS_OUTPUT, args.shard), resume=args.resume,
+                                 checkpoint_path=shard_path(CHECKPOINT_PATH, args.shard), shard=args.shard,
+                                 shard_by=args.shard_by, finalize=False, trace_path=shard_path(TRACE_PATH, args.shard))
+        if not succeeded:
+            print("Shard incomplete; rerun it with --resume.")
+            sys.exit(1)
+        print("Shard completed.")
+    elif args.workers is not None:
+        print(f"Starting the knowledge graph processing pipeline with {args.workers} worker processes...")
+        if not run_local_shards(args.workers, args.shard_by, args.resume):
+            print("Some shards failed; rerun with --resume to complete them before merging.")
+            sys.exit(1)
+        merge_shards(args.workers, RECORDS_OUTPUT, OUTPUT_XLSX, RTE_OUTPUT_JSON, KGC_OUTPUT_JSON)
+        print("Processing completed.")
+    elif args.merge is not None:
+        merge_shards(args.merge, RECORDS_OUTPUT, OUTPUT_XLSX, RTE_OUTPUT_JSON, KGC_OUTPUT_JSON)
+    else:
+        print("Starting the knowledge graph processing pipeline...")
+        if not process_xlsx(INPUT_XLSX, OUTPUT_XLSX, RTE_OUTPUT_JSON, KGC_OUTPUT_JSON, RECORDS_OUTPUT, resume=args.resume):
+            print("Processing incomplete; rerun with --resume to retry the skipped samples.")
+            sys.exit(1)
+        print("Processing completed.")
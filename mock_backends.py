@@ -0,0 +1,186 @@
+# mock_backends.py
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from scheduler import estimate_tokens
+
+ENTITIES = ["Steel plant", "Blast furnace", "Iron ore", "Coke", "Oxygen", "Rolling mill", "Slag", "Production line",
+            "Power station", "Cooling water", "Converter", "Scrap steel", "Hot metal", "Sinter plant", "Limestone"]
+RELATIONS = ["produces", "consumes", "supplies", "is located in", "is part of", "emits"]
+_FACT_RE = re.compile(r"(" + "|".join(map(re.escape, ENTITIES)) + r") (" + "|".join(RELATIONS) + r") ("
+                      + "|".join(re.escape(entity.lower()) for entity in ENTITIES) + r")")
+_RECORD_RE = re.compile(r"^Record (\d+):", re.M)
+
+
+def _rng(text: str) -> random.Random:
+    """A random generator seeded by a text, so the same request always gets the same answer."""
+    return random.Random(hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+
+class FakeGraphRAGEngine:
+    """Deterministic stand-in for the GraphRAG engine, answering without an index."""
+
+    def __init__(self, facts: int = 5):
+        self.facts = facts
+
+    def query(self, query: str) -> str:
+        rng = _rng(query)
+        sentences = []
+        for _ in range(self.facts):
+            head, tail = rng.sample(ENTITIES, 2)
+            sentences.append(f"{head} {rng.choice(RELATIONS)} {tail.lower()}.")
+        return " ".join(sentences)
+
+
+def _facts(text: str) -> List[Dict[str, str]]:
+    return [{"head": head, "relation": relation, "tail": tail} for head, relation, tail in _FACT_RE.findall(text)]
+
+
+def mock_reply(messages: List[Dict], response_format: Optional[Dict] = None) -> str:
+    """Return a deterministic, well-formed answer to one of the prompts of the pipeline or the evaluation."""
+    system = " ".join(m["content"] for m in messages if m["role"] == "system")
+    user = "\n".join(m["content"] for m in messages if m["role"] != "system")
+    schema_name = (response_format or {}).get("json_schema", {}).get("name")
+
+    if "validation expert" in system:
+        return "This is a loyal fact."
+    if "information extraction expert" in system:
+        entities = sorted({fact["head"] for fact in _facts(user)} | {fact["tail"] for fact in _facts(user)})
+        return json.dumps({"entities": entities}) if schema_name else "\n".join(entities)
+    if "construction expert" in system or "relationship analysis expert" in system:
+        facts = _facts(user)
+        if schema_name == "knowledge_graph_extraction":
+            return json.dumps({"entities": sorted({f["head"] for f in facts} | {f["tail"] for f in facts}),
+                               "triples": facts})
+        if schema_name:
+            return json.dumps({"triples": facts})
+        if "under 'Triples:'" in user:
+            entities = sorted({f["head"] for f in facts} | {f["tail"] for f in facts})
+            return ("Entities:\n" + "\n".join(entities) + "\nTriples:\n"
+                    + "\n".join(f"({f['head']}, {f['relation']}, {f['tail']})" for f in facts))
+        if "construction expert" in system:
+            return "\n".join(f"({f['head']}, {f['relation']}, {f['tail']})" for f in facts)
+        return "\n".join(f"{f['head']} {f['relation']} {f['tail']}" for f in facts)
+    if user.startswith("Translate each of the following texts"):
+        return json.dumps(json.loads(user.split("Texts:\n", 1)[1]), ensure_ascii=False)
+    if user.startswith("Translate it into English"):
+        return user.split(":", 1)[1].strip()
+    if "generate a question and answer" in user:
+        entities = re.search(r"relationship between (.+?) and (.+?)\?", user)
+        head, tail = entities.groups() if entities else ("Entity1", "Entity2")
+        return (f"Question: What is the relationship between {head} and {tail}?\n"
+                f"Answer: According to the context, {head} is related to {tail}.")
+    if user.startswith("Evaluate"):
+        rng = _rng(user)
+        ids = _RECORD_RE.findall(user)
+        results = [{"Answer": rng.choice(["Yes", "Yes", "Yes", "No"]), "Suggestions": "None.",
+                    "Confidence": rng.randint(3, 5)} for _ in ids or [None]]
+        if ids:
+            return json.dumps([dict(result, id=int(record_id)) for record_id, result in zip(ids, results)])
+        return json.dumps(results[0])
+    return "OK"
+
+
+class MockChatServer:
+    """Local OpenAI-compatible chat completions server with configurable latency and error rate.
+
+    Every POST is answered by mock_reply after `latency` seconds (+-50% jitter);
+    a fraction `error_rate` of the requests fails with 429 or 500 instead.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; without this every response waits for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock.lock:
+                    mock.requests += 1
+                    delay = mock.latency * mock.rng.uniform(0.5, 1.5)
+                    failed = mock.rng.random() < mock.error_rate
+                    status = mock.rng.choice([429, 500]) if failed else 200
+                    mock.errors += failed
+                if delay:
+                    time.sleep(delay)
+                if failed:
+                    body = json.dumps({"error": {"message": "mock error", "code": status}})
+                else:
+                    content = mock_reply(request["messages"], request.get("response_format"))
+                    body = json.dumps({
+                        "object": "chat.completion",
+                        "model": request.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": sum(estimate_tokens(m.get("content") or "")
+                                                       for m in request["messages"]),
+                                  "completion_tokens": estimate_tokens(content)},
+                    })
+                data = body.encode("utf-8")
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def start(self) -> "MockChatServer":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the mock chat completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean response time in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429/500.")
+    args = parser.parse_args()
+
+    server = MockChatServer(args.host, args.port, args.latency, args.error_rate)
+    print(f"Mock chat completions API listening on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+# scheduler.py
+import http.client
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple, TypeVar
+from tracing import record_retry
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+# CJK characters, kana, hangul and full-width forms, which are about one token each
+_CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens in a text: one per CJK character, about 4 other characters per token."""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class Completion(str):
+    """The reply text of a chat request, carrying the token `usage` reported by the API (None if not reported)."""
+
+    usage: Optional[Dict[str, Any]] = None
+
+    def __new__(cls, text: str, usage: Optional[Dict[str, Any]] = None):
+        completion = super().__new__(cls, text)
+        completion.usage = usage
+        return completion
+
+
+def token_usage(result: Optional[str], prompt_tokens: int) -> Tuple[int, int]:
+    """Return the (prompt, completion) tokens of a request: those reported by the API, else estimates."""
+    usage = getattr(result, "usage", None) or {}
+    prompt, completion = usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return (prompt if isinstance(prompt, int) else prompt_tokens,
+            completion if isinstance(completion, int) else estimate_tokens(result or ""))
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter for the given retry attempt (starting at 0)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at a per-minute rate."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0):
+        """Block until `amount` tokens are available, then take them."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait_time = (amount - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def consume(self, amount: float):
+        """Take tokens without blocking; the bucket may go into debt."""
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one endpoint."""
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, prompt_tokens: int = 0):
+        """Wait for permission to send one request with the given prompt size."""
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.tokens is not None and prompt_tokens:
+            self.tokens.acquire(prompt_tokens)
+
+    def record(self, tokens: int):
+        """Charge tokens of a finished request (its completion, and any prompt tokens beyond the estimate acquired)."""
+        if self.tokens is not None and tokens:
+            self.tokens.consume(tokens)
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+OVERLOAD_STATUSES = {429, 503}
+
+
+class RetryableError(Exception):
+    """A transient API failure (429/5xx response) that is worth retrying."""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"API returned status {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(RuntimeError):
+    """The endpoint keeps failing and its circuit stays open past the request's deadline."""
+
+
+def classify_error(error: Exception) -> Tuple[bool, Optional[int], Optional[float]]:
+    """Return (retryable, status, retry_after seconds) for an exception raised by an API call.
+
+    Besides RetryableError this recognizes connection errors and the rate limit,
+    timeout and server errors of the openai client.
+    """
+    if isinstance(error, RetryableError):
+        return True, error.status, error.retry_after
+    if isinstance(error, (OSError, http.client.HTTPException)):
+        return True, None, None
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    if status is not None:
+        return status in RETRY_STATUSES, status, None
+    name = type(error).__name__
+    if any(kind in name for kind in ("RateLimit", "Timeout", "Connection", "ServiceUnavailable")):
+        return True, 429 if "RateLimit" in name else None, None
+    return False, None, None
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit adjusted by AIMD.
+
+    Every successful request raises the limit by 1/limit (about +1 per round of
+    requests); an overload response (429/503) or a response slower than
+    `latency_target` halves it, at most once per smoothed round-trip time so a
+    burst of 429s counts as one signal.
+    """
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1, latency_target: Optional[float] = None):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.latency = 0.0  # Exponentially smoothed latency of successful requests
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float, outcome: str = "success"):
+        """Free a slot; `outcome` is "success", "overload" (429/503) or "error" (other failures, no adjustment)."""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+            if outcome == "error":
+                return
+            now = time.monotonic()
+            if outcome == "success":
+                self.latency = latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+            if outcome == "overload" or (self.latency_target and latency > self.latency_target):
+                if now - self.last_decrease >= self.latency:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+
+class CircuitBreaker:
+    """Stops sending requests to an endpoint after `failures` consecutive failed attempts.
+
+    The circuit then stays open for `reset_timeout` seconds, after which a single
+    probe request is let through: its success closes the circuit, its failure
+    opens it again. Requests wait for the circuit instead of failing as long as
+    their deadline allows.
+    """
+
+    def __init__(self, failures: int, reset_timeout: float):
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.condition = threading.Condition()
+
+    def before_call(self, deadline: float):
+        """Wait until a request may be sent; raise CircuitOpenError if that is after `deadline`."""
+        with self.condition:
+            while self.opened_at is not None:
+                now = time.monotonic()
+                reopen = self.opened_at + self.reset_timeout
+                if now >= reopen and not self.probing:
+                    self.probing = True
+                    return
+                wait_until = reopen if now < reopen else now + self.reset_timeout
+                if wait_until > deadline:
+                    raise CircuitOpenError("Circuit open: the API keeps failing")
+                self.condition.wait(wait_until - now)
+
+    def success(self):
+        with self.condition:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            self.condition.notify_all()
+
+    def failure(self):
+        with self.condition:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"Circuit opened after {self.failures} consecutive failures, "
+                          f"pausing requests for {self.reset_timeout:.0f}s")
+                self.opened_at = time.monotonic()
+                self.probing = False
+            self.condition.notify_all()
+
+
+class RequestScheduler:
+    """Runs the API requests of one endpoint and model.
+
+    Each attempt waits for the circuit breaker, the rate limits and a slot of the
+    adaptive concurrency limit. Transient failures are retried with jittered
+    exponential backoff (honoring Retry-After) until `max_retries` or the
+    request's deadline is reached.
+    """
+
+    def __init__(self, limiter: RateLimiter, concurrency: AdaptiveConcurrency, breaker: CircuitBreaker,
+                 max_retries: int = 5, deadline: float = 300.0):
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.deadline = deadline
+
+    def call(self, func: Callable[[], R], prompt_tokens: int = 0, max_retries: Optional[int] = None,
+             deadline: Optional[float] = None) -> R:
+        """Run `func` (one API request) and return its result, retrying transient failures."""
+        max_retries = self.max_retries if max_retries is None else max_retries
+        give_up_at = time.monotonic() + (self.deadline if deadline is None else deadline)
+        attempt = 0
+        while True:
+            self.breaker.before_call(give_up_at)
+            self.limiter.acquire(prompt_tokens)
+            self.concurrency.acquire()
+            start = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                retryable, status, retry_after = classify_error(e)
+                if not retryable:
+                    self.concurrency.release(time.monotonic() - start, "error")
+                    self.breaker.success()  # The endpoint answered; the request itself is at fault
+                    raise
+                self.concurrency.release(time.monotonic() - start,
+                                         "overload" if status in OVERLOAD_STATUSES else "error")
+                self.breaker.failure()
+                delay = max(backoff_delay(attempt), retry_after or 0)
+                if attempt >= max_retries or time.monotonic() + delay > give_up_at:
+                    raise
+                print(f"{e} (attempt {attempt + 1}/{max_retries + 1}), retrying in {delay:.1f}s")
+                record_retry()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.concurrency.release(time.monotonic() - start)
+            self.breaker.success()
+            if isinstance(result, str):
+                actual_prompt_tokens, completion_tokens = token_usage(result, prompt_tokens)
+                self.limiter.record(completion_tokens + actual_prompt_tokens - prompt_tokens)
+            return result
+
+
+_schedulers: Dict[Tuple[str, str], RequestScheduler] = {}
+_limiters: Dict[str, RateLimiter] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(endpoint: str, model: str) -> RequestScheduler:
+    """Return the shared request scheduler for an endpoint and model, creating it from config on first use.
+
+    Models with their own entry under RATE_LIMITS[endpoint]["models"] get their own
+    rate limits; the other models of the endpoint share the endpoint's limits.
+    The limits are scaled by RATE_LIMIT_SHARE, the share of this process.
+    The concurrency limit and the circuit breaker are per endpoint and model.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get((endpoint, model))
+        if scheduler is None:
+            from config import (RATE_LIMITS, RATE_LIMIT_SHARE, LLM_MAX_RETRIES, SCHEDULER_INITIAL_CONCURRENCY,
+                                SCHEDULER_MAX_CONCURRENCY, SCHEDULER_LATENCY_TARGET, SCHEDULER_DEADLINE,
+                                CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET)
+            limits = RATE_LIMITS.get(endpoint, {})
+            model_limits = limits.get("models", {}).get(model)
+            limiter_key = f"{endpoint} {model}" if model_limits else endpoint
+            if limiter_key not in _limiters:
+                limits = model_limits or limits
+                requests, tokens = limits.get("requests_per_minute"), limits.get("tokens_per_minute")
+                _limiters[limiter_key] = RateLimiter(requests and requests * RATE_LIMIT_SHARE,
+                                                     tokens and tokens * RATE_LIMIT_SHARE)
+            scheduler = RequestScheduler(
+                _limiters[limiter_key],
+                AdaptiveConcurrency(SCHEDULER_INITIAL_CONCURRENCY, SCHEDULER_MAX_CONCURRENCY,
+                                    latency_target=SCHEDULER_LATENCY_TARGET),
+                CircuitBreaker(CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET),
+                max_retries=LLM_MAX_RETRIES, deadline=SCHEDULER_DEADLINE)
+            _schedulers[(endpoint, model)] = scheduler
+        return scheduler
+
+
+def bounded_map(func: Callable[[T], R], items: Iterable[T], concurrency: int,
+                ordered: bool = True) -> Iterator[Tuple[T, R]]:
+    """Apply `func` to `items` on a bounded worker pool and yield (item, result) pairs.
+
+    At most `2 * concurrency` items are in flight or buffered at any time, so
+    arbitrarily long inputs can be streamed. With `ordered=True` results are
+    yielded in input order, otherwise as soon as they finish.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    iterator = iter(items)
+    max_pending = concurrency * 2
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        completed = {}
+        submitted = 0
+        next_index = 0
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) + len(completed) < max_pending:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(func, item)] = (submitted, item)
+                submitted += 1
+
+            if not pending and not completed:
+                return
+
+            if pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, item = pending.pop(future)
+                    if ordered:
+                        completed[index] = (item, future.result())
+                    else:
+                        yield item, future.result()
+
+            while next_index in completed:
+                yield completed.pop(next_index)
+                next_index += 1
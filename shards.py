@@ -0,0 +1,122 @@
+# shards.py
+import hashlib
+import heapq
+import os
+import subprocess
+import sys
+from typing import Dict, Iterator, List, Tuple
+from writers import clear_records, create_writer, finalize_outputs, read_records, read_unique_records
+from utils import ensure_directory_exists
+
+Shard = Tuple[int, int]  # (shard index, number of shards)
+
+
+def parse_shard(value: str) -> Shard:
+    """Parse a shard given as "index/count", e.g. "3/8" for the fourth of eight shards."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{value}', expected INDEX/COUNT") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{value}', INDEX must be between 0 and COUNT - 1")
+    return index, count
+
+
+def shard_path(path: str, shard: Shard) -> str:
+    """Return the segment path of a shard, e.g. output/records_t.shard-003-of-008.jsonl."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]:03d}-of-{shard[1]:03d}{ext}"
+
+
+def in_shard(index: int, context: str, shard: Shard, total: int, shard_by: str = "range") -> bool:
+    """Check whether a sample belongs to a shard.
+
+    "range" splits the input into contiguous row ranges; "hash" assigns samples by
+    a stable hash of their context, so identical contexts land in the same shard.
+    """
+    shard_index, count = shard
+    if shard_by == "range":
+        return shard_index * total // count <= index < (shard_index + 1) * total // count
+    if shard_by == "hash":
+        digest = hashlib.sha1(str(context).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % count == shard_index
+    raise ValueError(f"Unsupported shard mode: {shard_by}")
+
+
+def _segment_records(segment: str) -> Iterator[Dict]:
+    """Iterate over the records of a segment by sample index, dropping repeated (sample_index, triple) pairs.
+
+    Segments are usually in input order and are streamed. Segments written with
+    ORDERED_OUTPUT = False, or with a sample re-appended after a resumed partial
+    write, are sorted in memory (stably, so the records of a sample keep their order).
+    """
+    previous = 0
+    for record in read_records(segment):
+        if record["sample_index"] < previous:
+            print(f"{segment} is not in input order, sorting it in memory")
+            yield from sorted(read_unique_records(segment), key=lambda entry: entry["sample_index"])
+            return
+        previous = record["sample_index"]
+    yield from read_unique_records(segment)
+
+
+def _merge_records(segments: List[str]) -> Iterator[Dict]:
+    """Merge the record logs of the shards by sample index, dropping repeated (sample_index, triple) pairs.
+
+    This is a k-way merge of the segments in sample order (see _segment_records);
+    ties are broken by shard order.
+    """
+    seen = set()
+    merged = heapq.merge(*(_segment_records(segment) for segment in segments),
+                         key=lambda record: record["sample_index"])
+    for record in merged:
+        key = (record["sample_index"], record["triple"])
+        if key not in seen:
+            seen.add(key)
+            yield record
+
+
+def merge_shards(count: int, records_output: str, output_xlsx: str, rte_output_json: str, kgc_output_json: str):
+    """Concatenate the record segments of `count` shards into `records_output` and build the final outputs."""
+    segments = [shard_path(records_output, (index, count)) for index in range(count)]
+    missing = [segment for segment in segments if not os.path.exists(segment)]
+    if missing:
+        print(f"Missing shard segments, merging the others: {', '.join(missing)}")
+    clear_records(records_output)
+
+    merged = 0
+    with create_writer(records_output) as writer:
+        for record in _merge_records([segment for segment in segments if segment not in missing]):
+            writer.append(record)
+            merged += 1
+    print(f"Merged {merged} records from {count - len(missing)} shards into {records_output}")
+    finalize_outputs(records_output, output_xlsx, rte_output_json, kgc_output_json)
+
+
+def run_local_shards(count: int, shard_by: str = "range", resume: bool = False, log_dir: str = "output") -> bool:
+    """Run `count` shards as worker processes of main.py on this machine and wait for them.
+
+    Each worker's output goes to its own log file and may use 1/count of
+    RATE_LIMITS, so together they stay within the limits. Returns True if all
+    shards succeeded.
+    """
+    workers = []
+    for index in range(count):
+        log_path = os.path.join(log_dir, f"shard-{index:03d}-of-{count:03d}.log")
+        ensure_directory_exists(log_path)
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                   "--shard", f"{index}/{count}", "--shard-by", shard_by, "--rate-limit-share", str(1 / count)]
+        if resume:
+            command.append("--resume")
+        log = open(log_path, "w", encoding="utf-8")
+        workers.append((index, log_path, log, subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)))
+        print(f"Started shard {index}/{count} (log: {log_path})")
+
+    succeeded = True
+    for index, log_path, log, process in workers:
+        returncode = process.wait()
+        log.close()
+        if returncode != 0:
+            print(f"Shard {index}/{count} failed with exit code {returncode}, see {log_path}")
+            succeeded = False
+    return succeeded
@@ -0,0 +1,180 @@
+# stages.py
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_STOP = object()
+
+
+class Stage:
+    """One step of a staged pipeline: `func` maps an item to the item for the next stage, run by `workers` threads.
+
+    A stage returning None (or raising) drops the item from the following stages;
+    it still reaches the output as None so the caller sees every input.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+
+class StagedExecutor:
+    """Runs items through a chain of stages connected by bounded queues.
+
+    Every stage has its own worker threads, so different items can be in
+    different stages at the same time (e.g. one item's retrieval overlaps
+    another's LLM calls). Full queues block the stage before them, and at most
+    `max_in_flight` items are in the stages at any time. An item frees its slot
+    as soon as it leaves the last stage; in ordered runs finished items wait for
+    the items before them in a reorder buffer of at most `max_buffered` items,
+    so a slow item does not hold back the others. Both limits keep memory
+    bounded however long the input is. Queue depths are sampled every
+    `sample_interval` seconds for metrics().
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 4, max_in_flight: int = 16,
+                 max_buffered: int = 64, sample_interval: float = 0.1):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+        self.output: "queue.Queue[Tuple[int, Any]]" = queue.Queue()
+        self.slots = threading.Semaphore(max(1, max_in_flight))
+        # Items admitted but not yielded yet: in flight or in the reorder buffer
+        self.window = threading.Semaphore(max(1, max_in_flight) + max(0, max_buffered))
+        self.sample_interval = sample_interval
+        self.depths: List[List[int]] = [[] for _ in stages]
+        self.started = None
+        self.finished = None
+        self.error: Optional[BaseException] = None
+
+    def _feed(self, items: Iterable[Any]):
+        try:
+            for index, item in enumerate(items):
+                self.window.acquire()
+                self.slots.acquire()
+                self.queues[0].put((index, item))
+        except BaseException as e:
+            self.error = e
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.queues[0].put(_STOP)
+
+    def _work(self, position: int, remaining: List[int], remaining_lock: threading.Lock):
+        stage = self.stages[position]
+        inbox = self.queues[position]
+        last = position == len(self.stages) - 1
+        while True:
+            entry = inbox.get()
+            if entry is _STOP:
+                break
+            index, item = entry
+            if item is not None:
+                start = time.monotonic()
+                try:
+                    item = stage.func(item)
+                except Exception as e:
+                    print(f"An error occurred in stage {stage.name}: {e}")
+                    item = None
+                with stage.lock:
+                    stage.processed += 1
+                    stage.busy += time.monotonic() - start
+            if last or item is None:
+                self.output.put((index, item))
+            else:
+                self.queues[position + 1].put((index, item))
+        with remaining_lock:
+            remaining[position] -= 1
+            stage_done = remaining[position] == 0
+        if stage_done:
+            if last:
+                self.output.put(_STOP)
+            else:
+                for _ in range(self.stages[position + 1].workers):
+                    self.queues[position + 1].put(_STOP)
+
+    def _monitor(self, stop: threading.Event):
+        while not stop.wait(self.sample_interval):
+            for depths, inbox in zip(self.depths, self.queues):
+                depths.append(inbox.qsize())
+
+    def run(self, items: Iterable[Any], ordered: bool = True) -> Iterator[Tuple[Any, Any]]:
+        """Yield (input item, output of the last stage or None) for every input item.
+
+        With `ordered=True` results are yielded in input order, otherwise as soon
+        as they leave the pipeline. Results are yielded in the calling thread.
+        """
+        inputs: Dict[int, Any] = {}
+        inputs_lock = threading.Lock()
+
+        def remember(source):
+            for index, item in enumerate(source):
+                with inputs_lock:
+                    inputs[index] = item
+                yield item
+
+        self.started = time.monotonic()
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+        stop_monitor = threading.Event()
+        threads = [threading.Thread(target=self._feed, args=(remember(items),), daemon=True),
+                   threading.Thread(target=self._monitor, args=(stop_monitor,), daemon=True)]
+        for position, stage in enumerate(self.stages):
+            threads += [threading.Thread(target=self._work, args=(position, remaining, remaining_lock), daemon=True,
+                                         name=f"{stage.name}-{worker}") for worker in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+
+        completed: Dict[int, Any] = {}
+        next_index = 0
+        try:
+            while True:
+                entry = self.output.get()
+                if entry is _STOP:
+                    break
+                index, result = entry
+                self.slots.release()
+                if not ordered:
+                    with inputs_lock:
+                        item = inputs.pop(index)
+                    self.window.release()
+                    yield item, result
+                    continue
+                completed[index] = result
+                while next_index in completed:
+                    with inputs_lock:
+                        item = inputs.pop(next_index)
+                    self.window.release()
+                    yield item, completed.pop(next_index)
+                    next_index += 1
+        finally:
+            stop_monitor.set()
+            self.finished = time.monotonic()
+        if self.error is not None:
+            raise self.error
+
+    def metrics(self) -> List[Dict[str, float]]:
+        """Return per stage: workers, items processed, worker utilization and the mean/max depth of its input queue."""
+        elapsed = max((self.finished or time.monotonic()) - (self.started or time.monotonic()), 1e-9)
+        metrics = []
+        for stage, depths in zip(self.stages, self.depths):
+            metrics.append({
+                "stage": stage.name,
+                "workers": stage.workers,
+                "processed": stage.processed,
+                "utilization": stage.busy / (elapsed * stage.workers),
+                "queue_mean": sum(depths) / len(depths) if depths else 0.0,
+                "queue_max": max(depths) if depths else 0,
+            })
+        return metrics
+
+
+def print_metrics(metrics: List[Dict[str, float]]):
+    """Print the stage metrics of a StagedExecutor; a stage with a long input queue and busy workers is the bottleneck."""
+    print(f"{'stage':<12}{'workers':>8}{'items':>8}{'busy':>7}{'queue mean':>12}{'queue max':>11}")
+    for m in metrics:
+        print(f"{m['stage']:<12}{m['workers']:>8}{m['processed']:>8}{m['utilization']:>7.0%}"
+              f"{m['queue_mean']:>12.1f}{m['queue_max']:>11}")
@@ -0,0 +1,151 @@
+# structured_output.py
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from llm import chat_completion
+
+TRIPLES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "triples": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "head": {"type": "string"},
+                    "relation": {"type": "string"},
+                    "tail": {"type": "string"},
+                },
+                "required": ["head", "relation", "tail"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["triples"],
+    "additionalProperties": False,
+}
+
+ENTITIES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "entities": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["entities"],
+    "additionalProperties": False,
+}
+
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "entities": ENTITIES_SCHEMA["properties"]["entities"],
+        "triples": TRIPLES_SCHEMA["properties"]["triples"],
+    },
+    "required": ["entities", "triples"],
+    "additionalProperties": False,
+}
+
+_JSON_TYPES = {"object": dict, "array": list, "string": str, "number": (int, float), "integer": int, "boolean": bool}
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+def validate_schema(value: Any, schema: Dict, path: str = "$") -> List[str]:
+    """Check a decoded JSON value against the subset of JSON Schema used here and return the errors."""
+    expected = _JSON_TYPES[schema["type"]]
+    if not isinstance(value, expected) or (schema["type"] in ("number", "integer") and isinstance(value, bool)):
+        return [f"{path}: expected {schema['type']}, got {type(value).__name__}"]
+    errors = []
+    if schema["type"] == "object":
+        properties = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing required property '{key}'")
+        for key, item in value.items():
+            if key in properties:
+                errors.extend(validate_schema(item, properties[key], f"{path}.{key}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected property '{key}'")
+    elif schema["type"] == "array" and "items" in schema:
+        for index, item in enumerate(value):
+            errors.extend(validate_schema(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def repair_json(text: str, schema: Dict) -> Any:
+    """Decode model output as JSON, locally repairing common defects.
+
+    Strips code fences and surrounding prose, replaces smart quotes, removes
+    trailing commas and wraps a bare array into the schema's single array
+    property. Raises ValueError if the text still cannot be decoded.
+    """
+    text = _FENCE_RE.sub("", text.strip()).translate(_SMART_QUOTES)
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise ValueError("no JSON object or array found")
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    candidate = _TRAILING_COMMA_RE.sub(r"\1", text[start:end + 1])
+    try:
+        value = json.loads(candidate)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"invalid JSON: {e}") from e
+
+    array_properties = [key for key, prop in schema.get("properties", {}).items() if prop["type"] == "array"]
+    if isinstance(value, list) and schema["type"] == "object" and len(array_properties) == 1:
+        value = {array_properties[0]: value}
+    return value
+
+
+def parse_structured(text: str, schema: Dict) -> Tuple[Optional[Any], List[str]]:
+    """Decode and validate structured model output; returns the value (or None) and the errors."""
+    try:
+        value = json.loads(text)
+        if not validate_schema(value, schema):
+            return value, []
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = repair_json(text, schema)
+    except ValueError as e:
+        return None, [str(e)]
+    errors = validate_schema(value, schema)
+    return (value, []) if not errors else (None, errors)
+
+
+def run_structured_agent(backend, agent, messages: List[Dict], schema_name: str, schema: Dict,
+                         attempt: int = 0) -> Optional[Any]:
+    """Run an agent in structured-output mode and return its validated JSON value.
+
+    The agent's instructions are sent as the system prompt with a JSON schema
+    response format (Swarm's run loop adds nothing for agents without functions).
+    Output that fails validation is first repaired locally; if that fails, only
+    the malformed output and the validation errors are sent back for a fix, not
+    the whole agent conversation. Returns None if the output cannot be repaired.
+    """
+    response_format = {"type": "json_schema", "json_schema": {"name": schema_name, "schema": schema, "strict": True}}
+    text = chat_completion(
+        backend,
+        model=agent.model,
+        messages=[{"role": "system", "content": agent.instructions}] + messages,
+        response_format=response_format,
+        attempt=attempt,
+    )
+    value, errors = parse_structured(text, schema)
+    if value is not None:
+        return value
+
+    print(f"Structured output of {agent.name} failed validation ({'; '.join(errors)}). Requesting a repair.")
+    repaired = chat_completion(
+        backend,
+        model=agent.model,
+        messages=[{"role": "user", "content": (
+            "Fix the following JSON so that it matches the schema. Return only the corrected JSON.\n"
+            f"Schema:\n{json.dumps(schema)}\nErrors:\n" + "\n".join(errors) + f"\nJSON:\n{text}"
+        )}],
+        response_format=response_format,
+    )
+    value, errors = parse_structured(repaired, schema)
+    if value is None:
+        print(f"Repair of {agent.name} output failed: {'; '.join(errors)}")
+    return value
@@ -0,0 +1,225 @@
+# tracing.py
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from config import TRACE_ENABLED, TRACE_PATH, TOKEN_PRICES
+
+
+class Span:
+    """One timed stage of the pipeline with the LLM usage recorded while it was active."""
+
+    __slots__ = ("name", "span_id", "parent_id", "attributes", "start", "end", "counters")
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional["Span"] = None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+        self.counters = {"llm.calls": 0, "llm.cache_hits": 0, "llm.prompt_tokens": 0,
+                         "llm.completion_tokens": 0, "llm.retries": 0, "llm.cost_usd": 0.0}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the span in the field layout of an OpenTelemetry span."""
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time_unix_nano": int(self.start * 1e9),
+            "end_time_unix_nano": int(self.end * 1e9),
+            "attributes": dict(self.attributes, **self.counters),
+        }
+
+
+class Tracer:
+    """Writes finished spans as JSON lines to a trace file."""
+
+    def __init__(self, path: str = TRACE_PATH, resume: bool = False):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def write(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+_tracer: Optional[Tracer] = None
+_local = threading.local()
+
+
+def start_trace(path: str = TRACE_PATH, resume: bool = False) -> Optional[Tracer]:
+    """Start writing spans to `path` (appending when resuming), unless tracing is disabled."""
+    global _tracer
+    if not TRACE_ENABLED:
+        return None
+    stop_trace()
+    _tracer = Tracer(path, resume)
+    return _tracer
+
+
+def stop_trace():
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+def current_span() -> Optional[Span]:
+    """Return the innermost active span of the calling thread."""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, **attributes) -> Iterator[Optional[Span]]:
+    """Time a stage and record it to the trace.
+
+    The span's parent is the active span of the calling thread, or `parent` for
+    work handed to another thread. Without a started trace this does nothing.
+    """
+    if _tracer is None:
+        yield None
+        return
+    stage = Span(name, attributes, parent if parent is not None else current_span())
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    _local.stack.append(stage)
+    try:
+        yield stage
+    except Exception as e:
+        stage.attributes["error"] = repr(e)
+        raise
+    finally:
+        _local.stack.pop()
+        stage.end = time.time()
+        tracer = _tracer
+        if tracer is not None:
+            tracer.write(stage)
+
+
+def begin_span(name: str, parent: Optional[Span] = None, **attributes) -> Optional[Span]:
+    """Start a span that is ended by end_span, possibly in another thread (e.g. a sample passing through stages).
+
+    Use use_span to make it the parent of the spans of the calling thread.
+    """
+    if _tracer is None:
+        return None
+    return Span(name, attributes, parent if parent is not None else current_span())
+
+
+def end_span(stage: Optional[Span]):
+    if stage is None:
+        return
+    stage.end = time.time()
+    tracer = _tracer
+    if tracer is not None:
+        tracer.write(stage)
+
+
+@contextmanager
+def use_span(stage: Optional[Span]) -> Iterator[Optional[Span]]:
+    """Make a span started by begin_span the active span of the calling thread, without ending it."""
+    if stage is None:
+        yield None
+        return
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    _local.stack.append(stage)
+    try:
+        yield stage
+    finally:
+        _local.stack.pop()
+
+
+def record_llm_call(model: str, prompt_tokens: int, completion_tokens: int, cache_hit: bool):
+    """Add an LLM call to the active span; cache hits are counted but cost nothing."""
+    stage = current_span()
+    if stage is None:
+        return
+    counters = stage.counters
+    counters["llm.calls"] += 1
+    counters["llm.prompt_tokens"] += prompt_tokens
+    counters["llm.completion_tokens"] += completion_tokens
+    if cache_hit:
+        counters["llm.cache_hits"] += 1
+    else:
+        prices = TOKEN_PRICES.get(model, {})
+        counters["llm.cost_usd"] += (prompt_tokens * prices.get("prompt", 0.0)
+                                     + completion_tokens * prices.get("completion", 0.0)) / 1000
+
+
+def record_retry():
+    """Count a retried request against the active span."""
+    stage = current_span()
+    if stage is not None:
+        stage.counters["llm.retries"] += 1
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(path: str = TRACE_PATH) -> Dict[str, Dict[str, float]]:
+    """Aggregate a trace into per-stage latency percentiles, token usage, retries and cost.
+
+    Stages repeated in rounds (verifier, kg_master) are reported per round.
+    """
+    durations: Dict[str, List[float]] = {}
+    totals: Dict[str, Dict[str, float]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            name = entry["name"]
+            if "round" in entry["attributes"]:
+                name += f" r{entry['attributes']['round']}"
+            durations.setdefault(name, []).append((entry["end_time_unix_nano"] - entry["start_time_unix_nano"]) / 1e6)
+            stage_totals = totals.setdefault(name, {})
+            for key, value in entry["attributes"].items():
+                if key.startswith("llm."):
+                    stage_totals[key] = stage_totals.get(key, 0) + value
+
+    summary = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = dict(count=len(values), p50_ms=percentile(values, 50), p95_ms=percentile(values, 95),
+                             p99_ms=percentile(values, 99), total_s=sum(values) / 1000, **totals[name])
+    return summary
+
+
+def print_report(path: str = TRACE_PATH):
+    """Print the per-stage latency and cost report of a trace."""
+    summary = summarize(path)
+    print(f"{'stage':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'total s':>10}"
+          f"{'calls':>7}{'hits':>6}{'retries':>8}{'tokens':>10}{'cost $':>9}")
+    for name, s in sorted(summary.items(), key=lambda item: -item[1]["total_s"]):
+        tokens = s.get("llm.prompt_tokens", 0) + s.get("llm.completion_tokens", 0)
+        print(f"{name:<12}{s['count']:>7}{s['p50_ms']:>10.0f}{s['p95_ms']:>10.0f}{s['p99_ms']:>10.0f}{s['total_s']:>10.1f}"
+              f"{s.get('llm.calls', 0):>7}{s.get('llm.cache_hits', 0):>6}{s.get('llm.retries', 0):>8}"
+              f"{tokens:>10}{s.get('llm.cost_usd', 0):>9.2f}")
+    print(f"Total cost: ${sum(s.get('llm.cost_usd', 0) for s in summary.values()):.2f}")
+
+
+if __name__ == "__main__":
+    print_report(sys.argv[1] if len(sys.argv) > 1 else TRACE_PATH)
@@ -0,0 +1,234 @@
+# translation.py
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from config import (MODEL_NAME, TRANSLATION_SKIP_ENGLISH, TRANSLATION_MEMORY_PATH, TRANSLATION_NEAR_DUPLICATE_THRESHOLD,
+                    TRANSLATION_BATCH_SIZE, TRANSLATION_BATCH_WAIT)
+from llm import chat_completion
+from structured_output import repair_json
+from tracing import span
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+_DIGITS_RE = re.compile(r"\d+")
+_ENGLISH_STOPWORDS = frozenset(
+    "the a an of and or in on at to for with from by is are was were be been has have had it its this that these "
+    "those as not no but which who what how why when where all any can will would should may there their they we "
+    "you he she i our your his her".split())
+
+TRANSLATION_PROMPT = "Translate it into English with as few words as possible.: "
+BATCH_TRANSLATION_PROMPT = (
+    "Translate each of the following texts into English with as few words as possible. "
+    "Return only a JSON array with one translation per text, in the same order.\nTexts:\n"
+)
+
+
+def is_english(text: str) -> bool:
+    """Detect English text locally.
+
+    The text must be written in Latin letters without accents and contain
+    common English function words, which tells English apart from other
+    languages written in Latin script (German, French, pinyin). Short English
+    texts without function words are therefore translated too.
+    """
+    words = _WORD_RE.findall(text)
+    if not words or not all(word.isascii() for word in words):
+        return False
+    stopwords = sum(1 for word in words if word.lower() in _ENGLISH_STOPWORDS)
+    return stopwords / len(words) >= 0.15
+
+
+def normalize_text(text: str) -> str:
+    """Normalize a text for the translation memory (case, whitespace and punctuation insensitive)."""
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+class MinHasher:
+    """MinHash signatures of character 3-gram shingles, with LSH banding for near-duplicate lookup."""
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_hashes: int = 64, bands: int = 16, seed: int = 0):
+        import numpy as np
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, self._PRIME, size=num_hashes, dtype=np.uint64)
+        self.b = rng.integers(0, self._PRIME, size=num_hashes, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_hashes // bands
+
+    def signature(self, text: str) -> "np.ndarray":
+        import numpy as np
+        shingles = {text[i:i + 3] for i in range(max(len(text) - 2, 1))}
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+        # (a * x + b) mod p for every hash function and shingle; x < 2^32 and a < 2^61 may overflow
+        # uint64, which only permutes the values differently and keeps the hash functions consistent
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % np.uint64(self._PRIME)).min(axis=1)
+
+    def band_keys(self, signature: "np.ndarray") -> List[Tuple[int, bytes]]:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    @staticmethod
+    def similarity(first: "np.ndarray", second: "np.ndarray") -> float:
+        """Estimate the Jaccard similarity of the shingle sets of two signatures."""
+        return float((first == second).mean())
+
+
+class TranslationMemory:
+    """Persistent memory of translations, looked up exactly and, with a threshold, by near-duplicate source text.
+
+    A near-duplicate is only reused if it contains the same numbers as the text.
+    """
+
+    def __init__(self, path: str = TRANSLATION_MEMORY_PATH,
+                 near_duplicate_threshold: Optional[float] = TRANSLATION_NEAR_DUPLICATE_THRESHOLD):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.threshold = near_duplicate_threshold
+        self.hasher = MinHasher() if near_duplicate_threshold is not None else None
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translation TEXT NOT NULL)")
+        self.conn.commit()
+        self.exact: Dict[str, str] = dict(self.conn.execute("SELECT key, translation FROM translations"))
+        self.signatures: Dict[str, "np.ndarray"] = {}
+        self.buckets: Dict[Tuple[int, bytes], List[str]] = {}
+        if self.threshold is not None:
+            for key in self.exact:
+                self._index(key)
+
+    def _index(self, key: str):
+        signature = self.hasher.signature(key)
+        self.signatures[key] = signature
+        for band_key in self.hasher.band_keys(signature):
+            self.buckets.setdefault(band_key, []).append(key)
+
+    def lookup(self, text: str) -> Optional[str]:
+        """Return the translation of the same or a near-duplicate text, or None."""
+        key = normalize_text(text)
+        with self.lock:
+            if key in self.exact:
+                return self.exact[key]
+            if self.threshold is None:
+                return None
+            signature = self.hasher.signature(key)
+            numbers = _DIGITS_RE.findall(key)
+            candidates = {candidate for band_key in self.hasher.band_keys(signature)
+                          for candidate in self.buckets.get(band_key, ()) if _DIGITS_RE.findall(candidate) == numbers}
+            best, best_similarity = None, self.threshold
+            for candidate in candidates:
+                similarity = self.hasher.similarity(signature, self.signatures[candidate])
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+            return self.exact[best] if best is not None else None
+
+    def add(self, text: str, translation: str):
+        key = normalize_text(text)
+        with self.lock:
+            if key in self.exact:
+                return
+            self.exact[key] = translation
+            if self.threshold is not None:
+                self._index(key)
+            self.conn.execute("INSERT OR REPLACE INTO translations (key, translation) VALUES (?, ?)", (key, translation))
+            self.conn.commit()
+
+
+class Translator:
+    """Translates texts to English, skipping English input and reusing the translation memory.
+
+    Texts that still need the model are micro-batched: requests arriving within
+    `batch_wait` seconds of each other are translated together in one call of up
+    to `batch_size` texts.
+    """
+
+    def __init__(self, backend, memory: Optional[TranslationMemory] = None, batch_size: int = TRANSLATION_BATCH_SIZE,
+                 batch_wait: float = TRANSLATION_BATCH_WAIT, skip_english: bool = TRANSLATION_SKIP_ENGLISH):
+        self.backend = backend
+        self.memory = memory
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.skip_english = skip_english
+        self.pending: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="translate")
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def translate(self, text: str) -> str:
+        """Return the English translation of a text."""
+        if self.skip_english and is_english(text):
+            return text
+        if self.memory is not None:
+            translation = self.memory.lookup(text)
+            if translation is not None:
+                return translation
+        if self.batch_size <= 1:
+            translation = self._translate_one(text)
+        else:
+            future = Future()
+            self.pending.put((text, future))
+            translation = future.result()
+        if self.memory is not None:
+            self.memory.add(text, translation)
+        return translation
+
+    def _collect(self):
+        """Group pending texts into batches and send each batch from the worker pool."""
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self.executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Tuple[str, Future]]):
+        try:
+            translations = self._translate_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), translation in zip(batch, translations):
+            future.set_result(translation)
+
+    def _translate_one(self, text: str) -> str:
+        return chat_completion(self.backend, model=MODEL_NAME,
+                               messages=[{"role": "user", "content": TRANSLATION_PROMPT + text}])
+
+    def _translate_batch(self, texts: List[str]) -> List[str]:
+        if len(texts) == 1:
+            return [self._translate_one(texts[0])]
+        with span("translate_batch", texts=len(texts)):
+            response = chat_completion(self.backend, model=MODEL_NAME, messages=[
+                {"role": "user", "content": BATCH_TRANSLATION_PROMPT + json.dumps(texts, ensure_ascii=False)}])
+        try:
+            translations = repair_json(response, {"type": "array"})
+        except ValueError:
+            translations = None
+        if (not isinstance(translations, list) or len(translations) != len(texts)
+                or not all(isinstance(translation, str) and translation.strip() for translation in translations)):
+            print(f"Batch translation of {len(texts)} texts returned an invalid response, translating them one by one.")
+            return [self._translate_one(text) for text in texts]
+        return translations
+
+
+_translator: Optional[Translator] = None
+_translator_lock = threading.Lock()
+
+
+def get_translator(backend) -> Translator:
+    """Return the translator of this process for a chat backend, creating it on first use."""
+    global _translator
+    with _translator_lock:
+        if _translator is None or _translator.backend is not backend:
+            memory = TranslationMemory() if TRANSLATION_MEMORY_PATH else None
+            _translator = Translator(backend, memory)
+        return _translator
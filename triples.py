@@ -0,0 +1,173 @@
+# triples.py
+import json
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Union
+
+
+@dataclass(frozen=True)
+class Triple:
+    """A knowledge graph triple (head entity, relation, tail entity)."""
+    # Declared by hand: dataclass(slots=True) needs Python 3.10
+    __slots__ = ("head", "relation", "tail")
+    head: str
+    relation: str
+    tail: str
+
+    def __reduce__(self):
+        # The default pickling of slots would assign the frozen fields
+        return Triple, (self.head, self.relation, self.tail)
+
+    def __iter__(self) -> Iterator[str]:
+        yield self.head
+        yield self.relation
+        yield self.tail
+
+    def __str__(self) -> str:
+        return f"({self.head}, {self.relation}, {self.tail})"
+
+    def to_list(self) -> List[str]:
+        return [self.head, self.relation, self.tail]
+
+
+# Leading list markers such as "1.", "2)", "-", "*" or "•"
+_LIST_MARKER_RE = re.compile(r"^\s*(?:(?:\d+|[a-zA-Z])[.)]|[-*•>+])\s+")
+_SIMPLE_RE = re.compile(r"^\(\s*([^,()\"']+?)\s*,\s*([^,()\"']+?)\s*,\s*([^,()\"']+?)\s*\)[.;,]?$")
+_QUOTED_PARTS_RE = re.compile(r"""^\s*(["'])(.*?)\1\s*,\s*(["'])(.*?)\3\s*,\s*(["'])(.*?)\5\s*$""", re.S)
+_COMMA_RE = re.compile(r"\s*,\s*")
+_ARROW_RE = re.compile(r"\s*(?:-\[(.+?)\]->|--(.+?)-->)\s*")
+_ARROW_SPLIT_RE = re.compile(r"\s*(?:->|→|=>|\|)\s*")
+
+_HEAD_KEYS = ("head", "subject", "entity1", "head entity", "source")
+_RELATION_KEYS = ("relation", "predicate", "relationship", "rel")
+_TAIL_KEYS = ("tail", "object", "entity2", "tail entity", "target")
+
+
+def _clean(part: str) -> str:
+    return part.strip().strip("\"'`").strip()
+
+
+def _make(head: str, relation: str, tail: str) -> Optional[Triple]:
+    head, relation, tail = _clean(head), _clean(relation), _clean(tail)
+    if head and relation and tail:
+        return Triple(head, relation, tail)
+    return None
+
+
+def _split_commas(body: str) -> Optional[Triple]:
+    """Split an unquoted 'Entity1, Relation, Entity2' body, allowing commas inside entities."""
+    parts = _COMMA_RE.split(body)
+    if len(parts) < 3:
+        return None
+    if len(parts) == 3:
+        return _make(*parts)
+    # More than three parts: an entity contains a comma. Relations are usually
+    # lowercase verb phrases, so the relation is the only inner lowercase part;
+    # with none or several the split is ambiguous and the line is left for repair.
+    candidates = [i for i in range(1, len(parts) - 1) if parts[i][:1].islower()]
+    if len(candidates) != 1:
+        return None
+    index = candidates[0]
+    return _make(", ".join(parts[:index]), parts[index], ", ".join(parts[index + 1:]))
+
+
+def _from_json_value(value) -> List[Triple]:
+    """Convert decoded JSON (an object, a list of objects or a list of 3-lists) into triples."""
+    if isinstance(value, dict):
+        for key in ("triples", "triplets", "knowledge_graph"):
+            if isinstance(value.get(key), list):
+                return _from_json_value(value[key])
+        lowered = {str(k).lower(): v for k, v in value.items()}
+        head = next((lowered[k] for k in _HEAD_KEYS if k in lowered), None)
+        relation = next((lowered[k] for k in _RELATION_KEYS if k in lowered), None)
+        tail = next((lowered[k] for k in _TAIL_KEYS if k in lowered), None)
+        if all(isinstance(v, str) for v in (head, relation, tail)):
+            triple = _make(head, relation, tail)
+            return [triple] if triple else []
+        return []
+    if isinstance(value, list):
+        if len(value) == 3 and all(isinstance(v, str) for v in value):
+            triple = _make(*value)
+            return [triple] if triple else []
+        triples = []
+        for item in value:
+            triples.extend(_from_json_value(item))
+        return triples
+    return []
+
+
+def triples_from_json(value) -> List[Triple]:
+    """Convert decoded structured output such as {"triples": [{"head": ..., "relation": ..., "tail": ...}]} into triples."""
+    return _from_json_value(value)
+
+
+def parse_triple(line: str) -> Optional[Triple]:
+    """Parse one line of model output into a Triple, or return None if it holds no triple.
+
+    Accepts '(Entity1, Relation, Entity2)' with any spacing, numbered or bulleted
+    lines, quoted entities containing commas, JSON objects/arrays and arrow
+    formats such as 'Entity1 -> Relation -> Entity2' or 'Entity1 -[Relation]-> Entity2'.
+    """
+    line = _LIST_MARKER_RE.sub("", line.strip())
+    if not line:
+        return None
+
+    # Fast path for the requested '(Entity1, Relation, Entity2)' format
+    simple = _SIMPLE_RE.match(line)
+    if simple:
+        return _make(*simple.groups())
+
+    if line[0] in "{[":
+        try:
+            triples = _from_json_value(json.loads(line.rstrip(",")))
+            return triples[0] if triples else None
+        except json.JSONDecodeError:
+            pass
+
+    arrow = _ARROW_RE.search(line)
+    if arrow:
+        return _make(line[:arrow.start()], arrow.group(1) or arrow.group(2), line[arrow.end():])
+    parts = _ARROW_SPLIT_RE.split(line)
+    if len(parts) == 3:
+        return _make(*parts)
+
+    # Comma-separated triples must be parenthesized or fully quoted, so that
+    # ordinary sentences with two commas are not mistaken for triples
+    start = line.find("(")
+    end = line.rfind(")")
+    body = line[start + 1:end if end > start else len(line)] if start != -1 else line.rstrip(".;,")
+    quoted = _QUOTED_PARTS_RE.match(body)
+    if quoted:
+        return _make(quoted.group(2), quoted.group(4), quoted.group(6))
+    if start == -1:
+        return None
+    return _split_commas(body)
+
+
+def parse_triples(output: Union[str, Iterable[str]]) -> List[Triple]:
+    """Parse model output (a text or its lines) into triples, skipping lines without one.
+
+    A text that is a JSON document as a whole is decoded in one go; otherwise
+    every line is parsed on its own.
+    """
+    if isinstance(output, str):
+        stripped = output.strip()
+        if stripped.startswith("```"):
+            stripped = stripped.strip("`").partition("\n")[2]
+        if stripped[:1] in ("{", "["):
+            try:
+                return _from_json_value(json.loads(stripped))
+            except json.JSONDecodeError:
+                pass
+        lines = output.splitlines()
+    else:
+        lines = output
+
+    triples = []
+    for line in lines:
+        triple = parse_triple(line)
+        if triple is not None:
+            triples.append(triple)
+        elif line.strip():
+            print(f"Invalid triple detected: {line.strip()}. Requesting regeneration.")
+    return triples
@@ -1,11 +1,18 @@
 # utils.py
-import json
+import hashlib
 import os
 import time
-import subprocess
-import sys
-import pandas as pd
-from typing import List, Dict, Tuple, Optional
+from typing import Iterator, List, Dict, Tuple, Optional, Union
+from config import MODEL_NAME, QA_CONCURRENCY
+from llm import chat_completion
+from graphrag_engine import query_graphrag
+from scheduler import bounded_map
+from triples import Triple, parse_triple
+from tracing import span, current_span
+from graph_store import GraphStore
+from translation import get_translator
+from chunking import build_index, supporting_context
+from dedup import dedup_key
 
 def ensure_directory_exists(file_path: str):
     """Ensure the directory for the given file path exists."""
@@ -13,110 +20,127 @@ def ensure_directory_exists(file_path: str):
     if directory and not os.path.exists(directory):
         os.makedirs(directory)
 
-def initialize_output_files(output_xlsx: str, rte_output_json: str, kgc_output_json: str):
-    """Initialize output files with appropriate headers."""
-    ensure_directory_exists(output_xlsx)
-    ensure_directory_exists(rte_output_json)
-    ensure_directory_exists(kgc_output_json)
-
-    if not os.path.exists(output_xlsx):
-        pd.DataFrame(columns=['context', 'triples', 'question', 'answer']).to_excel(output_xlsx, index=False)
-    if not os.path.exists(rte_output_json):
-        with open(rte_output_json, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=4)
-    if not os.path.exists(kgc_output_json):
-        with open(kgc_output_json, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=4)
-
-def append_to_files(sample_index: int, context: str, triple: str, question: str, answer: str,
-                    rte_data: Dict, kgc_data: Dict, output_xlsx: str, rte_output_json: str, kgc_output_json: str):
-    """Append data to output files."""
-    # Append to Excel file
-    df = pd.DataFrame({
-        'context': [context],
-        'triples': [triple],
-        'question': [question],
-        'answer': [answer]
-    })
-    with pd.ExcelWriter(output_xlsx, mode='a', engine='openpyxl', if_sheet_exists='overlay') as writer:
-        df.to_excel(writer, index=False, header=False, startrow=writer.sheets['Sheet1'].max_row)
-
-    # Append to RTE JSON file
-    with open(rte_output_json, 'r+', encoding='utf-8') as f:
-        data = json.load(f)
-        data.append(rte_data)
-        f.seek(0)
-        json.dump(data, f, ensure_ascii=False, indent=4)
-        f.truncate()
-
-    # Append to KGC JSON file
-    with open(kgc_output_json, 'r+', encoding='utf-8') as f:
-        data = json.load(f)
-        data.append(kgc_data)
-        f.seek(0)
-        json.dump(data, f, ensure_ascii=False, indent=4)
-        f.truncate()
-
-
-def run_graphrag_query(query: str, openai_client) -> Tuple[Optional[str], Optional[str]]:
-    """Run a query using GraphRAG and translate it to English."""
+def truncate_torn_line(path: str):
+    """Cut a partially written last line, left behind by a crash, off an append-only JSONL file."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(position - 65536, 0)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            print(f"Removing incomplete last line of {path}")
+            f.truncate(position)
+
+def count_rows(input_file: str) -> int:
+    """Return the number of data rows (without the header) of the first sheet of an Excel file."""
+    from openpyxl import load_workbook
+    workbook = load_workbook(input_file, read_only=True)
     try:
-        # Translate query to English
-        translated_query = openai_client.ChatCompletion.create(
-            model="Model_Name",  # Use the model name from config
-            messages=[
-                {"role": "user", "content": f"Translate it into English with as few words as possible.: {query}"}
-            ]
-        ).choices[0].message.content
+        sheet = workbook.worksheets[0]
+        if sheet.max_row is not None:
+            return max(sheet.max_row - 1, 0)
+        # Workbooks written without a stored dimension have to be counted
+        return sum(1 for _ in sheet.iter_rows(min_row=2, values_only=True))
+    finally:
+        workbook.close()
+
+def iter_contexts(input_file: str) -> Iterator[Tuple[int, Optional[str]]]:
+    """Stream (row index, context) pairs from the 'context' column of an Excel file without loading it."""
+    from openpyxl import load_workbook
+    workbook = load_workbook(input_file, read_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        if 'context' not in header:
+            raise ValueError("Input file must contain a 'context' column.")
+        column = header.index('context')
+        for index, row in enumerate(rows):
+            value = row[column] if column < len(row) else None
+            # Numeric and date cells are read as numbers and datetimes
+            yield index, str(value) if value is not None else None
+    finally:
+        workbook.close()
+
+def translate_query(query: str, openai_client) -> Optional[str]:
+    """Translate a query to English and ask for it to be expanded."""
+    try:
+        # Translate query to English (skipped for English queries and reused for repeated ones)
+        translated_query = get_translator(openai_client).translate(query)
 
         translated_query += "Please analyze, expand and supplement the information of this sentence step by step in English."
+        return translated_query
+    except Exception as e:
+        print(f"An error occurred in translate_query: {e}")
+        return None
+
 
-        # Execute GraphRAG query
-        command = [
-            sys.executable, "-m", "graphrag.query",
-            "--root", "./test",
-            "--method", "Global",
-            translated_query,
-            "--data", "test/output/20250115-130155/artifacts"
-        ]
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode == 0:
-            output = result.stdout.strip()
-            if "SUCCESS: Local Search Response:" in output:
-                return output.split("SUCCESS: Local Search Response:", 1)[1].strip(), translated_query
-            else:
-                return output, translated_query
-        else:
-            error_message = result.stderr.strip()
-            if "failed" in error_message or "parsing" in error_message:
-                print(f"Error: Failed to parse the URL. Please check the URL's validity and your network connection. Error details: {error_message}")
-                return None, None
-            else:
-                raise Exception(f"Command failed with error: {error_message}")
+def search_graphrag(translated_query: str) -> Optional[str]:
+    """Run a translated query against GraphRAG."""
+    try:
+        return query_graphrag(translated_query)
     except Exception as e:
         print(f"An error occurred in run_graphrag_query: {e}")
+        return None
+
+
+def run_graphrag_query(query: str, openai_client) -> Tuple[Optional[str], Optional[str]]:
+    """Run a query using GraphRAG and translate it to English."""
+    translated_query = translate_query(query, openai_client)
+    if translated_query is None:
+        return None, None
+    output = search_graphrag(translated_query)
+    if output is None:
         return None, None
+    return output, translated_query
+
+
+def qa_prompt(head_entity: str, tail_entity: str, context: str) -> str:
+    """Return the prompt asking for the question and answer of a triple."""
+    return (
+        f"According to the context, generate a question and answer. "
+        f"The question should be in the form: 'What is the relationship between {head_entity} and {tail_entity}?' "
+        f"The answer should include the relationship between {head_entity} and {tail_entity} and reference the context. "
+        f"Here is the context:\n{context}"
+    )
+
 
+def qa_generator(context: str) -> str:
+    """Return a hash of the model, the prompt template and the context: stored answers are only reused while they match."""
+    template = qa_prompt("<head entity>", "<tail entity>", "<context>")
+    return hashlib.sha256(f"{MODEL_NAME}\n{template}\n{context}".encode("utf-8")).hexdigest()
 
-def generate_question_and_answer_with_agent(triple: str, context: str, openai_client) -> Tuple[Optional[str], Optional[str], Optional[Dict], Optional[Dict]]:
-    """Generate question and answer based on the knowledge graph triple and context."""
+
+def generate_question_and_answer_with_agent(triple: Union[Triple, str], context: str, openai_client,
+                                            support: Optional[str] = None) -> Tuple[Optional[str], Optional[str], Optional[Dict], Optional[Dict]]:
+    """Generate question and answer based on the knowledge graph triple and context.
+
+    The prompt quotes `support` (the sentences of the context supporting the
+    triple) instead of the whole context when it is given.
+    """
     try:
-        head_entity, relation, tail_entity = triple.strip('()').split(', ')
+        if isinstance(triple, str):
+            triple = parse_triple(triple)
+            if triple is None:
+                raise ValueError("could not parse the triple")
+        head_entity, relation, tail_entity = triple
 
-        prompt = (
-            f"According to the context, generate a question and answer. "
-            f"The question should be in the form: 'What is the relationship between {head_entity} and {tail_entity}?' "
-            f"The answer should include the relationship between {head_entity} and {tail_entity} and reference the context. "
-            f"Here is the context:\n{context}"
-        )
+        prompt = qa_prompt(head_entity, tail_entity, support or context)
 
-        response = openai_client.ChatCompletion.create(
-            model="Model_Name",  # Use the model name from config
+        qa_response = chat_completion(
+            openai_client,
+            model=MODEL_NAME,
             messages=[
                 {"role": "user", "content": prompt}
             ],
         )
-        qa_response = response.choices[0].message.content
         lines = qa_response.split('\n')
         question = lines[0].strip()
         answer = '\n'.join(lines[1:]).strip()
@@ -127,23 +151,61 @@ def generate_question_and_answer_with_agent(triple: str, context: str, openai_cl
         if not answer.startswith("Answer:"):
             answer = "Answer: " + answer
 
-        rte_data = {
-            "entity name": head_entity,
-            "entity type": "industry",
-            "text description": context,
-            "triplet": [{"subject": head_entity, "predicate": relation, "object": tail_entity}]
-        }
-
-        kgc_data = {
-            "head entity name": head_entity,
-            "head entity type": "industry",
-            "tail entity name": tail_entity,
-            "tail entity type": "industry",
-            "relation": relation,
-            "context": context
-        }
-
+        rte_data, kgc_data = build_records(triple, context)
         return question, answer, rte_data, kgc_data
     except Exception as e:
         print(f"An error occurred in generate_question_and_answer_with_agent: {e}")
         return None, None, None, None
+
+
+def build_records(triple: Triple, context: str) -> Tuple[Dict, Dict]:
+    """Build the RTE and KGC records of a triple."""
+    head_entity, relation, tail_entity = triple
+    rte_data = {
+        "entity name": head_entity,
+        "entity type": "industry",
+        "text description": context,
+        "triplet": [{"subject": head_entity, "predicate": relation, "object": tail_entity}]
+    }
+
+    kgc_data = {
+        "head entity name": head_entity,
+        "head entity type": "industry",
+        "tail entity name": tail_entity,
+        "tail entity type": "industry",
+        "relation": relation,
+        "context": context
+    }
+    return rte_data, kgc_data
+
+
+def generate_questions_and_answers(triples: List[Triple], context: str, openai_client,
+                                   max_workers: int = QA_CONCURRENCY, store: Optional[GraphStore] = None) -> List[Tuple[Triple, Optional[str], Optional[str], Optional[Dict], Optional[Dict]]]:
+    """Generate question/answer records for all triples of a sample concurrently.
+
+    With a graph `store`, triples equivalent to one answered before for the same
+    context, model and prompt reuse its question and answer instead of calling
+    the model, and new answers are stored.
+    Near-duplicates share the answers stored for their cluster's representative (see dedup.py).
+    Long contexts are compacted to the supporting sentences of each triple in the prompts.
+    Returns one (triple, question, answer, rte_data, kgc_data) tuple per triple, in the input order.
+    """
+    parent = current_span()
+    index = build_index(context)
+    generator = qa_generator(context) if store is not None else None
+
+    def generate(triple):
+        if store is not None:
+            key = dedup_key(triple)
+            stored = store.get_qa(key, generator)
+            if stored is not None:
+                return (*stored, *build_records(triple, context))
+        with span("qa", parent=parent, triple=str(triple)):
+            support = supporting_context(index, context, [triple]) if index is not None else None
+            result = generate_question_and_answer_with_agent(triple, context, openai_client, support)
+        if store is not None and result[0] is not None and result[1] is not None:
+            store.put_qa(key, generator, result[0], result[1])
+        return result
+
+    results = bounded_map(generate, triples, max_workers)
+    return [(triple, *result) for triple, result in results]
@@ -0,0 +1,78 @@
+# validation.py
+import difflib
+import re
+from typing import Iterable, List, Optional, Set, Tuple
+from config import ENTITY_MATCH_THRESHOLD, MAX_RELATION_WORDS
+from triples import Triple
+
+_WORD_RE = re.compile(r"\w+")
+_BRACKET_RE = re.compile(r"[()\[\]{}]")
+
+
+def _tokens(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def normalize(text: str) -> str:
+    """Lowercase a text and collapse it to its word tokens."""
+    return " ".join(_tokens(text))
+
+
+def is_grounded(entity: str, context_tokens: Set[str], normalized_context: str,
+                threshold: float = ENTITY_MATCH_THRESHOLD) -> bool:
+    """Check whether an entity appears in the context, exactly or approximately.
+
+    An entity is grounded if its normalized form occurs in the normalized context,
+    or if at least `threshold` of its words match a context word closely (which
+    tolerates plurals, casing and small spelling differences).
+    """
+    normalized_entity = normalize(entity)
+    if not normalized_entity:
+        return False
+    if normalized_entity in normalized_context:
+        return True
+    words = normalized_entity.split()
+    matched = sum(1 for word in words
+                  if word in context_tokens or difflib.get_close_matches(word, context_tokens, n=1, cutoff=0.8))
+    return matched / len(words) >= threshold
+
+
+def check_triple(triple: Triple, context_tokens: Set[str], normalized_context: str) -> Optional[str]:
+    """Return the reason a triple is invalid, or None if it passes all local checks."""
+    head, relation, tail = triple
+    if not head.strip() or not relation.strip() or not tail.strip():
+        return "empty entity or relation"
+    if any(_BRACKET_RE.search(part) for part in triple):
+        return "stray brackets in entity or relation"
+    if len(relation.split()) > MAX_RELATION_WORDS:
+        return f"relation is longer than {MAX_RELATION_WORDS} words"
+    if normalize(head) == normalize(tail):
+        return "head and tail entity are the same"
+    if normalize(relation) in (normalize(head), normalize(tail)):
+        return "relation repeats an entity"
+    for entity in (head, tail):
+        if not is_grounded(entity, context_tokens, normalized_context):
+            return f"entity '{entity}' does not appear in the original input"
+    return None
+
+
+def validate_triples(triples: Iterable[Triple], context: str) -> Tuple[List[Triple], List[Tuple[Triple, str]]]:
+    """Run the deterministic local checks on a list of triples.
+
+    Returns the valid triples (deduplicated on their normalized form, in order)
+    and the failed triples together with the reason they failed.
+    """
+    normalized_context = normalize(context)
+    context_tokens = set(normalized_context.split())
+    valid, failed, seen = [], [], set()
+    for triple in triples:
+        key = tuple(normalize(part) for part in triple)
+        if key in seen:
+            continue
+        seen.add(key)
+        reason = check_triple(triple, context_tokens, normalized_context)
+        if reason is None:
+            valid.append(triple)
+        else:
+            failed.append((triple, reason))
+    return valid, failed
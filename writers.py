@@ -0,0 +1,226 @@
+# writers.py
+import glob
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterator, List
+from config import OUTPUT_BACKEND, WRITE_BATCH_SIZE, DATASET_FORMAT, COLUMNAR_OUTPUT
+from utils import ensure_directory_exists, truncate_torn_line
+
+
+class RecordWriter:
+    """Append-only record writer that buffers records and flushes them in fsync'd batches."""
+
+    def __init__(self, path: str, batch_size: int = WRITE_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer: List[Dict] = []
+
+    def append(self, record: Dict):
+        """Buffer one record, flushing when the batch is full."""
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered records to disk."""
+        if self.buffer:
+            self._write_batch(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+
+    def _write_batch(self, records: List[Dict]):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JsonlRecordWriter(RecordWriter):
+    """Writes records as JSON lines appended to a single file."""
+
+    def __init__(self, path: str, batch_size: int = WRITE_BATCH_SIZE):
+        super().__init__(path, batch_size)
+        ensure_directory_exists(path)
+        # Otherwise the first record appended after a crash would be glued onto the torn line
+        truncate_torn_line(path)
+
+    def _write_batch(self, records: List[Dict]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ParquetRecordWriter(RecordWriter):
+    """Writes each batch as a new Parquet part file inside a directory (requires pyarrow)."""
+
+    def __init__(self, path: str, batch_size: int = WRITE_BATCH_SIZE):
+        super().__init__(path, batch_size)
+        import pyarrow  # Fail early if the optional dependency is missing
+        os.makedirs(path, exist_ok=True)
+        self.part = len(glob.glob(os.path.join(path, 'part-*.parquet')))
+
+    def _write_batch(self, records: List[Dict]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist([_flatten(record) for record in records])
+        part_path = os.path.join(self.path, f"part-{self.part:06d}.parquet")
+        tmp_path = part_path + '.tmp'
+        pq.write_table(table, tmp_path)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, part_path)
+        self.part += 1
+
+
+def _flatten(record: Dict) -> Dict:
+    """Store nested values as JSON strings so every Parquet part shares one flat schema."""
+    return {key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+            for key, value in record.items()}
+
+
+def create_writer(path: str, backend: str = OUTPUT_BACKEND, batch_size: int = WRITE_BATCH_SIZE) -> RecordWriter:
+    """Create a record writer for the configured backend ("jsonl" or "parquet")."""
+    if backend == "jsonl":
+        return JsonlRecordWriter(path, batch_size)
+    if backend == "parquet":
+        return ParquetRecordWriter(path, batch_size)
+    raise ValueError(f"Unsupported output backend: {backend}")
+
+
+def clear_records(path: str):
+    """Delete a record log: a JSONL file or a Parquet part directory."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    """Iterate over the records written by a JSONL file or a Parquet part directory."""
+    if not os.path.exists(path):
+        return
+    if os.path.isdir(path):
+        import pyarrow.parquet as pq
+        for part_path in sorted(glob.glob(os.path.join(path, 'part-*.parquet'))):
+            for record in pq.read_table(part_path).to_pylist():
+                yield {key: json.loads(value) if key in ('rte', 'kgc') else value for key, value in record.items()}
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partially written last line behind
+                print(f"Skipping incomplete record in {path}")
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Incrementally decode the items of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, pos, eof = '', 0, False
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def skip(chars):
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                fill()
+
+        skip(' \t\r\n\ufeff')
+        if pos >= len(buffer) or buffer[pos] != '[':
+            raise ValueError(f"{path} is not a JSON array.")
+        pos += 1
+        while True:
+            skip(' \t\r\n,')
+            if pos >= len(buffer):
+                raise ValueError(f"Unexpected end of JSON array in {path}.")
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # Only accept an item followed by a delimiter: a scalar cut off at the end
+            # of a chunk (e.g. "3." of "3.25") is decoded again with more data
+            after = end
+            while after < len(buffer) and buffer[after] in ' \t\r\n':
+                after += 1
+            if after == len(buffer) or buffer[after] not in ',]':
+                if eof:
+                    raise ValueError(f"Malformed JSON array in {path}.")
+                fill()
+                continue
+            pos = end
+            yield item
+
+
+def iter_json_records(path: str) -> Iterator[Any]:
+    """Iterate over the records of a JSON array file or, for .jsonl files, of a JSON lines file."""
+    if path.endswith('.jsonl'):
+        yield from read_records(path)
+    else:
+        yield from iter_json_array(path)
+
+
+def write_json_array(records: Iterator[Dict], path: str):
+    """Stream records into a JSON array formatted like json.dump(..., indent=4)."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        first = True
+        for record in records:
+            item = json.dumps(record, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+            f.write(('\n    ' if first else ',\n    ') + item)
+            first = False
+        f.write('\n]' if not first else ']')
+
+
+def read_unique_records(path: str) -> Iterator[Dict]:
+    """Iterate over the records of a log, skipping repeated (sample_index, triple) pairs.
+
+    Repeats appear when a sample is reprocessed after an interrupted run.
+    """
+    seen = set()
+    for record in read_records(path):
+        key = (record['sample_index'], record['triple'])
+        if key not in seen:
+            seen.add(key)
+            yield record
+
+
+def finalize_outputs(records_path: str, output_xlsx: str, rte_output_json: str, kgc_output_json: str,
+                     dataset_format: str = DATASET_FORMAT, columnar_output: str = COLUMNAR_OUTPUT):
+    """Build the XLSX output and the RTE/KGC JSON files (or the columnar dataset) from the record log in one pass each."""
+    import pandas as pd
+    for path in (output_xlsx, rte_output_json, kgc_output_json):
+        ensure_directory_exists(path)
+
+    rows = [(r['context'], r['triple'], r['question'], r['answer']) for r in read_unique_records(records_path)]
+    pd.DataFrame(rows, columns=['context', 'triples', 'question', 'answer']).to_excel(output_xlsx, index=False)
+    if dataset_format == "columnar":
+        from columnar import write_columnar
+        write_columnar(read_unique_records(records_path), columnar_output)
+        print(f"Wrote {len(rows)} records to {output_xlsx} and {columnar_output}")
+        return
+    write_json_array((r['rte'] for r in read_unique_records(records_path)), rte_output_json)
+    write_json_array((r['kgc'] for r in read_unique_records(records_path)), kgc_output_json)
+    print(f"Wrote {len(rows)} records to {output_xlsx}, {rte_output_json} and {kgc_output_json}")